@@ -1,48 +1,41 @@
-import requests
-import json
+import asyncio
+import sys
 import uuid
-import time
+
+from relay_client import RelayClient, RelayError
 
 BASE_URL = "https://synai.shop"
+BUYER_ID = "BOSS_AGENT_001"
 
-def post_task():
-    print("🚀 [BOSS] Initializing new task...")
-    
-    # 1. Post the Job
-    job_payload = {
-        "title": "Text Summarization Task",
-        "description": "Please summarize this sentence into 3 words: 'The artificial intelligence system demonstrated remarkable efficiency in processing complex datasets.'",
-        "terms": {
-            "price": 1.0
-        },
-        "buyer_id": "BOSS_AGENT_001",
-        "envelope_json": {
-            "payload": {
-                "verification_regex": "^[\\w\\s]{1,50}$",
-                "entrypoint": "summarizer.v1"
-            }
+TASK = {
+    "title": "Text Summarization Task",
+    "description": "Please summarize this sentence into 3 words: 'The artificial intelligence system demonstrated remarkable efficiency in processing complex datasets.'",
+    "price": 1.0,
+    "envelope_json": {
+        "payload": {
+            "verification_regex": "^[\\w\\s]{1,50}$",
+            "entrypoint": "summarizer.v1"
         }
     }
-    
-    response = requests.post(f"{BASE_URL}/jobs", json=job_payload)
-    if response.status_code == 201:
-        task_id = response.json()["task_id"]
-        print(f"✅ [BOSS] Job posted successfully. Task ID: {task_id}")
-        
-        # 2. Fund the Job (Simulate Escrow)
-        print(f"💰 [BOSS] Funding task {task_id}...")
-        funding_payload = {
-            "escrow_tx_hash": f"0x{uuid.uuid4().hex}"
-        }
-        fund_resp = requests.post(f"{BASE_URL}/jobs/{task_id}/fund", json=funding_payload)
-        
-        if fund_resp.status_code == 200:
-            print(f"💎 [BOSS] Task {task_id} is now FUNDED and ready for agents.")
-            print(f"🔗 View Task: {BASE_URL}/share/job/{task_id}")
+}
+
+async def post_tasks(count):
+    print(f"🚀 [BOSS] Initializing {count} new task(s)...")
+
+    async with RelayClient(BASE_URL) as relay:
+        # Post and fund (simulated escrow) every task concurrently
+        results = await relay.post_and_fund_many(BUYER_ID, [
+            dict(TASK, escrow_tx_hash=f"0x{uuid.uuid4().hex}") for _ in range(count)
+        ])
+
+    for result in results:
+        if isinstance(result, RelayError):
+            print(f"❌ [BOSS] Failed to post or fund job: {result}")
+        elif isinstance(result, Exception):
+            print(f"⚠️ [BOSS] Error: {result}")
         else:
-            print(f"❌ [BOSS] Funding failed: {fund_resp.text}")
-    else:
-        print(f"❌ [BOSS] Failed to post job: {response.text}")
+            print(f"💎 [BOSS] Task {result} is now FUNDED and ready for agents.")
+            print(f"🔗 View Task: {BASE_URL}/share/job/{result}")
 
 if __name__ == "__main__":
-    post_task()
+    asyncio.run(post_tasks(int(sys.argv[1]) if len(sys.argv) > 1 else 1))
@@ -1,51 +1,56 @@
-import requests
-import json
+import asyncio
 import time
 
+from relay_client import RelayClient
+
 BASE_URL = "https://synai.shop"
 BUYER_ID = "BOSS_AGENT_001"
 
-def confirm_tasks():
-    print(f"🧐 [BOSS] Boss {BUYER_ID} checking for submitted tasks...")
-    
+async def next_round(relay, cursor):
+    """Waits for submitted jobs of ours. Returns (jobs, cursor)."""
+    if cursor is None:
+        # Take a feed position first so nothing submitted during the listing is missed
+        cursor = await relay.feed_cursor()
+        jobs, _ = await relay.list_jobs(status="submitted", buyer_id=BUYER_ID)
+        jobs = [j for j in jobs if j.get("claimed_by")]
+        if jobs:
+            return jobs, cursor
+
     while True:
-        try:
-            resp = requests.get(f"{BASE_URL}/jobs")
-            if resp.status_code == 200:
-                jobs = resp.json()
-                submitted_jobs = [j for j in jobs if j["status"] == "submitted" and j.get("claimed_by")]
-                
-                if not submitted_jobs:
-                    print("💤 [BOSS] No tasks awaiting verification. Retrying in 5s...")
-                    time.sleep(5)
-                    continue
-                
+        print("💤 [BOSS] No tasks awaiting verification. Waiting on feed...")
+        events, cursor, resync = await relay.wait_for(cursor, status="submitted", buyer_id=BUYER_ID)
+        if resync:
+            return await next_round(relay, None)
+        if events:
+            return events, cursor
+
+async def confirm_tasks():
+    print(f"🧐 [BOSS] Boss {BUYER_ID} checking for submitted tasks...")
+    cursor = None
+
+    async with RelayClient(BASE_URL) as relay:
+        while True:
+            try:
+                submitted_jobs, cursor = await next_round(relay, cursor)
                 for job in submitted_jobs:
-                    task_id = job["task_id"]
-                    print(f"👀 [BOSS] Verifying Task {task_id} submitted by {job['claimed_by']}...")
-                    
-                    # In a real scenario, we'd check the quality here.
-                    # For this test, we auto-approve.
-                    confirm_payload = {
-                        "buyer_id": BUYER_ID,
-                        "signature": f"SIG_CONFIRM_{task_id}_{int(time.time())}"
-                    }
-                    
-                    conf_resp = requests.post(f"{BASE_URL}/jobs/{task_id}/confirm", json=confirm_payload)
-                    
-                    if conf_resp.status_code == 200:
-                        data = conf_resp.json()
-                        print(f"✅ [BOSS] Task {task_id} CONFIRMED. Payout: {data['payout']} USDC, Fee: {data['fee']} USDC.")
-                        print(f"📖 Ledger updated for {job['claimed_by']}.")
+                    print(f"👀 [BOSS] Verifying Task {job['task_id']} submitted by {job['claimed_by']}...")
+
+                # In a real scenario, we'd check the quality here.
+                # For this test, we auto-approve the whole round in one settlement call.
+                results = await relay.confirm_batch(BUYER_ID, {
+                    job["task_id"]: f"SIG_CONFIRM_{job['task_id']}_{int(time.time())}" for job in submitted_jobs
+                })
+                for item in results:
+                    if item["status"] == "success":
+                        print(f"✅ [BOSS] Task {item['task_id']} CONFIRMED. Payout: {item['payout']} USDC, Fee: {item['fee']} USDC.")
                     else:
-                        print(f"❌ [BOSS] Confirmation failed: {conf_resp.text}")
-                
+                        print(f"❌ [BOSS] Confirmation of {item['task_id']} failed: {item['error']}")
+
                 break # Exit after one round of confirmation for this demo
-            else:
-                print(f"❌ [BOSS] Failed to list jobs: {resp.text}")
-        except Exception as e:
-            print(f"⚠️ [BOSS] Error: {e}")
-            time.sleep(5)
+            except Exception as e:
+                print(f"⚠️ [BOSS] Error: {e}")
+                cursor = None
+                await asyncio.sleep(5)
 
 if __name__ == "__main__":
-    confirm_tasks()
+    asyncio.run(confirm_tasks())
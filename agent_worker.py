@@ -1,59 +1,50 @@
-import requests
-import time
-import json
+import asyncio
+import sys
+
+from relay_client import RelayClient
 
 BASE_URL = "https://synai.shop"
 AGENT_ID = "WORKER_AGENT_X"
+CAPABILITIES = ["summarizer.v1"]  # envelope entrypoints this worker can run
+
+async def solve_task(relay, agent_id):
+    print(f"🤖 [WORKER] Agent {agent_id} online. Capabilities: {', '.join(CAPABILITIES)}")
 
-def solve_task():
-    print(f"🤖 [WORKER] Agent {AGENT_ID} online. Polling for tasks...")
-    
     while True:
         try:
-            # 1. List Jobs
-            resp = requests.get(f"{BASE_URL}/jobs")
-            if resp.status_code == 200:
-                jobs = resp.json()
-                funded_jobs = [j for j in jobs if j["status"] == "funded"]
-                
-                if not funded_jobs:
-                    print("💤 [WORKER] No funded tasks found. Retrying in 5s...")
-                    time.sleep(5)
+            await relay.set_capabilities(agent_id, CAPABILITIES)
+            cursor = await relay.feed_cursor()
+            while True:
+                # 1. Ask the relay for the best funded job we can run (claimed for us)
+                target_job = await relay.next_job(agent_id)
+                if target_job is None:
+                    # Nothing matches yet: sleep on the feed until something is funded
+                    _, cursor, _ = await relay.wait_for(cursor, status="funded")
                     continue
-                
-                target_job = funded_jobs[0]
                 task_id = target_job["task_id"]
-                print(f"🎯 [WORKER] Found funded task: {target_job['title']} (ID: {task_id})")
-                
-                # 2. Claim Job
-                print(f"✍️ [WORKER] Claiming task {task_id}...")
-                claim_resp = requests.post(f"{BASE_URL}/jobs/{task_id}/claim", json={"agent_id": AGENT_ID})
-                
-                if claim_resp.status_code == 200:
-                    print(f"✅ [WORKER] Task claimed. Solving...")
-                    
-                    # 3. Submit Result (Simulated Processing)
-                    time.sleep(3)
+                print(f"✅ [WORKER] {agent_id} claimed {task_id} ({target_job['entrypoint']}). Solving...")
+
+                # 2. Submit Result (Simulated Processing), holding the claim lease meanwhile
+                lease = asyncio.create_task(relay.keep_lease(task_id, agent_id))
+                try:
+                    await asyncio.sleep(3)
                     result = "AI Processing Efficiency" # 3 words as requested
-                    
-                    print(f"📤 [WORKER] Submitting result: '{result}'")
-                    submit_resp = requests.post(f"{BASE_URL}/jobs/{task_id}/submit", json={
-                        "agent_id": AGENT_ID,
-                        "result": result
-                    })
-                    
-                    if submit_resp.status_code == 200:
-                        print(f"🏁 [WORKER] Result submitted. Awaiting BOSS verification.")
-                        break # Exit loop for this demo
-                    else:
-                        print(f"❌ [WORKER] Submission failed: {submit_resp.text}")
-                else:
-                    print(f"❌ [WORKER] Claim failed: {claim_resp.text}")
-            else:
-                print(f"❌ [WORKER] Failed to list jobs: {resp.text}")
+                finally:
+                    lease.cancel()
+
+                print(f"📤 [WORKER] {agent_id} submitting result: '{result}'")
+                await relay.submit_result(task_id, agent_id, result)
+                print(f"🏁 [WORKER] Result submitted. Awaiting BOSS verification.")
+                return # Exit for this demo
         except Exception as e:
-            print(f"⚠️ [WORKER] Error: {e}")
-            time.sleep(5)
+            print(f"⚠️ [WORKER] {agent_id} error: {e}")
+            await asyncio.sleep(5)
+
+async def main(agents):
+    # Every agent shares one pooled client; run many with `python agent_worker.py 100`
+    agent_ids = [AGENT_ID] if agents == 1 else [f"{AGENT_ID}_{i}" for i in range(agents)]
+    async with RelayClient(BASE_URL) as relay:
+        await asyncio.gather(*(solve_task(relay, agent_id) for agent_id in agent_ids))
 
 if __name__ == "__main__":
-    solve_task()
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 1))
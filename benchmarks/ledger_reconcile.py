@@ -0,0 +1,98 @@
+"""
+Ledger reconciliation benchmark.
+
+Seeds a synthetic history (see lifecycle.seed; about 1.6 ledger entries per
+job) and times the audit passes against it in-process:
+
+    full          every chain verified from its first entry (first run, audit(full=True))
+    no-op         incremental pass with nothing settled since the last one
+    incremental   incremental pass after new settlements for --touched agents
+
+    python benchmarks/ledger_reconcile.py --dataset 100k
+    python benchmarks/ledger_reconcile.py --dataset 1m --touched 500
+    python benchmarks/ledger_reconcile.py --db postgres --postgres-url postgresql://localhost/synai_bench
+"""
+import argparse
+import datetime
+import json
+import os
+import random
+import tempfile
+import uuid
+from decimal import Decimal
+
+from lifecycle import DATASETS, seed
+
+
+def settle_more(db, Agent, LedgerEntry, agent_ids, per_agent, chain_entries, ledger_amount):
+    """Appends `per_agent` chained payouts to each agent's chain, as settlement would."""
+    rng = random.Random(7)
+    now = datetime.datetime.utcnow()
+    heads = dict(db.session.query(Agent.agent_id, Agent.ledger_head).filter(Agent.agent_id.in_(agent_ids)))
+    entries, payouts = [], {}
+    for agent_id in agent_ids:
+        for _ in range(per_agent):
+            amount = ledger_amount(Decimal(rng.randint(100, 10000)) / 100)
+            entries.append(dict(source_id='platform', target_id=agent_id, amount=amount,
+                                transaction_type='task_payout', task_id=str(uuid.uuid4()),
+                                chain_id=agent_id, created_at=now))
+            payouts[agent_id] = payouts.get(agent_id, Decimal(0)) + amount
+    chain_entries(entries, heads)
+    db.session.execute(db.insert(LedgerEntry), entries)
+    for agent_id, amount in payouts.items():
+        db.session.execute(db.update(Agent).where(Agent.agent_id == agent_id)
+                           .values(balance=Agent.balance + amount, ledger_head=heads[agent_id]))
+    db.session.commit()
+    return len(entries)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Relay ledger audit timings")
+    parser.add_argument("--dataset", choices=DATASETS, default="100k")
+    parser.add_argument("--db", choices=("sqlite", "postgres"), default="sqlite")
+    parser.add_argument("--postgres-url", default=os.getenv("BENCH_POSTGRES_URL"))
+    parser.add_argument("--touched", type=int, default=100, help="agents settled between passes")
+    parser.add_argument("--per-agent", type=int, default=5, help="new entries per touched agent")
+    parser.add_argument("--json", help="write results to this file")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        if args.db == "postgres":
+            if not args.postgres_url:
+                parser.error("--postgres-url (or BENCH_POSTGRES_URL) is required with --db postgres")
+            database_url = args.postgres_url
+        else:
+            database_url = f"sqlite:///{os.path.join(tmp, 'bench.db')}"
+        seed(database_url, DATASETS[args.dataset])
+
+        from server import create_app
+        from models import db, Agent, LedgerEntry
+        from ledger_audit import ledger_auditor, chain_entries, ledger_amount
+
+        app = create_app()
+        results = {}
+        with app.app_context():
+            total = db.session.query(db.func.count(LedgerEntry.entry_id)).scalar()
+            print(f"[Bench] {total} ledger entries")
+            results["full"] = ledger_auditor.audit(full=True)
+            results["no-op"] = ledger_auditor.audit()
+
+            agent_ids = [a for (a,) in db.session.query(Agent.agent_id)
+                         .filter(Agent.ledger_head.isnot(None)).order_by(Agent.agent_id).limit(args.touched)]
+            settle_more(db, Agent, LedgerEntry, agent_ids, args.per_agent, chain_entries, ledger_amount)
+            results["incremental"] = ledger_auditor.audit()
+            report = ledger_auditor.report()
+            db.session.remove()
+
+    print(f"\n{'pass':<12} {'agents':>8} {'entries':>9} {'ms':>9}")
+    for name, r in results.items():
+        print(f"{name:<12} {r['agents_checked']:>8} {r['entries_verified']:>9} {r['duration_ms']:>9}")
+    print(f"\nAgents per status: {report['agents']}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(dict(results, entries=total, agents=report["agents"]), f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,370 @@
+"""
+End-to-end job lifecycle load test.
+
+Seeds a synthetic dataset, boots the relay under gunicorn against it, and
+drives concurrent post -> fund -> claim -> submit -> confirm flows shaped
+like agent_boss.py / agent_worker.py / agent_boss_confirm.py, while reader
+threads poll the listing, ranking and job endpoints the way agents and
+dashboards do. Reports throughput and p50/p95/p99 latency per endpoint and
+saves the run as JSON so runs can be compared.
+
+All load comes from 127.0.0.1, so the relay's rate limiter is switched
+off for the run (pass --rate-limit to keep it). Any 429s are counted per
+endpoint and kept out of the latency figures.
+
+    python benchmarks/lifecycle.py --dataset 10k
+    python benchmarks/lifecycle.py --dataset 100k --flows 2000 --concurrency 32
+    python benchmarks/lifecycle.py --db postgres --postgres-url postgresql://localhost/synai_bench
+    python benchmarks/lifecycle.py --dataset 10k --compare results/previous.json
+
+The Postgres target is wiped (all relay tables dropped) before seeding, so
+point it at a scratch database.
+"""
+import argparse
+import datetime
+import json
+import os
+import random
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+
+import requests
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+DATASETS = {'10k': 10_000, '100k': 100_000, '1m': 1_000_000}
+SEED_CHUNK = 5000
+STATUS_MIX = (('completed', 0.80), ('funded', 0.05), ('posted', 0.05), ('claimed', 0.05), ('submitted', 0.05))
+
+
+def seed(database_url, jobs):
+    """Creates the schema and bulk-loads a consistent synthetic history."""
+    os.environ['DATABASE_URL'] = database_url
+    from config import Config
+    Config.SQLALCHEMY_DATABASE_URI = database_url
+    from server import create_app
+    from migrations import upgrade
+    from models import db, Owner, Agent, Job, LedgerEntry
+    from stats_rollup import stats_rollup
+    from ledger_audit import chain_entries, ledger_amount
+
+    app = create_app()
+    with app.app_context():
+        db.drop_all()
+        db.session.commit()
+    upgrade(app)
+
+    rng = random.Random(42)
+    n_agents = max(10, jobs // 20)
+    n_owners = max(2, n_agents // 5)
+    now = datetime.datetime.utcnow()
+    statuses = [s for s, _ in STATUS_MIX]
+    weights = [w for _, w in STATUS_MIX]
+
+    with app.app_context():
+        owner_ids = [f"owner_bench_{i}" for i in range(n_owners)]
+        agent_owner = {f"agent_bench_{i}": (owner_ids[i % n_owners] if i % 3 else None) for i in range(n_agents)}
+        balances = defaultdict(Decimal)
+        owner_totals = defaultdict(Decimal)
+        heads = {}
+
+        print(f"[Bench] Seeding {jobs} jobs, {n_agents} agents, {n_owners} owners...")
+        started = time.perf_counter()
+        job_rows, ledger_rows = [], []
+        agent_ids = list(agent_owner)
+
+        def flush():
+            # Agents are inserted up front; jobs before the ledger rows that reference them
+            if job_rows:
+                db.session.execute(db.insert(Job), job_rows)
+                job_rows.clear()
+            if ledger_rows:
+                chain_entries(ledger_rows, heads)
+                db.session.execute(db.insert(LedgerEntry), ledger_rows)
+                ledger_rows.clear()
+            db.session.commit()
+
+        db.session.execute(db.insert(Owner), [
+            dict(owner_id=o, username=o, twitter_handle=o, total_profit=0) for o in owner_ids
+        ])
+        db.session.execute(db.insert(Agent), [
+            dict(agent_id=a, owner_id=o, name=f"Agent_{a[-6:]}", balance=0, is_ghost=False,
+                 wallet_address="0x" + uuid.UUID(int=rng.getrandbits(128)).hex[:40].ljust(40, "0"))
+            for a, o in agent_owner.items()
+        ])
+        db.session.commit()
+
+        for i in range(jobs):
+            status = rng.choices(statuses, weights)[0]
+            task_id = str(uuid.UUID(int=rng.getrandbits(128)))
+            price = Decimal(rng.randint(100, 10000)) / 100
+            created_at = now - datetime.timedelta(seconds=rng.randint(0, 90 * 86400))
+            agent_id = rng.choice(agent_ids) if status in ('claimed', 'submitted', 'completed') else None
+            job_rows.append(dict(
+                task_id=task_id, title=f"Bench task {i}", description="Synthetic benchmark task",
+                price=price, buyer_id=f"buyer_bench_{i % 50}", claimed_by=agent_id, status=status,
+                escrow_tx_hash="0xbench" if status != 'posted' else None,
+                envelope_json={"payload": {"verification_regex": "^ok$", "entrypoint": "bench.v1"}},
+                result_data={"diff": "..."} if status in ('submitted', 'completed') else None,
+                created_at=created_at, updated_at=created_at,
+            ))
+            if status == 'completed':
+                payout, fee = ledger_amount(price * Decimal('0.80')), ledger_amount(price * Decimal('0.20'))
+                balances[agent_id] += payout
+                if agent_owner[agent_id]:
+                    owner_totals[agent_owner[agent_id]] += payout
+                ledger_rows.append(dict(source_id='platform', target_id=agent_id, amount=payout,
+                                        transaction_type='task_payout', task_id=task_id,
+                                        chain_id=agent_id, created_at=created_at))
+                ledger_rows.append(dict(source_id='platform', target_id='platform_admin', amount=fee,
+                                        transaction_type='platform_fee', task_id=task_id,
+                                        chain_id=agent_id, created_at=created_at))
+            if len(job_rows) >= SEED_CHUNK:
+                flush()
+        flush()
+
+        db.session.execute(db.update(Agent), [dict(agent_id=a, balance=b, ledger_head=heads[a])
+                                              for a, b in balances.items()])
+        db.session.execute(db.update(Owner), [dict(owner_id=o, total_profit=t) for o, t in owner_totals.items()])
+        db.session.commit()
+        stats_rollup.rebuild()
+        print(f"[Bench] Seeded in {time.perf_counter() - started:.1f}s")
+
+
+class Recorder:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.samples = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.throttled = defaultdict(int)
+
+    def call(self, session, label, method, url, **kwargs):
+        start = time.perf_counter()
+        try:
+            resp = session.request(method, url, timeout=60, **kwargs)
+            ok = resp.status_code < 500
+        except requests.RequestException:
+            resp, ok = None, False
+        elapsed = time.perf_counter() - start
+        with self._lock:
+            if resp is not None and resp.status_code == 429:
+                # The limiter's answer, not the endpoint's latency
+                self.throttled[label] += 1
+                return resp
+            self.samples[label].append(elapsed)
+            if not ok:
+                self.errors[label] += 1
+        return resp
+
+
+def run_flow(base, recorder, session, n):
+    buyer_id = f"buyer_load_{n % 20}"
+    agent_id = f"agent_load_{n % 200}"
+    resp = recorder.call(session, "POST /jobs", "POST", f"{base}/jobs", json={
+        "title": f"Load task {n}",
+        "description": "Summarize into 3 words",
+        "terms": {"price": 1.0 + n % 10},
+        "buyer_id": buyer_id,
+        "envelope_json": {"payload": {"verification_regex": "^[\\w\\s]{1,50}$", "entrypoint": "summarizer.v1"}}
+    })
+    if resp is None or resp.status_code != 201:
+        return False
+    task_id = resp.json()["task_id"]
+    steps = (
+        ("POST /jobs/<id>/fund", f"{base}/jobs/{task_id}/fund", {"escrow_tx_hash": f"0x{uuid.uuid4().hex}"}),
+        ("POST /jobs/<id>/claim", f"{base}/jobs/{task_id}/claim", {"agent_id": agent_id}),
+        ("POST /jobs/<id>/submit", f"{base}/jobs/{task_id}/submit", {"agent_id": agent_id, "result": "AI Processing Efficiency"}),
+        ("POST /jobs/<id>/confirm", f"{base}/jobs/{task_id}/confirm", {"buyer_id": buyer_id, "signature": f"SIG_{task_id}"}),
+    )
+    for label, url, body in steps:
+        resp = recorder.call(session, label, "POST", url, json=body)
+        if resp is None or resp.status_code != 200:
+            return False
+    return True
+
+
+def run_reader(base, recorder, stop, interval):
+    session = requests.Session()
+    reads = (
+        ("GET /jobs?status=funded", f"{base}/jobs", {"status": "funded", "limit": 10}),
+        ("GET /jobs?order=desc", f"{base}/jobs", {"order": "desc", "limit": 50}),
+        ("GET /ledger/ranking", f"{base}/ledger/ranking", None),
+    )
+    while not stop.is_set():
+        for label, url, params in reads:
+            recorder.call(session, label, "GET", url, params=params)
+        stop.wait(interval)
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def summarize(recorder, duration):
+    endpoints = {}
+    for label in sorted(set(recorder.samples) | set(recorder.throttled)):
+        count = len(recorder.samples.get(label, ()))
+        values = recorder.samples.get(label) or [0.0]
+        endpoints[label] = {
+            "count": count,
+            "errors": recorder.errors.get(label, 0),
+            "throttled": recorder.throttled.get(label, 0),
+            "rps": round(count / duration, 1),
+            "p50_ms": round(percentile(values, 50) * 1000, 2),
+            "p95_ms": round(percentile(values, 95) * 1000, 2),
+            "p99_ms": round(percentile(values, 99) * 1000, 2),
+            "mean_ms": round(statistics.mean(values) * 1000, 2),
+        }
+    return endpoints
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_server(database_url, port, workers, threads, tree=REPO_ROOT, env=None):
+    # Load generators share one IP, so per-caller rate limits would throttle
+    # the run itself; `env` can turn them back on
+    server_env = dict(os.environ, DATABASE_URL=database_url, LOG_LEVEL="WARNING", RATE_LIMIT_ENABLED="0")
+    server_env.update(env or {})
+    proc = subprocess.Popen([
+        sys.executable, "-m", "gunicorn", "--bind", f"127.0.0.1:{port}",
+        "--worker-class", "gthread", "--threads", str(threads), "--workers", str(workers),
+        "server:create_app()"
+    ], cwd=tree, env=server_env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    base = f"http://127.0.0.1:{port}"
+    for _ in range(100):
+        try:
+            if requests.get(f"{base}/health", timeout=1).status_code == 200:
+                return proc, base
+        except requests.RequestException:
+            pass
+        time.sleep(0.2)
+    proc.terminate()
+    raise RuntimeError("relay did not come up")
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(current, previous_path):
+    with open(previous_path) as f:
+        previous = json.load(f)
+    print(f"\nCompared with {previous_path} ({previous.get('revision')}):")
+    print(f"{'endpoint':<28} {'p95 before':>11} {'p95 now':>9} {'change':>8}")
+    for label, now in current["endpoints"].items():
+        before = previous.get("endpoints", {}).get(label)
+        if not before:
+            continue
+        change = (now["p95_ms"] - before["p95_ms"]) / before["p95_ms"] * 100 if before["p95_ms"] else 0.0
+        print(f"{label:<28} {before['p95_ms']:>11} {now['p95_ms']:>9} {change:>+7.1f}%")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Relay job lifecycle load test")
+    parser.add_argument("--db", choices=("sqlite", "postgres"), default="sqlite")
+    parser.add_argument("--postgres-url", help="scratch Postgres database (will be wiped)")
+    parser.add_argument("--dataset", choices=sorted(DATASETS), default="10k")
+    parser.add_argument("--flows", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--readers", type=int, default=4)
+    parser.add_argument("--read-interval", type=float, default=0.5)
+    parser.add_argument("--workers", type=int, default=2, help="gunicorn workers")
+    parser.add_argument("--threads", type=int, default=32, help="gunicorn threads per worker")
+    parser.add_argument("--rate-limit", action="store_true", help="keep the relay's rate limiter on")
+    parser.add_argument("--output", help="results JSON path (default benchmarks/results/<timestamp>.json)")
+    parser.add_argument("--compare", help="previous results JSON to compare p95 against")
+    args = parser.parse_args()
+
+    tmp = tempfile.TemporaryDirectory()
+    if args.db == "postgres":
+        if not args.postgres_url:
+            parser.error("--postgres-url is required with --db postgres")
+        database_url = args.postgres_url
+    else:
+        database_url = f"sqlite:///{os.path.join(tmp.name, 'bench.db')}"
+
+    seed(database_url, DATASETS[args.dataset])
+    proc, base = start_server(database_url, free_port(), args.workers, args.threads,
+                              env={"RATE_LIMIT_ENABLED": "1"} if args.rate_limit else None)
+    recorder = Recorder()
+    stop = threading.Event()
+    readers = [threading.Thread(target=run_reader, args=(base, recorder, stop, args.read_interval), daemon=True)
+               for _ in range(args.readers)]
+    try:
+        for t in readers:
+            t.start()
+        local = threading.local()
+
+        def flow(n):
+            if not hasattr(local, "session"):
+                local.session = requests.Session()
+            return run_flow(base, recorder, local.session, n)
+
+        print(f"[Bench] Driving {args.flows} flows at concurrency {args.concurrency}...")
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+            completed = sum(pool.map(flow, range(args.flows)))
+        duration = time.perf_counter() - started
+    finally:
+        stop.set()
+        for t in readers:
+            t.join()
+        proc.terminate()
+        proc.wait()
+        tmp.cleanup()
+
+    results = {
+        "revision": git_revision(),
+        "timestamp": datetime.datetime.utcnow().isoformat(),
+        "db": args.db,
+        "dataset": args.dataset,
+        "flows": args.flows,
+        "concurrency": args.concurrency,
+        "readers": args.readers,
+        "workers": args.workers,
+        "duration_s": round(duration, 2),
+        "flows_completed": completed,
+        "flows_per_s": round(completed / duration, 2),
+        "endpoints": summarize(recorder, duration),
+    }
+
+    print(f"\n{completed}/{args.flows} flows in {duration:.1f}s ({results['flows_per_s']} flows/s)")
+    print(f"{'endpoint':<28} {'count':>7} {'err':>5} {'429':>5} {'rps':>7} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+    for label, e in results["endpoints"].items():
+        print(f"{label:<28} {e['count']:>7} {e['errors']:>5} {e['throttled']:>5} {e['rps']:>7} "
+              f"{e['p50_ms']:>8} {e['p95_ms']:>8} {e['p99_ms']:>8}")
+
+    output = args.output or os.path.join(
+        REPO_ROOT, "benchmarks", "results", f"{args.db}-{args.dataset}-{results['timestamp'][:19].replace(':', '')}.json"
+    )
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"\nSaved {output}")
+
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+"""
+Worker boot-time benchmark.
+
+Measures what every gunicorn worker pays before it can answer: importing
+`server`, building the app, and serving its first request. Each run is a
+fresh interpreter against an already-migrated SQLite database.
+
+    python benchmarks/startup.py                  # current tree
+    python benchmarks/startup.py --ref baseline   # also measure a git ref, side by side
+
+Older revisions that build `server.app` at import time are supported, so a
+ref from before the app factory gives the "before" numbers.
+"""
+import argparse
+import io
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tarfile
+import tempfile
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+BOOT_SNIPPET = r'''
+import json, time
+t0 = time.perf_counter()
+import server
+app = server.create_app() if hasattr(server, "create_app") else server.app
+t1 = time.perf_counter()
+resp = app.test_client().get("/health")
+t2 = time.perf_counter()
+print(json.dumps({"boot": t1 - t0, "first_request": t2 - t1, "status": resp.status_code}))
+'''
+
+MIGRATE_SNIPPET = r'''
+import server
+from migrations import upgrade
+upgrade(server.create_app())
+'''
+
+
+def _run(tree, db_path, snippet):
+    env = dict(os.environ, DATABASE_URL=f"sqlite:///{db_path}")
+    out = subprocess.run(
+        [sys.executable, "-c", snippet], cwd=tree, env=env,
+        capture_output=True, text=True, check=True
+    ).stdout
+    return out.strip().splitlines()[-1] if out.strip() else ""
+
+
+def measure(tree, runs):
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "bench.db")
+        # Untimed: bring the schema up so every timed run sees a migrated DB
+        if os.path.exists(os.path.join(tree, "migrations.py")):
+            _run(tree, db_path, MIGRATE_SNIPPET)
+        else:
+            _run(tree, db_path, BOOT_SNIPPET)
+
+        samples = [json.loads(_run(tree, db_path, BOOT_SNIPPET)) for _ in range(runs)]
+
+    result = {}
+    for key in ("boot", "first_request"):
+        values = [s[key] * 1000 for s in samples]
+        result[key] = {
+            "median_ms": round(statistics.median(values), 1),
+            "min_ms": round(min(values), 1),
+            "max_ms": round(max(values), 1),
+        }
+    return result
+
+
+def export_ref(ref, dest):
+    archive = subprocess.run(["git", "archive", ref], cwd=REPO_ROOT, capture_output=True, check=True).stdout
+    with tarfile.open(fileobj=io.BytesIO(archive)) as tar:
+        tar.extractall(dest)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure relay worker boot time")
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--ref", help="git ref to measure alongside the working tree")
+    parser.add_argument("--json", help="write results to this file")
+    args = parser.parse_args()
+
+    results = {"current": measure(REPO_ROOT, args.runs)}
+    if args.ref:
+        with tempfile.TemporaryDirectory() as tree:
+            export_ref(args.ref, tree)
+            results[args.ref] = measure(tree, args.runs)
+
+    print(f"{'tree':<20} {'boot (ms)':>24} {'first request (ms)':>24}")
+    for name, r in results.items():
+        boot, first = r["boot"], r["first_request"]
+        print(f"{name:<20} {boot['median_ms']:>10} [{boot['min_ms']}-{boot['max_ms']}]"
+              f" {first['median_ms']:>10} [{first['min_ms']}-{first['max_ms']}]")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
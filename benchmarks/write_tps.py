@@ -0,0 +1,151 @@
+"""
+SQLite write-throughput benchmark.
+
+Boots the relay under gunicorn on a fresh SQLite file and has concurrent
+clients run the write half of the job lifecycle (post -> fund -> claim ->
+submit) back to back for a fixed time. Reports successful writes per
+second, failed writes ("database is locked" and the like) and write
+latency for each configuration, side by side:
+
+    group-commit   the working tree as configured by default (WAL + group commit)
+    wal            the working tree with GROUP_COMMIT=0 (WAL, one commit per request)
+    <ref>          a git ref, e.g. the revision before the SQLite mode, for "before" numbers
+
+    python benchmarks/write_tps.py
+    python benchmarks/write_tps.py --ref HEAD~1 --workers 4 --clients 64
+    python benchmarks/write_tps.py --ref HEAD~1 --json write_tps.json
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import requests
+
+from lifecycle import REPO_ROOT, free_port, percentile, start_server
+from startup import export_ref
+
+MIGRATE_SNIPPET = r'''
+import server
+from migrations import upgrade
+upgrade(server.create_app())
+'''
+
+CONFIGURATIONS = (
+    ("group-commit", {}),
+    ("wal", {"GROUP_COMMIT": "0"}),
+)
+
+
+class Tally:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies = []
+        self.failed = 0
+
+    def record(self, elapsed, ok):
+        with self._lock:
+            self.latencies.append(elapsed)
+            if not ok:
+                self.failed += 1
+
+
+def run_client(base, n, deadline, tally):
+    session = requests.Session()
+    agent_id = f"agent_tps_{n}"
+    i = 0
+
+    def write(path, body, expected):
+        start = time.perf_counter()
+        try:
+            resp = session.post(f"{base}{path}", json=body, timeout=60)
+            ok = resp.status_code == expected
+        except requests.RequestException:
+            resp, ok = None, False
+        tally.record(time.perf_counter() - start, ok)
+        return resp if ok else None
+
+    while time.monotonic() < deadline:
+        i += 1
+        resp = write("/jobs", {"title": f"TPS task {n}-{i}", "terms": {"price": 1.0},
+                               "buyer_id": f"buyer_tps_{n}", "envelope_json": {}}, 201)
+        if resp is None:
+            continue
+        task_id = resp.json()["task_id"]
+        if write(f"/jobs/{task_id}/fund", {"escrow_tx_hash": "0xtps"}, 200) is None:
+            continue
+        if write(f"/jobs/{task_id}/claim", {"agent_id": agent_id}, 200) is None:
+            continue
+        write(f"/jobs/{task_id}/submit", {"agent_id": agent_id, "result": "ok"}, 200)
+
+
+def measure(tree, env, args):
+    with tempfile.TemporaryDirectory() as tmp:
+        database_url = f"sqlite:///{os.path.join(tmp, 'bench.db')}"
+        subprocess.run([sys.executable, "-c", MIGRATE_SNIPPET], cwd=tree, check=True,
+                       env=dict(os.environ, DATABASE_URL=database_url, **env), capture_output=True)
+        proc, base = start_server(database_url, free_port(), args.workers, args.threads, tree=tree, env=env)
+        try:
+            # Untimed: first requests start each worker's background services
+            for _ in range(args.workers * 2):
+                requests.get(f"{base}/health", timeout=10)
+            tally = Tally()
+            deadline = time.monotonic() + args.duration
+            clients = [threading.Thread(target=run_client, args=(base, n, deadline, tally))
+                       for n in range(args.clients)]
+            started = time.perf_counter()
+            for t in clients:
+                t.start()
+            for t in clients:
+                t.join()
+            duration = time.perf_counter() - started
+        finally:
+            proc.terminate()
+            proc.wait()
+
+    latencies = tally.latencies or [0.0]
+    ok = len(tally.latencies) - tally.failed
+    return {
+        "writes": ok,
+        "failed": tally.failed,
+        "writes_per_s": round(ok / duration, 1),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 1),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Relay SQLite write throughput")
+    parser.add_argument("--duration", type=float, default=20.0, help="seconds per configuration")
+    parser.add_argument("--clients", type=int, default=32, help="concurrent client threads")
+    parser.add_argument("--workers", type=int, default=4, help="gunicorn workers")
+    parser.add_argument("--threads", type=int, default=16, help="gunicorn threads per worker")
+    parser.add_argument("--ref", help="git ref to measure alongside the working tree")
+    parser.add_argument("--json", help="write results to this file")
+    args = parser.parse_args()
+
+    results = {}
+    with tempfile.TemporaryDirectory() as ref_tree:
+        runs = [(name, REPO_ROOT, env) for name, env in CONFIGURATIONS]
+        if args.ref:
+            export_ref(args.ref, ref_tree)
+            runs.append((args.ref, ref_tree, {}))
+        for name, tree, env in runs:
+            print(f"[Bench] {name}: {args.clients} clients for {args.duration:.0f}s...")
+            results[name] = measure(tree, env, args)
+
+    print(f"\n{'configuration':<16} {'writes/s':>9} {'writes':>8} {'failed':>7} {'p50 ms':>8} {'p99 ms':>8}")
+    for name, r in results.items():
+        print(f"{name:<16} {r['writes_per_s']:>9} {r['writes']:>8} {r['failed']:>7} {r['p50_ms']:>8} {r['p99_ms']:>8}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+import hashlib
+import json
+import os
+import re
+import tempfile
+
+BLOB_REF_KEY = '$blob'
+DIGEST_PATTERN = re.compile(r'[0-9a-f]{64}')
+STREAM_CHUNK_BYTES = 64 * 1024
+
+
+class FilesystemBlobBackend:
+    """Blobs as files under `root`, fanned out by the first hex pairs of the digest."""
+
+    def __init__(self, root):
+        self.root = root
+
+    def _path(self, digest):
+        # Digests end up in a filesystem path: anything but a SHA-256 hex
+        # string could walk out of `root`
+        if not isinstance(digest, str) or not DIGEST_PATTERN.fullmatch(digest):
+            raise ValueError(f"Invalid blob digest: {digest!r}")
+        return os.path.join(self.root, digest[:2], digest[2:4], digest)
+
+    def exists(self, digest):
+        return os.path.exists(self._path(digest))
+
+    def put(self, digest, data):
+        path = self._path(digest)
+        if os.path.exists(path):
+            return
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write-then-rename so a reader never sees a partial blob; racing
+        # writers of the same digest write identical bytes
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path))
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp, path)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+
+    def open(self, digest):
+        return open(self._path(digest), 'rb')
+
+
+BACKENDS = {
+    'filesystem': lambda app: FilesystemBlobBackend(app.config['BLOB_STORE_PATH']),
+}
+
+
+def register_backend(name, factory):
+    """Adds a backend (e.g. object storage) selectable with BLOB_BACKEND. `factory(app)` builds it."""
+    BACKENDS[name] = factory
+
+
+class BlobStore:
+    """
+    Content-addressed storage for large job payloads.
+
+    `offload` keeps small JSON values inline and moves anything whose
+    encoding reaches BLOB_INLINE_MAX_BYTES into the backend, keyed by its
+    SHA-256, returning a small reference ({"$blob": digest, "size": n}) to
+    store in the row instead. Identical payloads share one blob. `load`
+    resolves a reference back to the value; `stream` yields the stored
+    JSON bytes without parsing them.
+
+    Client values are never trusted as references: one that carries a
+    top-level "$blob" key is offloaded whatever its size, so every stored
+    dict with that key is a reference written here.
+
+    Blobs are written before the row that references them commits, so a
+    rolled-back write can leave an unreferenced blob behind, never a
+    dangling reference.
+    """
+
+    def __init__(self, inline_max_bytes=64 * 1024):
+        self.inline_max_bytes = inline_max_bytes
+        self.backend = None
+
+    def init_app(self, app):
+        self.inline_max_bytes = app.config.get('BLOB_INLINE_MAX_BYTES', self.inline_max_bytes)
+        self.backend = BACKENDS[app.config.get('BLOB_BACKEND', 'filesystem')](app)
+
+    @staticmethod
+    def is_ref(value):
+        return (isinstance(value, dict) and isinstance(value.get(BLOB_REF_KEY), str)
+                and DIGEST_PATTERN.fullmatch(value[BLOB_REF_KEY]) is not None)
+
+    def offload(self, value):
+        if value is None:
+            return None
+        # Canonical encoding, so equal payloads hash to the same blob
+        data = json.dumps(value, sort_keys=True, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+        if len(data) < self.inline_max_bytes and not (isinstance(value, dict) and BLOB_REF_KEY in value):
+            return value
+        digest = hashlib.sha256(data).hexdigest()
+        self.backend.put(digest, data)
+        return {BLOB_REF_KEY: digest, "size": len(data)}
+
+    def load(self, value):
+        if not self.is_ref(value):
+            return value
+        with self.backend.open(value[BLOB_REF_KEY]) as f:
+            return json.load(f)
+
+    def stream(self, value):
+        with self.backend.open(value[BLOB_REF_KEY]) as f:
+            while True:
+                chunk = f.read(STREAM_CHUNK_BYTES)
+                if not chunk:
+                    return
+                yield chunk
+
+
+# Singleton instance
+blob_store = BlobStore()
@@ -0,0 +1,89 @@
+import gzip
+import zlib
+
+from flask import request
+
+try:
+    import brotli
+except ImportError:  # optional: gzip only
+    brotli = None
+
+COMPRESSIBLE_MIMETYPES = frozenset({
+    'application/json', 'application/x-ndjson', 'text/html', 'text/plain', 'text/markdown',
+    'text/css', 'application/javascript',
+})
+
+
+class Compression:
+    """
+    Negotiated response compression (br when the brotli package is
+    installed, else gzip).
+
+    Buffered responses are compressed once they reach COMPRESS_MIN_BYTES;
+    smaller bodies cost more to compress than they save on the wire.
+    Streamed responses (NDJSON exports) are gzipped chunk by chunk, so they
+    stay streamed. A compressed response's ETag is downgraded to weak, since
+    its bytes differ from the identity encoding while the content is the same.
+    """
+
+    def __init__(self, min_bytes=1024, level=6):
+        self.min_bytes = min_bytes
+        self.level = level
+
+    def init_app(self, app):
+        self.min_bytes = app.config.get('COMPRESS_MIN_BYTES', self.min_bytes)
+        self.level = app.config.get('COMPRESS_LEVEL', self.level)
+        app.after_request(self._after_request)
+
+    def _choose(self, streamed):
+        accepted = request.accept_encodings
+        if brotli is not None and not streamed and accepted['br']:
+            return 'br'
+        if accepted['gzip']:
+            return 'gzip'
+        return None
+
+    def _after_request(self, response):
+        if (response.status_code != 200
+                or response.direct_passthrough
+                or response.mimetype not in COMPRESSIBLE_MIMETYPES
+                or 'Content-Encoding' in response.headers):
+            return response
+        streamed = response.is_streamed
+        if not streamed and response.calculate_content_length() < self.min_bytes:
+            return response
+        encoding = self._choose(streamed)
+        response.vary.add('Accept-Encoding')
+        if encoding is None:
+            return response
+
+        if streamed:
+            response.response = self._gzip_stream(response.response)
+            response.headers.pop('Content-Length', None)
+        else:
+            body = response.get_data()
+            if encoding == 'br':
+                response.set_data(brotli.compress(body, quality=min(self.level, 11)))
+            else:
+                response.set_data(gzip.compress(body, compresslevel=self.level, mtime=0))
+        response.headers['Content-Encoding'] = encoding
+
+        etag, weak = response.get_etag()
+        if etag and not weak:
+            response.set_etag(etag, weak=True)
+        return response
+
+    def _gzip_stream(self, chunks):
+        compressor = zlib.compressobj(self.level, zlib.DEFLATED, 31)
+        for chunk in chunks:
+            if isinstance(chunk, str):
+                chunk = chunk.encode('utf-8')
+            # Sync-flush per chunk so each piece reaches the client as it is produced
+            data = compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+            if data:
+                yield data
+        yield compressor.flush()
+
+
+# Singleton instance
+compression = Compression()
@@ -0,0 +1,198 @@
+import datetime
+import logging
+import threading
+import time
+
+from job_feed import prune_job_events
+from leaderboard import leaderboard
+from models import db, Job, JobEvent, JobEventState
+from stats_rollup import stats_rollup
+
+logger = logging.getLogger('relay')
+
+
+def _job_entry(j):
+    return {
+        "task_id": str(j.task_id),
+        "title": j.title,
+        "price": j.price,
+        "status": j.status,
+        "claimed_by": j.claimed_by,
+        "created_at": j.created_at
+    }
+
+
+def encode_cursor(event_id, ranking_version):
+    return f"{event_id}.{ranking_version}"
+
+
+def decode_cursor(cursor):
+    """Returns (event_id, ranking_version); raises ValueError on a malformed cursor."""
+    event_id, ranking_version = cursor.split('.')
+    return int(event_id), int(ranking_version)
+
+
+class DashboardState:
+    """
+    Delta sync for the dashboard.
+
+    The change log is the `job_events` table, which every job transition
+    appends to; rankings are versioned by `leaderboard_state`. A cursor
+    names a position in both, so a poll whose cursor is current costs a
+    min/max over the event key plus a version lookup and returns an
+    empty delta. Otherwise the jobs
+    touched since the cursor are re-read (deduplicated, current state only)
+    and rankings/stats are attached only if they may have moved. A cursor
+    that has fallen out of retention, or one too far behind to be worth
+    replaying, gets a full snapshot flagged `reset`. Returned cursors stop
+    below event ids that may still commit (see `_settled_through`), so a
+    transition committing late is never skipped, at the cost of re-sending
+    the few jobs touched after it.
+
+    A background thread keeps the newest `retention` events and prunes the
+    rest. Every worker runs one, but only the worker that moves
+    `job_event_state.pruned_at` past the interval prunes, so the log is
+    pruned once per interval however many workers there are.
+    """
+
+    def __init__(self, job_limit=50, max_delta_events=1000, retention=100000, prune_interval=300.0,
+                 gap_seconds=60.0):
+        self.job_limit = job_limit
+        self.gap_seconds = gap_seconds
+        self.max_delta_events = max_delta_events
+        self.retention = retention
+        self.prune_interval = prune_interval
+        self._app = None
+        self._thread = None
+        self._start_lock = threading.Lock()
+
+    def init_app(self, app):
+        self._app = app
+        self.retention = app.config.get('DASHBOARD_EVENT_RETENTION', self.retention)
+        self.gap_seconds = app.config.get('JOB_EVENT_GAP_SECONDS', self.gap_seconds)
+
+    def ensure_started(self):
+        if self._thread is not None:
+            return
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="job-event-pruner", daemon=True)
+                self._thread.start()
+
+    def delta(self, since=None):
+        floor, head = db.session.query(db.func.min(JobEvent.event_id), db.func.max(JobEvent.event_id)).one()
+        floor, head = floor or 0, head or 0
+        ranking_version, agent_ranking, owner_ranking = leaderboard.versioned_snapshot()
+        state = {
+            "cursor": encode_cursor(head, ranking_version),
+            "reset": False,
+            "jobs": [],
+            "ranking": None,
+            "stats": None,
+        }
+
+        if since is not None:
+            since_event, since_version = since
+            # Fell out of retention, or from before a reset of the log
+            stale = since_event < floor - 1 or since_event > head
+            if not stale:
+                rows = self._events_after(since_event, head).limit(self.max_delta_events + 1).all()
+                if len(rows) <= self.max_delta_events:
+                    state["cursor"] = encode_cursor(self._settled_through(since_event, rows), ranking_version)
+                    task_ids = {row.task_id for row in rows}
+                    if task_ids:
+                        state["jobs"] = [_job_entry(j) for j in self._job_query()
+                                         .filter(Job.task_id.in_(task_ids))
+                                         .order_by(Job.created_at.desc(), Job.task_id.desc())
+                                         .limit(self.job_limit)]
+                    if since_version != ranking_version:
+                        state["ranking"] = {"agent_ranking": agent_ranking, "owner_ranking": owner_ranking}
+                    if task_ids or state["ranking"]:
+                        state["stats"] = self._stats()
+                    return state
+
+        state["reset"] = True
+        # The snapshot covers everything committed; the next delta starts
+        # below any recent event id that has yet to commit
+        start = max(head - self.max_delta_events, floor - 1, 0)
+        state["cursor"] = encode_cursor(
+            self._settled_through(start, self._events_after(start, head).all()), ranking_version)
+        state["jobs"] = [_job_entry(j) for j in self._job_query()
+                         .order_by(Job.created_at.desc(), Job.task_id.desc())
+                         .limit(self.job_limit)]
+        state["ranking"] = {"agent_ranking": agent_ranking, "owner_ranking": owner_ranking}
+        state["stats"] = self._stats()
+        return state
+
+    @staticmethod
+    def _events_after(event_id, head):
+        return db.session.query(JobEvent.event_id, JobEvent.task_id, JobEvent.created_at) \
+            .filter(JobEvent.event_id > event_id, JobEvent.event_id <= head) \
+            .order_by(JobEvent.event_id.asc())
+
+    def _settled_through(self, after, rows):
+        """
+        The event id a cursor can safely move to over `rows` (the events
+        after `after`, in order). Ids commit out of order on Postgres: one
+        missing just below an event written in the last `gap_seconds` may
+        still commit, so the cursor stops short of it and the next delta
+        re-reads from there. Older holes are rolled-back ids.
+        """
+        recent = datetime.datetime.utcnow() - datetime.timedelta(seconds=self.gap_seconds)
+        expected = after + 1
+        for row in rows:
+            if row.event_id > expected and row.created_at and row.created_at >= recent:
+                break
+            expected = row.event_id + 1
+        return expected - 1
+
+    @staticmethod
+    def _job_query():
+        return db.session.query(Job.task_id, Job.title, Job.price, Job.status, Job.claimed_by, Job.created_at)
+
+    @staticmethod
+    def _stats():
+        totals = stats_rollup.totals()
+        return {
+            "total_agents": int(totals['total_agents']),
+            "total_bounty_volume": totals['bounty_volume'],
+            "active_tasks": int(totals['jobs_total']) - totals['jobs_by_status']['completed'],
+            "platform_revenue": totals['platform_revenue']
+        }
+
+    def prune(self):
+        """Prunes if no worker has within `prune_interval`. Returns rows deleted."""
+        with self._app.app_context():
+            try:
+                if not self._claim_prune():
+                    db.session.rollback()
+                    return 0
+                # The claim commits with the delete: a failed prune leaves it to the next worker
+                return prune_job_events(self.retention)
+            finally:
+                db.session.remove()
+
+    def _claim_prune(self):
+        now = datetime.datetime.utcnow()
+        due = now - datetime.timedelta(seconds=self.prune_interval)
+        return db.session.execute(
+            db.update(JobEventState)
+            .where(JobEventState.id == 1,
+                   db.or_(JobEventState.pruned_at.is_(None), JobEventState.pruned_at <= due))
+            .values(pruned_at=now)
+            .execution_options(synchronize_session=False)
+        ).rowcount == 1
+
+    def _run(self):
+        while True:
+            try:
+                deleted = self.prune()
+                if deleted:
+                    logger.info("Pruned %d job events past retention", deleted)
+            except Exception:
+                logger.exception("Job event pruning failed")
+            time.sleep(self.prune_interval)
+
+
+# Singleton instance
+dashboard_state = DashboardState()
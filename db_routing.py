@@ -0,0 +1,105 @@
+import threading
+import time
+import zlib
+
+import sqlalchemy as sa
+from flask import current_app, g, has_app_context, request
+from flask_sqlalchemy.session import Session
+
+from rate_limit import caller_identity, client_ip, rate_limiter
+
+READ_METHODS = frozenset({'GET', 'HEAD', 'OPTIONS'})
+RYW_COOKIE = 'relay_ryw'
+
+
+class RoutingSession(Session):
+    """
+    Sends the statements of a replica-routed request (see DatabaseRouter) to
+    its replica. Flushes and INSERT/UPDATE/DELETE always go to the primary,
+    so a write slipping into a read-only view cannot land on a replica, and
+    mark the request as a writer. A context that sets `g.db_engine` (the
+    group-commit writer) sends everything to that engine.
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and has_app_context():
+            pinned = g.get('db_engine')
+            if pinned is not None:
+                return pinned
+            if self._flushing or isinstance(clause, sa.UpdateBase):
+                g.db_wrote = True
+            else:
+                engine = g.get('db_read_engine')
+                if engine is not None:
+                    return engine
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+class DatabaseRouter:
+    """
+    Read/write split across the primary and DATABASE_REPLICA_URLS.
+
+    Views marked `@db_router.replica_reads` read from a replica; everything
+    else, including background work, uses the primary. Each caller (see
+    `caller_identity`) sticks to one replica, so its reads never move
+    backwards in time by hopping between replicas with different lag.
+
+    Read-your-writes: a request that wrote marks its caller and client IP
+    as recent writers for REPLICA_READ_YOUR_WRITES_SECONDS, and their reads
+    go to the primary meanwhile. The mark is kept in this worker and in a
+    short-lived cookie, so it also holds when the next request lands on
+    another worker (for clients that keep cookies, as requests.Session and
+    httpx clients do).
+    """
+
+    def __init__(self, window=5.0, max_tracked=100000):
+        self.window = window
+        self.max_tracked = max_tracked
+        self.replicas = []
+        self._recent_writers = {}
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.window = app.config.get('REPLICA_READ_YOUR_WRITES_SECONDS', self.window)
+        self.replicas = sorted(key for key in app.config.get('SQLALCHEMY_BINDS', {}) if key.startswith('replica_'))
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+
+    @staticmethod
+    def replica_reads(view):
+        """Marks a view as read-only, to be served from a replica."""
+        view.replica_reads = True
+        return view
+
+    def _callers(self):
+        return caller_identity(rate_limiter.trusted_proxies), f"ip={client_ip(rate_limiter.trusted_proxies)}"
+
+    def _before_request(self):
+        if not self.replicas or request.method not in READ_METHODS or RYW_COOKIE in request.cookies:
+            return
+        view = current_app.view_functions.get(request.endpoint)
+        if not getattr(view, 'replica_reads', False):
+            return
+        callers = self._callers()
+        now = time.monotonic()
+        with self._lock:
+            if any(self._recent_writers.get(caller, 0) > now for caller in callers):
+                return
+        replica = self.replicas[zlib.crc32(callers[0].encode('utf-8')) % len(self.replicas)]
+        g.db_read_engine = current_app.extensions['sqlalchemy'].engines[replica]
+
+    def _after_request(self, response):
+        if not self.replicas or not g.get('db_wrote') or response.status_code >= 400:
+            return response
+        now = time.monotonic()
+        with self._lock:
+            if len(self._recent_writers) >= self.max_tracked:
+                self._recent_writers = {k: v for k, v in self._recent_writers.items() if v > now}
+            for caller in self._callers():
+                self._recent_writers[caller] = now + self.window
+        response.set_cookie(RYW_COOKIE, '1', max_age=max(1, round(self.window)), httponly=True, samesite='Lax')
+        return response
+
+
+# Singleton instance
+db_router = DatabaseRouter()
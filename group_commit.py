@@ -0,0 +1,178 @@
+import logging
+import queue
+import threading
+from concurrent.futures import Future
+
+from flask import g
+from sqlalchemy import create_engine, event
+
+from models import db
+
+logger = logging.getLogger('relay')
+
+JOURNAL_MODES = ('DELETE', 'TRUNCATE', 'PERSIST', 'MEMORY', 'WAL', 'OFF')
+SYNCHRONOUS_MODES = ('OFF', 'NORMAL', 'FULL', 'EXTRA')
+
+
+def tune_sqlite(engine, journal_mode='WAL', busy_timeout_ms=10000, synchronous='FULL'):
+    """Applies the SQLite pragmas to every connection the engine opens."""
+    if journal_mode.upper() not in JOURNAL_MODES or synchronous.upper() not in SYNCHRONOUS_MODES:
+        raise ValueError(f"Unsupported SQLite journal_mode/synchronous: {journal_mode}/{synchronous}")
+
+    @event.listens_for(engine, 'connect')
+    def _pragmas(dbapi_conn, record):
+        cursor = dbapi_conn.cursor()
+        # WAL lets readers run alongside the writer; the busy timeout makes a
+        # writer wait for the lock instead of failing with "database is locked"
+        cursor.execute(f"PRAGMA journal_mode={journal_mode}")
+        cursor.execute(f"PRAGMA busy_timeout={int(busy_timeout_ms)}")
+        cursor.execute(f"PRAGMA synchronous={synchronous}")
+        cursor.close()
+
+
+class GroupCommitter:
+    """
+    Single-writer group commit for the SQLite deployment mode.
+
+    On SQLite every commit takes the database-wide write lock and pays an
+    fsync, so concurrent lifecycle requests mostly wait on each other. With
+    group commit each worker process funnels those mutations through one
+    writer thread instead: it takes whatever requests are queued (up to
+    `max_batch`), runs each one in a SAVEPOINT of a single BEGIN IMMEDIATE
+    transaction, and commits them together, so N requests share one lock
+    acquisition and one fsync.
+
+    Callers still get their own outcome. A mutation that raises rolls back
+    to its savepoint and the exception is re-raised in its request, leaving
+    the rest of the batch alone. If the commit itself fails, each mutation
+    is retried in a transaction of its own, so only the culprit fails.
+
+    Mutations run on the writer thread, in an app context but outside the
+    request: they take plain arguments, use `db.session`, must not commit,
+    and return plain values (not ORM objects). On other databases, or with
+    GROUP_COMMIT off, `run` executes the mutation inline and commits.
+    """
+
+    def __init__(self, max_batch=64):
+        self.max_batch = max_batch
+        self.enabled = False
+        self._engine = None
+        self._queue = queue.SimpleQueue()
+        self._app = None
+        self._thread = None
+        self._start_lock = threading.Lock()
+
+    def init_app(self, app):
+        self._app = app
+        self.max_batch = app.config.get('GROUP_COMMIT_MAX_BATCH', self.max_batch)
+        pragmas = dict(journal_mode=app.config.get('SQLITE_JOURNAL_MODE', 'WAL'),
+                       busy_timeout_ms=app.config.get('SQLITE_BUSY_TIMEOUT_MS', 10000),
+                       synchronous=app.config.get('SQLITE_SYNCHRONOUS', 'FULL'))
+        with app.app_context():
+            engines = list(db.engines.values())
+            primary = db.engine
+        for engine in engines:
+            if engine.dialect.name == 'sqlite':
+                tune_sqlite(engine, **pragmas)
+
+        self.enabled = app.config.get('GROUP_COMMIT', True) and primary.dialect.name == 'sqlite'
+        if not self.enabled:
+            return
+        # The writer's own connection, driving transactions itself: pysqlite's
+        # implicit BEGIN would break savepoints, and a deferred BEGIN could
+        # fail to upgrade to the write lock while another process holds it
+        self._engine = create_engine(primary.url, pool_size=1, max_overflow=0)
+        tune_sqlite(self._engine, **pragmas)
+
+        @event.listens_for(self._engine, 'connect')
+        def _autocommit(dbapi_conn, record):
+            dbapi_conn.isolation_level = None
+
+        @event.listens_for(self._engine, 'begin')
+        def _begin_immediate(conn):
+            conn.exec_driver_sql('BEGIN IMMEDIATE')
+
+    def ensure_started(self):
+        if self._thread is not None:
+            return
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="group-commit", daemon=True)
+                self._thread.start()
+
+    def run(self, mutation, *args):
+        """Runs `mutation(*args)` and commits it. Returns its result or raises its exception."""
+        if not self.enabled:
+            try:
+                result = mutation(*args)
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                raise
+            return result
+
+        self.ensure_started()
+        future = Future()
+        self._queue.put((mutation, args, future))
+        result = future.result()
+        # The write happened on the writer's session: mark this request as a
+        # writer so its follow-up reads skip the replicas (see db_routing)
+        g.db_wrote = True
+        return result
+
+    def _next_batch(self):
+        # Whatever queued up during the previous commit forms the next batch;
+        # the writer never waits for stragglers
+        batch = [self._queue.get()]
+        while len(batch) < self.max_batch:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _commit(self, batch):
+        outcomes = []
+        for mutation, args, future in batch:
+            try:
+                # Releasing the savepoint flushes, so constraint errors land here too
+                with db.session.begin_nested():
+                    result = mutation(*args)
+            except Exception as e:
+                outcomes.append((future, None, e))
+            else:
+                outcomes.append((future, result, None))
+        try:
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            if len(batch) > 1:
+                for item in batch:
+                    self._commit([item])
+                return
+            outcomes = [(future, None, e) for future, _, _ in outcomes]
+        for future, result, error in outcomes:
+            if error is None:
+                future.set_result(result)
+            else:
+                future.set_exception(error)
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            try:
+                with self._app.app_context():
+                    g.db_engine = self._engine
+                    try:
+                        self._commit(batch)
+                    finally:
+                        db.session.remove()
+            except Exception as e:
+                logger.exception("Group commit failed")
+                for _, _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+
+
+# Singleton instance
+group_commit = GroupCommitter()
@@ -0,0 +1,151 @@
+import bisect
+import logging
+import threading
+import time
+
+from flask import g, has_request_context, request, Response
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger('relay.sql')
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+SQL_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200)
+
+
+class Histogram:
+    """Cumulative-bucket histogram in the Prometheus sense, one per label set."""
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.total = 0.0
+        self.n = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.total += value
+        self.n += 1
+
+    def render(self, name, labels):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+        lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {self.n}')
+        lines.append(f'{name}_sum{{{labels}}} {self.total}')
+        lines.append(f'{name}_count{{{labels}}} {self.n}')
+        return lines
+
+
+class Instrumentation:
+    """
+    Per-request latency and SQL accounting, exposed on /metrics.
+
+    SQLAlchemy cursor events count statements and time spent in the database
+    for the request that issued them (statements from background threads
+    are tallied separately), so an N+1 loop shows up as a high
+    `relay_request_sql_statements` for its endpoint. Statements slower than
+    SLOW_QUERY_MS are logged on the `relay.sql` logger. Metrics are kept per
+    worker process and rendered in the Prometheus text format.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._latency = {}
+        self._sql_counts = {}
+        self._db_time = {}
+        self._requests = {}
+        self._background_statements = 0
+        self._slow_queries = 0
+        self.slow_query_seconds = 0.2
+        self._listening = False
+
+    def init_app(self, app):
+        self.slow_query_seconds = app.config.get('SLOW_QUERY_MS', 200) / 1000.0
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        app.add_url_rule('/metrics', 'metrics', self.metrics_view)
+        if not self._listening:
+            # Class-level listeners cover every engine, so nothing here needs
+            # an app context or a database connection.
+            event.listen(Engine, 'before_cursor_execute', self._before_cursor_execute)
+            event.listen(Engine, 'after_cursor_execute', self._after_cursor_execute)
+            self._listening = True
+
+    def _before_request(self):
+        g._metrics_start = time.perf_counter()
+        g._sql_count = 0
+        g._sql_time = 0.0
+
+    def _after_request(self, response):
+        start = g.pop('_metrics_start', None)
+        if start is None:
+            return response
+        elapsed = time.perf_counter() - start
+        endpoint = request.endpoint or 'unmatched'
+        key = (endpoint, request.method, response.status_code)
+        with self._lock:
+            self._requests[key] = self._requests.get(key, 0) + 1
+            self._histogram(self._latency, endpoint, LATENCY_BUCKETS).observe(elapsed)
+            self._histogram(self._sql_counts, endpoint, SQL_COUNT_BUCKETS).observe(g._sql_count)
+            self._histogram(self._db_time, endpoint, LATENCY_BUCKETS).observe(g._sql_time)
+        return response
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('_query_start', []).append(time.perf_counter())
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info['_query_start'].pop()
+        if has_request_context() and '_sql_count' in g:
+            g._sql_count += 1
+            g._sql_time += elapsed
+        else:
+            with self._lock:
+                self._background_statements += 1
+        if elapsed >= self.slow_query_seconds:
+            with self._lock:
+                self._slow_queries += 1
+            endpoint = request.endpoint if has_request_context() else 'background'
+            logger.warning("Slow query (%.1f ms) in %s: %s", elapsed * 1000, endpoint, statement)
+
+    @staticmethod
+    def _histogram(store, endpoint, buckets):
+        hist = store.get(endpoint)
+        if hist is None:
+            hist = store[endpoint] = Histogram(buckets)
+        return hist
+
+    def render(self):
+        lines = []
+        with self._lock:
+            lines.append('# HELP relay_requests_total Requests served, by endpoint, method and status.')
+            lines.append('# TYPE relay_requests_total counter')
+            for (endpoint, method, status), count in sorted(self._requests.items()):
+                lines.append(f'relay_requests_total{{endpoint="{endpoint}",method="{method}",status="{status}"}} {count}')
+
+            for name, store, help_text in (
+                ('relay_request_duration_seconds', self._latency, 'Request latency.'),
+                ('relay_request_sql_statements', self._sql_counts, 'SQL statements issued per request.'),
+                ('relay_request_db_seconds', self._db_time, 'Time spent in the database per request.'),
+            ):
+                lines.append(f'# HELP {name} {help_text}')
+                lines.append(f'# TYPE {name} histogram')
+                for endpoint, hist in sorted(store.items()):
+                    lines.extend(hist.render(name, f'endpoint="{endpoint}"'))
+
+            lines.append('# HELP relay_background_sql_statements_total SQL statements issued outside requests.')
+            lines.append('# TYPE relay_background_sql_statements_total counter')
+            lines.append(f'relay_background_sql_statements_total {self._background_statements}')
+            lines.append('# HELP relay_slow_queries_total Statements slower than SLOW_QUERY_MS.')
+            lines.append('# TYPE relay_slow_queries_total counter')
+            lines.append(f'relay_slow_queries_total {self._slow_queries}')
+        return '\n'.join(lines) + '\n'
+
+    def metrics_view(self):
+        return Response(self.render(), mimetype='text/plain; version=0.0.4')
+
+
+# Singleton instance
+instrumentation = Instrumentation()
@@ -0,0 +1,290 @@
+import bisect
+import json
+import logging
+import threading
+import time
+
+from models import db, Job, JobEvent, WebhookState
+
+logger = logging.getLogger('relay')
+
+# Event ids skipped over by a tail that are tracked at once; a bigger jump
+# in the sequence only waits for the ids just below the new event
+MAX_TRACKED_GAPS = 1000
+
+
+class EventTail:
+    """
+    Commit-order-safe reader of the `job_events` log.
+
+    Event ids are assigned when a row is inserted but become visible when
+    its transaction commits, so on Postgres a later id can show up first.
+    Reading `event_id > last seen` would then skip the earlier event for
+    good. The tail instead remembers the ids it has stepped over (`gaps`,
+    id -> time first skipped) and re-reads them on every call until they
+    appear, or until `gap_seconds` pass and the id is taken to belong to a
+    rolled-back transaction.
+
+    `head` is the highest id read; every event at or below `horizon` has
+    been read or never will be.
+    """
+
+    def __init__(self, head=0, gaps=None, gap_seconds=60.0):
+        self.head = head
+        self.gaps = dict(gaps or {})
+        self.gap_seconds = gap_seconds
+
+    @property
+    def horizon(self):
+        return min(self.gaps) - 1 if self.gaps else self.head
+
+    def read(self, limit):
+        """Returns up to `limit` unread events (JobEvent rows, by event_id): late arrivals and new ones."""
+        now = time.time()
+        self.gaps = {event_id: since for event_id, since in self.gaps.items() if now - since < self.gap_seconds}
+        unread = JobEvent.event_id > self.head
+        if self.gaps:
+            unread = db.or_(unread, JobEvent.event_id.in_(self.gaps))
+        rows = JobEvent.query.filter(unread).order_by(JobEvent.event_id.asc()).limit(limit).all()
+        for row in rows:
+            if row.event_id <= self.head:
+                del self.gaps[row.event_id]
+                continue
+            for skipped in range(max(self.head + 1, row.event_id - MAX_TRACKED_GAPS), row.event_id):
+                self.gaps[skipped] = now
+            self.head = row.event_id
+        return rows
+
+
+def dump_gaps(gaps):
+    """EventTail gaps as stored text; equal gaps always give equal text."""
+    return json.dumps({str(event_id): since for event_id, since in gaps.items()}, sort_keys=True)
+
+
+def load_gaps(text):
+    return {int(event_id): since for event_id, since in json.loads(text or '{}').items()}
+
+
+def encode_feed_cursor(head, gaps=()):
+    """`head`, then the ids below it still waited for, if any: "1234" or "1234:1229,1231"."""
+    if not gaps:
+        return str(head)
+    return f"{head}:" + ",".join(str(event_id) for event_id in sorted(gaps))
+
+
+def decode_feed_cursor(cursor):
+    """Returns (head, gaps); raises ValueError on a malformed cursor."""
+    head, _, gaps = cursor.partition(':')
+    gaps = frozenset(int(event_id) for event_id in gaps.split(',')) if gaps else frozenset()
+    if len(gaps) > MAX_TRACKED_GAPS:
+        raise ValueError("cursor holds too many event ids")
+    return int(head), gaps
+
+
+class JobFeed:
+    """
+    In-process fan-out of job state changes to long-polling clients.
+
+    A single poller thread per worker process tails the `job_events` table and
+    adds new rows to a bounded in-memory buffer, kept in event_id order; every
+    waiting request just sleeps on a shared condition variable and bisects
+    the buffer from its cursor when woken. However many clients are waiting,
+    the database sees at most one small indexed query per poll interval per
+    process, and only while someone is actually waiting (or an in-process
+    listener, such as the job router, has subscribed).
+
+    The poller is an EventTail, so events that commit after a later event id
+    still reach the buffer and the listeners. Client cursors carry the ids
+    still waited for along with the head (see encode_feed_cursor), which
+    keeps them valid on any worker: a late event is returned to every client
+    whose cursor still waits for it.
+    """
+
+    def __init__(self, history=4096, poll_interval=0.5, batch_size=500, gap_seconds=60.0):
+        self.poll_interval = poll_interval
+        self.batch_size = batch_size
+        self.gap_seconds = gap_seconds
+        self.history = history
+        self._events = []   # buffered events in event_id order
+        self._ids = []      # their event_ids, for bisecting
+        self._cond = threading.Condition()
+        self._wakeup = threading.Event()
+        self._tail = None
+        self._head = 0
+        self._gaps = frozenset()
+        self._floor = 0
+        self._waiters = 0
+        self._listeners = []
+        self._app = None
+        self._thread = None
+        self._start_lock = threading.Lock()
+
+    def init_app(self, app):
+        self._app = app
+        self.gap_seconds = app.config.get('JOB_EVENT_GAP_SECONDS', self.gap_seconds)
+
+    @property
+    def position(self):
+        """The cursor of the current end of the feed."""
+        self.ensure_started()
+        with self._cond:
+            return encode_feed_cursor(self._head, self._gaps)
+
+    def ensure_started(self):
+        if self._thread is not None:
+            return
+        with self._start_lock:
+            if self._thread is not None:
+                return
+            # Start from the current end of the log; history is served by GET /jobs
+            with self._app.app_context():
+                self._head = db.session.query(db.func.max(JobEvent.event_id)).scalar() or 0
+                self._floor = self._head
+                db.session.remove()
+            self._tail = EventTail(self._head, gap_seconds=self.gap_seconds)
+            self._thread = threading.Thread(target=self._run, name="job-feed-poller", daemon=True)
+            self._thread.start()
+
+    def notify(self):
+        """Called after a commit that wrote job events, to skip the poll delay."""
+        self._wakeup.set()
+
+    def subscribe(self, listener):
+        """Calls `listener(events)` with every batch the poller reads from here on."""
+        self.ensure_started()
+        self._listeners.append(listener)
+
+    def wait(self, cursor, match, timeout):
+        """
+        Blocks until an event after `cursor` (a decoded feed cursor) satisfies
+        `match` or `timeout` elapses. Returns (events, new_cursor, resync),
+        where resync means events the cursor waits for fell out of the buffer
+        and the caller should re-list via GET /jobs.
+        """
+        head, gaps = cursor
+        self.ensure_started()
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            self._waiters += 1
+            if self._waiters == 1:
+                # The poller idles without waiters; with some it is polling already
+                self._wakeup.set()
+            try:
+                while True:
+                    resync = head < self._floor or any(
+                        event_id <= self._floor and event_id not in self._gaps for event_id in gaps)
+                    events = [e for e in self._buffered(head, gaps) if match(e)]
+                    remaining = deadline - time.monotonic()
+                    if events or resync or remaining <= 0:
+                        return events, self._advance(head, gaps), resync
+                    self._cond.wait(remaining)
+            finally:
+                self._waiters -= 1
+
+    def _buffered(self, head, gaps):
+        """Buffered events after `head` or among `gaps`, in event_id order (holding the lock)."""
+        found = []
+        for event_id in sorted(gaps):
+            i = bisect.bisect_left(self._ids, event_id)
+            if i < len(self._ids) and self._ids[i] == event_id:
+                found.append(self._events[i])
+        return found + self._events[bisect.bisect_right(self._ids, head):]
+
+    def _advance(self, head, gaps):
+        """The cursor after serving `head`/`gaps` from the buffer (holding the lock)."""
+        # The client's ids this process cannot rule out yet (not read here,
+        # and not given up on), plus those it is waiting for past the client's head
+        pending = {event_id for event_id in gaps if event_id in self._gaps or event_id > self._head}
+        pending.update(event_id for event_id in self._gaps if event_id > head)
+        return encode_feed_cursor(max(head, self._head), pending)
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.poll_interval)
+            self._wakeup.clear()
+            if not self._waiters and not self._listeners:
+                continue
+            try:
+                self._poll()
+            except Exception:
+                logger.exception("Job feed poll failed")
+                time.sleep(self.poll_interval)
+
+    def _poll(self):
+        with self._app.app_context():
+            try:
+                rows = self._tail.read(self.batch_size)
+                events = [row.to_dict() for row in rows]
+            finally:
+                db.session.remove()
+
+        with self._cond:
+            for event in events:
+                event_id = event["event_id"]
+                if event_id <= self._floor:
+                    continue  # cursors waiting for it resync anyway
+                # Late events (below the head) are inserted in id order
+                i = bisect.bisect_right(self._ids, event_id)
+                self._ids.insert(i, event_id)
+                self._events.insert(i, event)
+            excess = len(self._events) - self.history
+            if excess > 0:
+                # Cursors still waiting for the events dropped here must resync
+                self._floor = max(self._floor, self._ids[excess - 1])
+                del self._ids[:excess], self._events[:excess]
+            self._head = self._tail.head
+            self._gaps = frozenset(self._tail.gaps)
+            if events:
+                self._cond.notify_all()
+        if not events:
+            return
+        for listener in self._listeners:
+            listener(events)
+        if len(events) == self.batch_size:
+            self._wakeup.set()
+
+
+def record_job_event(job):
+    """Adds a JobEvent for the job's current status to the open session."""
+    db.session.add(JobEvent(
+        task_id=job.task_id,
+        status=job.status,
+        buyer_id=job.buyer_id,
+        claimed_by=job.claimed_by,
+        price=job.price
+    ))
+
+
+def record_job_events(task_ids):
+    """
+    Adds a JobEvent for each job's current row state with one INSERT ...
+    SELECT, for transitions made by bulk UPDATEs (claims, settlement).
+    """
+    if not task_ids:
+        return
+    db.session.execute(
+        db.insert(JobEvent).from_select(
+            ['task_id', 'status', 'buyer_id', 'claimed_by', 'price'],
+            db.select(Job.task_id, Job.status, Job.buyer_id, Job.claimed_by, Job.price)
+            .where(Job.task_id.in_(task_ids))
+        )
+    )
+
+
+def prune_job_events(retention):
+    """
+    Deletes all but the newest `retention` job events, never passing events
+    the webhook dispatcher has yet to fan out. Returns rows deleted.
+    """
+    head = db.session.query(db.func.max(JobEvent.event_id)).scalar() or 0
+    state = db.session.query(WebhookState.last_event_id, WebhookState.gaps).filter_by(id=1).first()
+    cutoff = head - retention
+    if state is not None:
+        cutoff = min(cutoff, EventTail(state.last_event_id, load_gaps(state.gaps)).horizon)
+    deleted = JobEvent.query.filter(JobEvent.event_id <= cutoff).delete(synchronize_session=False)
+    db.session.commit()
+    return deleted
+
+
+# Singleton instance
+job_feed = JobFeed()
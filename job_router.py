@@ -0,0 +1,158 @@
+import heapq
+import threading
+
+from job_feed import job_feed
+from models import db, Job
+
+ENTRYPOINT_MAX_LENGTH = 100
+
+
+def envelope_entrypoint(envelope):
+    """The `payload.entrypoint` an envelope routes on, or None."""
+    payload = envelope.get('payload') if isinstance(envelope, dict) else None
+    entrypoint = payload.get('entrypoint') if isinstance(payload, dict) else None
+    if isinstance(entrypoint, str) and 0 < len(entrypoint) <= ENTRYPOINT_MAX_LENGTH:
+        return entrypoint
+    return None
+
+
+class JobRouter:
+    """
+    In-memory routing index of funded jobs, per worker process.
+
+    Jobs are kept in one heap per entrypoint plus one over all jobs,
+    ordered by price (highest first) then age (oldest first), so handing
+    an agent its best match costs a heap pop per capability. Pops are
+    exclusive within the process, so concurrent agents get distinct jobs;
+    across processes the claim's compare-and-set decides, and a loser
+    just pops the next one.
+
+    The index is rebuilt from the database on start and then follows the
+    job feed: 'funded' events add the job (if it is still funded), any
+    other status drops it. The feed also delivers events that commit after
+    later ones; since a funded job is re-checked against its row, a late
+    'funded' event cannot resurrect a job claimed since. The routes that fund and claim also update it
+    directly so this process sees its own writes without waiting for a
+    poll. Removal is lazy: heaps keep stale entries, skipped on pop, until
+    they outnumber live ones and the heaps are compacted.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = {}   # task_id -> (sort key, entrypoint)
+        self._heaps = {}     # entrypoint -> heap of (sort key, task_id)
+        self._all = []       # heap over every entrypoint
+        self._stale = 0      # heap copies of jobs no longer indexed
+        self._app = None
+        self._started = False
+        self._start_lock = threading.Lock()
+
+    def init_app(self, app):
+        self._app = app
+
+    def ensure_started(self):
+        if self._started:
+            return
+        with self._start_lock:
+            if self._started:
+                return
+            # Subscribe first: events racing the rebuild are replayed, not lost
+            job_feed.subscribe(self._on_events)
+            with self._app.app_context():
+                try:
+                    self.rebuild()
+                finally:
+                    db.session.remove()
+            self._started = True
+
+    def rebuild(self):
+        rows = db.session.query(Job.task_id, Job.entrypoint, Job.price, Job.created_at) \
+            .filter(Job.status == 'funded').yield_per(1000)
+        with self._lock:
+            self._entries, self._heaps, self._all, self._stale = {}, {}, [], 0
+            for row in rows:
+                self._entries[row.task_id] = ((-row.price, row.created_at), row.entrypoint)
+            self._heapify()
+
+    def add(self, task_id, entrypoint, price, created_at):
+        key = (-price, created_at)
+        with self._lock:
+            if task_id in self._entries:
+                return
+            self._entries[task_id] = (key, entrypoint)
+            heapq.heappush(self._heaps.setdefault(entrypoint, []), (key, task_id))
+            heapq.heappush(self._all, (key, task_id))
+
+    def discard(self, task_id):
+        with self._lock:
+            if self._entries.pop(task_id, None) is not None:
+                self._dropped(2)
+
+    def pop(self, entrypoints=None):
+        """
+        Removes the best job among `entrypoints` (any entrypoint when empty).
+        Returns (task_id, entry), entry being what `restore` needs to put it
+        back, or (None, None) when nothing matches.
+        """
+        with self._lock:
+            heaps = [self._heaps.get(e) for e in entrypoints] if entrypoints else [self._all]
+            best = None
+            for heap in heaps:
+                while heap and heap[0][1] not in self._entries:
+                    heapq.heappop(heap)
+                if heap and (best is None or heap[0] < best[0]):
+                    best = heap
+            if best is None:
+                return None, None
+            _, task_id = heapq.heappop(best)
+            entry = self._entries.pop(task_id)
+            # Its copy in the other heap is now stale
+            self._dropped(1)
+            return task_id, entry
+
+    def restore(self, task_id, entry):
+        """Re-indexes a popped job whose claim failed without deciding its fate."""
+        key, entrypoint = entry
+        self.add(task_id, entrypoint, -key[0], key[1])
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _dropped(self, copies):
+        self._stale += copies
+        if self._stale > 2 * len(self._entries) + 1024:
+            self._heapify()
+
+    def _heapify(self):
+        self._heaps = {}
+        for task_id, (key, entrypoint) in self._entries.items():
+            self._heaps.setdefault(entrypoint, []).append((key, task_id))
+        for heap in self._heaps.values():
+            heapq.heapify(heap)
+        self._all = [item for heap in self._heaps.values() for item in heap]
+        heapq.heapify(self._all)
+        self._stale = 0
+
+    def _on_events(self, events):
+        funded = set()
+        for event in events:
+            if event["status"] == 'funded':
+                funded.add(event["task_id"])
+            else:
+                funded.discard(event["task_id"])
+                self.discard(event["task_id"])
+        funded = {task_id for task_id in funded if task_id not in self._entries}
+        if not funded:
+            return
+        with self._app.app_context():
+            try:
+                rows = db.session.query(Job.task_id, Job.entrypoint, Job.price, Job.created_at) \
+                    .filter(Job.task_id.in_(funded), Job.status == 'funded').all()
+            finally:
+                db.session.remove()
+        for row in rows:
+            self.add(row.task_id, row.entrypoint, row.price, row.created_at)
+
+
+# Singleton instance
+job_router = JobRouter()
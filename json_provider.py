@@ -0,0 +1,81 @@
+import datetime
+import json
+from decimal import Decimal
+
+from flask import current_app
+from flask.json.provider import JSONProvider
+
+try:
+    import orjson
+except ImportError:  # optional: falls back to the stdlib encoder
+    orjson = None
+
+
+def _default(value):
+    # Amounts go on the wire as JSON numbers, as the float() calls did before
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+    if hasattr(value, '_asdict'):
+        return value._asdict()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+# Streamed responses are written in chunks of about this size
+NDJSON_CHUNK_BYTES = 64 * 1024
+
+
+class RelayJSONProvider(JSONProvider):
+    """
+    JSON provider with native Decimal and datetime support.
+
+    Uses orjson when it is installed (JSON_BACKEND 'auto' or 'orjson') and
+    the stdlib encoder otherwise, so views can hand rows and Decimals to
+    jsonify without converting each field. Output is compact in both cases.
+    """
+
+    def __init__(self, app):
+        super().__init__(app)
+        backend = app.config.get('JSON_BACKEND', 'auto')
+        if backend == 'orjson' and orjson is None:
+            raise RuntimeError("JSON_BACKEND is 'orjson' but orjson is not installed")
+        self.use_orjson = orjson is not None and backend in ('auto', 'orjson')
+
+    def dumps(self, obj, **kwargs):
+        return self.dumpb(obj).decode('utf-8')
+
+    def dumpb(self, obj):
+        """Encodes straight to bytes, skipping the str round trip for responses."""
+        if self.use_orjson:
+            return orjson.dumps(obj, default=_default, option=orjson.OPT_NON_STR_KEYS)
+        return json.dumps(obj, default=_default, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+    def loads(self, s, **kwargs):
+        if self.use_orjson:
+            return orjson.loads(s)
+        return json.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(self.dumpb(obj) + b'\n', mimetype='application/json')
+
+
+def ndjson_stream(rows, to_dict):
+    """
+    Encodes rows as newline-delimited JSON, yielding ~NDJSON_CHUNK_BYTES
+    chunks as rows come off the cursor. Wrap in stream_with_context.
+    """
+    dumpb = current_app.json.dumpb
+    chunk = []
+    size = 0
+    for row in rows:
+        line = dumpb(to_dict(row)) + b'\n'
+        chunk.append(line)
+        size += len(line)
+        if size >= NDJSON_CHUNK_BYTES:
+            yield b''.join(chunk)
+            chunk = []
+            size = 0
+    if chunk:
+        yield b''.join(chunk)
@@ -0,0 +1,181 @@
+import threading
+
+from sqlalchemy.orm import joinedload
+
+from models import db, Owner, Agent, LeaderboardState
+
+
+class Leaderboard:
+    """
+    Top-K agent and owner rankings cached per worker process.
+
+    Changes that can move a ranking bump the shared version in
+    `leaderboard_state`. Reads compare that version (one primary-key
+    lookup) with the cached one and serve the cached top-K when they match;
+    otherwise the top-K is reloaded with two index-ordered LIMIT K queries.
+
+    Payouts and new agents publish after their commit, in a statement of
+    their own, and only when they can enter or move within a ranking. So
+    settlements neither queue on the shared row nor flush every worker's
+    cache. The worker publishing a payout applies it to its own cache
+    directly. Adoptions can lower an owner's total, so they bump inside
+    their transaction and every cache reloads.
+    """
+
+    def __init__(self, size=10):
+        self.size = size
+        self._lock = threading.Lock()
+        self._version = None
+        self._agents = []
+        self._owners = []
+
+    def snapshot(self):
+        """Returns (agent_ranking, owner_ranking), reloading if another worker changed them."""
+        _, agents, owners = self.versioned_snapshot()
+        return agents, owners
+
+    def versioned_snapshot(self):
+        """As `snapshot`, plus the shared version the rankings correspond to."""
+        version = db.session.query(LeaderboardState.version).filter_by(id=1).scalar() or 0
+        with self._lock:
+            if version == self._version:
+                return version, list(self._agents), list(self._owners)
+        return (version,) + self._rebuild(version)
+
+    def _rebuild(self, version):
+        agents = Agent.query.options(joinedload(Agent.owner)) \
+            .order_by(Agent.balance.desc()).limit(self.size).all()
+        owners = Owner.query.order_by(Owner.total_profit.desc()).limit(self.size).all()
+        agent_ranking = [_agent_entry(a) for a in agents]
+        owner_ranking = [_owner_entry(o.username, o.total_profit) for o in owners]
+        with self._lock:
+            self._version = version
+            self._agents = agent_ranking
+            self._owners = owner_ranking
+        return list(agent_ranking), list(owner_ranking)
+
+    def record_payout(self, agent, amount):
+        """
+        Adds a payout to the agent's owner total in the open transaction.
+        Returns a token to pass to `publish_payout` after commit.
+        """
+        # The owner is read inside the UPDATE rather than from `agent`: the
+        # caller already holds the agent row lock from its balance increment,
+        # so a concurrent adoption cannot slip in between.
+        owner_id = db.select(Agent.owner_id).where(Agent.agent_id == agent.agent_id).scalar_subquery()
+        return db.session.execute(
+            db.update(Owner)
+            .where(Owner.owner_id == owner_id)
+            .values(total_profit=Owner.total_profit + amount)
+            .returning(Owner.total_profit)
+            .execution_options(synchronize_session=False)
+        ).scalar()
+
+    def publish_payout(self, token, agent):
+        """After commit: publishes a payout that can move a ranking, and applies it to the local cache."""
+        owner_total = token
+        entry = _agent_entry(agent)
+        owner_entry = _owner_entry(agent.owner.username, owner_total) if owner_total is not None else None
+        if not self._may_rank(entry, owner_entry):
+            return
+        version = self._publish()
+        with self._lock:
+            # Only safe when no other change landed in between; otherwise the next read reloads
+            if self._version is None or version != self._version + 1:
+                return
+            self._agents = _upsert_top(self._agents, entry, "agent_id", "balance", self.size)
+            if owner_entry is not None:
+                self._owners = _upsert_top(self._owners, owner_entry, "owner_id", "total_profit", self.size)
+            self._version = version
+
+    def publish_agent(self, agent_id):
+        """After a new agent commits: publishes it if it enters the ranking (while under K agents)."""
+        if self._may_rank({"agent_id": agent_id, "balance": 0.0}, None):
+            self._publish()
+
+    def record_adoption(self, agent, old_owner_id, new_owner_id):
+        """
+        Moves the agent's balance between owner totals in the open
+        transaction. The caller must hold the agent row lock (SELECT ... FOR
+        UPDATE) so no payout lands between reading the balance and moving it.
+        """
+        if old_owner_id == new_owner_id:
+            return
+        if old_owner_id:
+            Owner.query.filter_by(owner_id=old_owner_id).update(
+                {Owner.total_profit: Owner.total_profit - agent.balance},
+                synchronize_session=False
+            )
+        Owner.query.filter_by(owner_id=new_owner_id).update(
+            {Owner.total_profit: Owner.total_profit + agent.balance},
+            synchronize_session=False
+        )
+        # Owner totals can drop here, which an incremental top-K cannot
+        # track, so other caches (and ours) simply reload on next read.
+        self._bump()
+
+    def _may_rank(self, entry, owner_entry):
+        """
+        Whether a raised score can change a ranking, judged against the
+        current top-K. Scores only rise between reloads (adoptions force
+        one), so a score below the cached K-th cannot enter the real top-K.
+        """
+        _, agents, owners = self.versioned_snapshot()
+        return _may_enter(agents, entry, "agent_id", "balance", self.size) or (
+            owner_entry is not None and _may_enter(owners, owner_entry, "owner_id", "total_profit", self.size))
+
+    def _publish(self):
+        """Bumps the version in a transaction of its own. Returns the new version."""
+        with db.engine.begin() as conn:
+            return self._bump(conn)
+
+    def _bump(self, conn=None):
+        conn = conn or db.session
+        version = conn.execute(
+            db.update(LeaderboardState)
+            .where(LeaderboardState.id == 1)
+            .values(version=LeaderboardState.version + 1)
+            .returning(LeaderboardState.version)
+            .execution_options(synchronize_session=False)
+        ).scalar()
+        if version is None:
+            conn.execute(db.insert(LeaderboardState).values(id=1, version=1))
+            version = 1
+        return version
+
+
+def _agent_entry(a):
+    return {
+        "agent_id": a.agent_id,
+        "balance": float(a.balance),
+        "owner_id": a.owner.username if a.owner and not a.is_ghost else "[ENCRYPTED]",
+        "owner_twitter": a.owner.twitter_handle if a.owner else None,
+        "wallet_address": a.wallet_address,
+        "is_ghost": a.is_ghost
+    }
+
+
+def _owner_entry(username, total_profit):
+    return {
+        "owner_id": username,
+        "total_profit": float(total_profit or 0)
+    }
+
+
+def _may_enter(ranking, entry, key, score, size):
+    return (len(ranking) < size or entry[score] > ranking[-1][score]
+            or any(e[key] == entry[key] for e in ranking))
+
+
+def _upsert_top(ranking, entry, key, score, size):
+    """Inserts or replaces `entry` in a ranking sorted by `score` and trims it to `size`."""
+    ranking = [e for e in ranking if e[key] != entry[key]]
+    if len(ranking) >= size and entry[score] <= ranking[-1][score]:
+        return ranking
+    ranking.append(entry)
+    ranking.sort(key=lambda e: e[score], reverse=True)
+    return ranking[:size]
+
+
+# Singleton instance
+leaderboard = Leaderboard()
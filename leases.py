@@ -0,0 +1,115 @@
+import datetime
+import logging
+import threading
+import time
+
+from job_feed import job_feed, record_job_events
+from models import db, Job
+from stats_rollup import stats_rollup
+from webhooks import webhook_dispatcher
+
+logger = logging.getLogger('relay')
+
+
+class LeaseReaper:
+    """
+    Time-limited claims.
+
+    A claim holds the job for `lease_seconds`; the agent extends it with
+    heartbeats while it works. A background thread in every worker returns
+    jobs whose lease has run out to 'funded', so a crashed agent's bounty
+    goes back on the market instead of staying stranded.
+
+    Only claimed jobs carry `lease_expires_at` (submit clears it), so each
+    pass is a range scan over `idx_jobs_lease_expiry` up to now. Expired
+    jobs are reset by one compare-and-set UPDATE per batch: a job that is
+    submitted or heartbeated in the meantime no longer matches, and
+    concurrent reapers in other workers take disjoint rows (SKIP LOCKED on
+    Postgres). Each reclaim appends a job event and is counted in the
+    stats rollup.
+    """
+
+    def __init__(self, lease_seconds=300, interval=10.0, batch_size=500):
+        self.lease_seconds = lease_seconds
+        self.interval = interval
+        self.batch_size = batch_size
+        self._app = None
+        self._thread = None
+        self._start_lock = threading.Lock()
+
+    def init_app(self, app):
+        self._app = app
+        self.lease_seconds = app.config.get('CLAIM_LEASE_SECONDS', self.lease_seconds)
+        self.interval = app.config.get('LEASE_REAP_INTERVAL', self.interval)
+        self.batch_size = app.config.get('LEASE_REAP_BATCH', self.batch_size)
+
+    def ensure_started(self):
+        if self._thread is not None:
+            return
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="lease-reaper", daemon=True)
+                self._thread.start()
+
+    def expiry(self):
+        """Expiry for a lease taken or renewed now."""
+        return datetime.datetime.utcnow() + datetime.timedelta(seconds=self.lease_seconds)
+
+    def renew(self, task_id, agent_id):
+        """
+        Extends the agent's lease on a job it still holds (a lapsed lease can
+        be renewed until the reaper gets to it). Returns the new expiry, or None.
+        """
+        expires_at = self.expiry()
+        renewed = Job.query.filter_by(task_id=task_id, status='claimed', claimed_by=agent_id).update(
+            {"lease_expires_at": expires_at},
+            synchronize_session=False
+        )
+        return expires_at if renewed else None
+
+    def reap(self):
+        """Returns every expired claim to 'funded'. Returns how many were reclaimed."""
+        reclaimed = 0
+        while True:
+            now = datetime.datetime.utcnow()
+            # Expiry alone, so the planner range-scans idx_jobs_lease_expiry;
+            # the status guard is applied to the matched rows below
+            expired = db.select(Job.task_id) \
+                .where(Job.lease_expires_at < now) \
+                .order_by(Job.lease_expires_at.asc()) \
+                .limit(self.batch_size) \
+                .with_for_update(skip_locked=True)
+            stmt = db.update(Job) \
+                .where(Job.task_id.in_(expired), Job.status == 'claimed', Job.lease_expires_at < now) \
+                .values(status='funded', claimed_by=None, lease_expires_at=None) \
+                .returning(Job.task_id) \
+                .execution_options(synchronize_session=False)
+            task_ids = [str(row.task_id) for row in db.session.execute(stmt)]
+            record_job_events(task_ids)
+            stats_rollup.record_reclaim(len(task_ids))
+            db.session.commit()
+            if not task_ids:
+                return reclaimed
+            reclaimed += len(task_ids)
+            job_feed.notify()
+            webhook_dispatcher.notify()
+            if len(task_ids) < self.batch_size:
+                return reclaimed
+
+    def _run(self):
+        while True:
+            try:
+                with self._app.app_context():
+                    try:
+                        reclaimed = self.reap()
+                    finally:
+                        db.session.remove()
+                if reclaimed:
+                    logger.info("Reclaimed %d jobs with expired claim leases", reclaimed)
+            except Exception:
+                logger.exception("Lease reaping failed")
+            time.sleep(self.interval)
+
+
+# Singleton instance
+lease_reaper = LeaseReaper()
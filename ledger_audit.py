@@ -0,0 +1,256 @@
+import datetime
+import hashlib
+import itertools
+import logging
+import operator
+import threading
+import time
+from collections import namedtuple
+from decimal import Decimal
+
+from sqlalchemy.dialects import postgresql, sqlite
+
+from models import db, Agent, LedgerEntry, LedgerCheckpoint
+
+logger = logging.getLogger('relay')
+
+# Ledger amounts are Numeric(20, 6); entries are hashed as stored
+AMOUNT_QUANTUM = Decimal('0.000001')
+AUDIT_STATUSES = ('ok', 'drift', 'broken')
+
+ENTRY_COLUMNS = (
+    LedgerEntry.entry_id, LedgerEntry.chain_id, LedgerEntry.source_id, LedgerEntry.target_id,
+    LedgerEntry.amount, LedgerEntry.transaction_type, LedgerEntry.task_id, LedgerEntry.created_at,
+    LedgerEntry.entry_hash,
+)
+
+# An agent to verify: its balance and chain head, and its checkpoint (None fields when it has none)
+Candidate = namedtuple('Candidate', 'agent_id balance ledger_head last_entry_id chain_head running_sum entries')
+
+
+def ledger_amount(value):
+    """`value` rounded the way the ledger stores it."""
+    return Decimal(value).quantize(AMOUNT_QUANTUM)
+
+
+def entry_hash(prev_hash, source_id, target_id, amount, transaction_type, task_id, created_at):
+    """SHA-256 over an entry's fields and the entry_hash before it in its chain (None for the first)."""
+    material = "|".join((
+        prev_hash or "", source_id, target_id, f"{ledger_amount(amount):f}",
+        transaction_type or "", task_id or "", created_at.isoformat(),
+    ))
+    return hashlib.sha256(material.encode('utf-8')).hexdigest()
+
+
+def chain_entries(entries, heads):
+    """
+    Links new ledger entry dicts into their chains in list order: sets each
+    one's entry_hash from its chain's head in `heads` (chain_id -> hash,
+    missing for an empty chain) and advances the head. Entries must then be
+    inserted in the same order, so entry_id order is chain order.
+    """
+    for entry in entries:
+        entry['entry_hash'] = heads[entry['chain_id']] = entry_hash(
+            heads.get(entry['chain_id']), entry['source_id'], entry['target_id'], entry['amount'],
+            entry['transaction_type'], entry['task_id'], entry['created_at'],
+        )
+
+
+class LedgerAuditor:
+    """
+    Reconciles agent balances against the hash-chained ledger.
+
+    Every ledger entry carries the hash of its fields and of the previous
+    entry in its chain, one chain per paid agent, whose head is kept on the
+    agent row next to the balance it moves (settlement updates both under
+    the agent's row lock). Each agent's checkpoint records how far its chain
+    has been verified: the last entry, its hash and the running sum of the
+    agent's payouts up to it.
+
+    A pass only looks at agents whose balance or chain head differ from
+    their checkpoint (one join over agents, no ledger scan), walks each of
+    their chains from the checkpoint up to the head read with the balance,
+    and checks that every hash matches and that the payouts add up to the
+    balance. Settlements committed mid-pass lie beyond that head and are
+    left for the next pass. Outcomes, per agent:
+
+    - ok: chain intact, balance equals the ledger sum.
+    - drift: chain intact, balance off by `drift` (balance - ledger sum).
+    - broken: an entry does not hash to its recorded value (edited,
+      reordered or deleted entries: `broken_entry_id`), or the chain ends
+      short of the agent's head (deleted tail). The checkpoint stays at the
+      last good entry.
+
+    Passes run in a background thread per worker every `interval` seconds;
+    concurrent passes just verify the same entries twice. GET /ledger/audit
+    only reads the checkpoints. Full passes are for operators, from a shell
+    (`ledger_auditor.audit(full=True)` in an app context).
+    """
+
+    def __init__(self, interval=300.0, batch_size=500):
+        self.interval = interval
+        self.batch_size = batch_size
+        self._app = None
+        self._thread = None
+        self._start_lock = threading.Lock()
+
+    def init_app(self, app):
+        self._app = app
+        self.interval = app.config.get('LEDGER_AUDIT_INTERVAL', self.interval)
+        self.batch_size = app.config.get('LEDGER_AUDIT_BATCH', self.batch_size)
+
+    def ensure_started(self):
+        if self._thread is not None:
+            return
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="ledger-audit", daemon=True)
+                self._thread.start()
+
+    def audit(self, full=False):
+        """
+        One pass. Incremental by default; `full` re-verifies every chain from
+        its first entry, which also catches edits below a checkpoint.
+        Returns what it checked.
+        """
+        started = time.perf_counter()
+        checkpoint = LedgerCheckpoint
+        query = db.session.query(
+            Agent.agent_id, Agent.balance, Agent.ledger_head,
+            checkpoint.last_entry_id, checkpoint.chain_head, checkpoint.running_sum, checkpoint.entries
+        ).outerjoin(checkpoint, checkpoint.agent_id == Agent.agent_id)
+        if full:
+            candidates = [Candidate(row.agent_id, row.balance, row.ledger_head, None, None, None, None)
+                          for row in query.filter(db.or_(
+                              db.func.coalesce(Agent.balance, 0) != 0,
+                              Agent.ledger_head.isnot(None),
+                              checkpoint.agent_id.isnot(None)))]
+        else:
+            candidates = [Candidate(*row) for row in query.filter(db.or_(
+                db.func.coalesce(Agent.balance, 0) != db.func.coalesce(checkpoint.running_sum, 0),
+                Agent.ledger_head.is_distinct_from(checkpoint.chain_head),
+                checkpoint.status != 'ok',
+            ))]
+        # Agents with nearby checkpoints share a chunk, so one range scan serves them all
+        candidates.sort(key=lambda c: c.last_entry_id or 0)
+
+        verified = 0
+        for i in range(0, len(candidates), self.batch_size):
+            chunk = candidates[i:i + self.batch_size]
+            verified += self._audit_chunk(chunk)
+        return {
+            "agents_checked": len(candidates),
+            "entries_verified": verified,
+            "duration_ms": round((time.perf_counter() - started) * 1000, 1),
+        }
+
+    def _audit_chunk(self, chunk):
+        by_agent = {c.agent_id: c for c in chunk}
+        # Plain tuples (see ENTRY_COLUMNS) straight off a Core select: this
+        # loop is what a full pass over millions of entries spends its time on
+        entries = db.session.connection().execute(
+            db.select(*ENTRY_COLUMNS).where(
+                LedgerEntry.chain_id.in_(by_agent),
+                LedgerEntry.entry_id > min(c.last_entry_id or 0 for c in chunk)
+            ).order_by(LedgerEntry.chain_id, LedgerEntry.entry_id).execution_options(yield_per=5000)
+        ).tuples()
+
+        now = datetime.datetime.utcnow()
+        rows = {}
+        verified = 0
+        for agent_id, chain in itertools.groupby(entries, key=operator.itemgetter(1)):
+            rows[agent_id] = self._walk(by_agent[agent_id], chain, now)
+            verified += rows[agent_id]['entries'] - (by_agent[agent_id].entries or 0)
+        for agent_id, candidate in by_agent.items():
+            if agent_id not in rows:
+                rows[agent_id] = self._walk(candidate, (), now)
+
+        dialect = postgresql if db.session.get_bind().dialect.name == 'postgresql' else sqlite
+        stmt = dialect.insert(LedgerCheckpoint.__table__)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['agent_id'],
+            set_={col: stmt.excluded[col] for col in next(iter(rows.values())) if col != 'agent_id'}
+        )
+        db.session.execute(stmt, list(rows.values()))
+        db.session.commit()
+        return verified
+
+    @staticmethod
+    def _walk(candidate, chain, now):
+        """Verifies the candidate's chain after its checkpoint, up to its head. Returns the new checkpoint row."""
+        agent_id, stop = candidate.agent_id, candidate.ledger_head
+        head = candidate.chain_head
+        last_entry_id = candidate.last_entry_id or 0
+        total = candidate.running_sum or Decimal(0)
+        count = candidate.entries or 0
+        broken_entry_id = None
+        for entry_id, _, source_id, target_id, amount, transaction_type, task_id, created_at, recorded in chain:
+            if head == stop:
+                # Appended after the agent row was read: the next pass checks it
+                break
+            if entry_id <= last_entry_id:
+                # Below this agent's checkpoint; the chunk scans from the lowest one
+                continue
+            expected = entry_hash(head, source_id, target_id, amount, transaction_type, task_id, created_at)
+            if recorded != expected:
+                broken_entry_id = entry_id
+                break
+            head, last_entry_id, count = expected, entry_id, count + 1
+            if target_id == agent_id:
+                total += amount
+
+        drift = (candidate.balance or Decimal(0)) - total
+        if broken_entry_id is not None or head != stop:
+            status = 'broken'
+        else:
+            status = 'drift' if drift else 'ok'
+        return dict(agent_id=agent_id, last_entry_id=last_entry_id, chain_head=head,
+                    running_sum=total, entries=count, status=status, drift=drift,
+                    broken_entry_id=broken_entry_id, checked_at=now)
+
+    @staticmethod
+    def report(agent_id=None, limit=100):
+        """Audit state: agents per status, and the agents that failed (or just `agent_id`)."""
+        counts = {status: 0 for status in AUDIT_STATUSES}
+        counts.update(db.session.query(LedgerCheckpoint.status, db.func.count())
+                      .group_by(LedgerCheckpoint.status).all())
+        query = LedgerCheckpoint.query
+        if agent_id:
+            query = query.filter_by(agent_id=agent_id)
+        else:
+            query = query.filter(LedgerCheckpoint.status != 'ok')
+        return {
+            "agents": counts,
+            "flagged": [{
+                "agent_id": c.agent_id,
+                "status": c.status,
+                "drift": float(c.drift),
+                "ledger_sum": float(c.running_sum),
+                "verified_entries": c.entries,
+                "verified_through": c.last_entry_id,
+                "broken_entry_id": c.broken_entry_id,
+                "checked_at": c.checked_at.isoformat() if c.checked_at else None,
+            } for c in query.order_by(LedgerCheckpoint.agent_id).limit(limit)],
+        }
+
+    def _run(self):
+        while True:
+            # First pass one interval after start, so workers booting together do not all audit at once
+            time.sleep(self.interval)
+            try:
+                with self._app.app_context():
+                    try:
+                        result = self.audit()
+                        flagged = LedgerCheckpoint.query.filter(LedgerCheckpoint.status != 'ok').count()
+                    finally:
+                        db.session.remove()
+                if flagged:
+                    logger.warning("Ledger audit: %d agents out of balance or with a broken chain", flagged)
+                elif result["entries_verified"]:
+                    logger.info("Ledger audit: verified %d entries", result['entries_verified'])
+            except Exception:
+                logger.exception("Ledger audit failed")
+
+
+# Singleton instance
+ledger_auditor = LedgerAuditor()
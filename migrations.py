@@ -0,0 +1,274 @@
+"""
+Versioned schema migrations for the relay.
+
+Run once per release, before any web worker starts (Procfile `release:`):
+
+    python migrations.py            # apply pending migrations
+    python migrations.py status     # list applied / pending versions
+
+Each migration is idempotent, so a run interrupted half-way can simply be
+re-run. Applied versions are recorded in `schema_migrations`.
+"""
+import datetime
+import sys
+
+from sqlalchemy import text, inspect
+
+from models import (
+    db, Owner, Agent, Job, LedgerEntry, JobEvent, JobEventState, LeaderboardState,
+    PlatformStat, StatsBucket, PooledWallet, SchemaMigration,
+    WebhookEndpoint, WebhookDelivery, WebhookState, LedgerCheckpoint
+)
+
+
+def _create_tables(*models):
+    conn = db.session.connection()
+    for model in models:
+        model.__table__.create(bind=conn, checkfirst=True)
+
+
+def _create_indexes(model, *names):
+    """
+    Creates the named indexes of `model`'s table. Always by name: the model
+    may since have gained indexes on columns a later migration adds.
+    """
+    conn = db.session.connection()
+    for index in model.__table__.indexes:
+        if index.name in names:
+            index.create(bind=conn, checkfirst=True)
+
+
+def _add_column(table, column, ddl):
+    conn = db.session.connection()
+    if column in [col['name'] for col in inspect(conn).get_columns(table)]:
+        return False
+    print(f"[Migrate] Adding {column} column to {table} table...")
+    conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {ddl}"))
+    return True
+
+
+def m001_initial_schema():
+    _create_tables(Owner, Agent, Job, LedgerEntry)
+
+
+def m002_agent_wallet_columns():
+    _add_column('agents', 'wallet_address', 'VARCHAR(42)')
+    _add_column('agents', 'encrypted_privkey', 'TEXT')
+
+
+def m003_job_listing_indexes():
+    _create_indexes(Job, 'idx_jobs_created', 'idx_jobs_status_created',
+                    'idx_jobs_buyer_created', 'idx_jobs_claimed_by_created')
+
+
+def m004_job_events():
+    _create_tables(JobEvent)
+
+
+def m005_leaderboard():
+    if _add_column('owners', 'total_profit', 'NUMERIC(20, 6) NOT NULL DEFAULT 0'):
+        db.session.execute(text(
+            "UPDATE owners SET total_profit = "
+            "(SELECT COALESCE(SUM(balance), 0) FROM agents WHERE agents.owner_id = owners.owner_id)"
+        ))
+    _create_indexes(Agent, 'idx_agents_balance')
+    _create_indexes(Owner, 'idx_owners_total_profit')
+    _create_tables(LeaderboardState)
+    if db.session.get(LeaderboardState, 1) is None:
+        db.session.add(LeaderboardState(id=1, version=0))
+
+
+def m006_stats_rollup():
+    from stats_rollup import stats_rollup
+    _create_tables(PlatformStat, StatsBucket)
+    db.session.commit()
+    stats_rollup.rebuild()
+
+
+def m007_wallet_pool():
+    _create_tables(PooledWallet)
+
+
+def m008_ledger_indexes():
+    _create_indexes(LedgerEntry, 'idx_ledger_target_entry', 'idx_ledger_task')
+
+
+def m009_row_versions():
+    _add_column('jobs', 'version', 'INTEGER NOT NULL DEFAULT 1')
+    _add_column('agents', 'version', 'INTEGER NOT NULL DEFAULT 1')
+
+
+def m010_result_verification():
+    _add_column('jobs', 'auto_settle', "BOOLEAN NOT NULL DEFAULT '0'")
+    _add_column('jobs', 'verification_status', 'VARCHAR(20)')
+
+
+def m011_webhooks():
+    _create_tables(WebhookEndpoint, WebhookDelivery, WebhookState)
+    # Start at the current end of the event log: history is not replayed to new endpoints
+    if not db.session.get(WebhookState, 1):
+        head = db.session.query(db.func.max(JobEvent.event_id)).scalar() or 0
+        db.session.add(WebhookState(id=1, last_event_id=head))
+
+
+def m012_claim_leases():
+    from config import Config
+    _add_column('jobs', 'lease_expires_at', 'TIMESTAMP')
+    _add_column('stats_buckets', 'reclaimed', 'INTEGER NOT NULL DEFAULT 0')
+    _create_indexes(Job, 'idx_jobs_lease_expiry')
+    # Claims made before leases existed get one full lease from now
+    expiry = datetime.datetime.utcnow() + datetime.timedelta(seconds=Config.CLAIM_LEASE_SECONDS)
+    db.session.execute(
+        db.update(Job).where(Job.status == 'claimed', Job.lease_expires_at.is_(None))
+        .values(lease_expires_at=expiry).execution_options(synchronize_session=False)
+    )
+
+
+def m013_job_routing():
+    from blob_store import blob_store
+    from job_router import envelope_entrypoint
+    _add_column('agents', 'capabilities', 'JSON')
+    _add_column('jobs', 'entrypoint', 'VARCHAR(100)')
+    # Only jobs that can still be (re)funded are ever routed
+    rows = db.session.query(Job.task_id, Job.envelope_json) \
+        .filter(Job.status.in_(('posted', 'funded', 'claimed')), Job.entrypoint.is_(None)).all()
+    updates = [{"task_id": task_id, "entrypoint": envelope_entrypoint(blob_store.load(envelope))}
+               for task_id, envelope in rows]
+    updates = [u for u in updates if u["entrypoint"]]
+    if updates:
+        print(f"[Migrate] Backfilling entrypoint for {len(updates)} jobs...")
+        db.session.execute(db.update(Job), updates)
+
+
+def m014_ledger_hash_chain():
+    from ledger_audit import chain_entries
+    _add_column('agents', 'ledger_head', 'VARCHAR(64)')
+    _add_column('ledger_entries', 'chain_id', 'VARCHAR(100)')
+    _add_column('ledger_entries', 'entry_hash', 'VARCHAR(64)')
+    _create_tables(LedgerCheckpoint)
+    _create_indexes(LedgerEntry, 'idx_ledger_chain_entry')
+
+    # Chain the existing history oldest first, each entry under the agent
+    # its settlement paid (fee entries included), in pages of entry_id
+    heads = {}
+    last_id = 0
+    while True:
+        rows = db.session.query(
+            LedgerEntry.entry_id, LedgerEntry.source_id, LedgerEntry.target_id, LedgerEntry.amount,
+            LedgerEntry.transaction_type, LedgerEntry.task_id, LedgerEntry.created_at, Job.claimed_by
+        ).outerjoin(Job, Job.task_id == LedgerEntry.task_id) \
+            .filter(LedgerEntry.entry_id > last_id).order_by(LedgerEntry.entry_id.asc()).limit(5000).all()
+        if not rows:
+            break
+        if not last_id:
+            print("[Migrate] Hash-chaining existing ledger entries...")
+        entries = [dict(row._mapping, chain_id=row.claimed_by or row.target_id) for row in rows]
+        chain_entries(entries, heads)
+        db.session.execute(db.update(LedgerEntry), [
+            {"entry_id": e["entry_id"], "chain_id": e["chain_id"], "entry_hash": e["entry_hash"]} for e in entries
+        ])
+        last_id = rows[-1].entry_id
+
+    agent_ids = {a for (a,) in db.session.query(Agent.agent_id).filter(Agent.agent_id.in_(heads))}
+    if agent_ids:
+        db.session.execute(db.update(Agent), [
+            {"agent_id": agent_id, "ledger_head": heads[agent_id]} for agent_id in agent_ids
+        ])
+
+
+def m015_webhook_event_gaps():
+    _add_column('webhook_state', 'gaps', "TEXT NOT NULL DEFAULT '{}'")
+
+
+def m016_stats_counter_shards():
+    # The shard joins each rollup table's primary key, which neither
+    # database can alter in place: copy the rows into a rebuilt table as shard 0
+    conn = db.session.connection()
+    for model in (PlatformStat, StatsBucket):
+        table = model.__table__.name
+        columns = [col['name'] for col in inspect(conn).get_columns(table)]
+        if 'shard' in columns:
+            continue
+        print(f"[Migrate] Rebuilding {table} with counter shards...")
+        conn.execute(text(f"ALTER TABLE {table} RENAME TO {table}_unsharded"))
+        if conn.dialect.name == 'postgresql':
+            conn.execute(text(f"ALTER INDEX {table}_pkey RENAME TO {table}_unsharded_pkey"))
+        _create_tables(model)
+        names = ', '.join(columns)
+        conn.execute(text(f"INSERT INTO {table} ({names}) SELECT {names} FROM {table}_unsharded"))
+        conn.execute(text(f"DROP TABLE {table}_unsharded"))
+
+
+def m017_job_event_prune_lease():
+    _create_tables(JobEventState)
+    if db.session.get(JobEventState, 1) is None:
+        db.session.add(JobEventState(id=1))
+
+
+MIGRATIONS = [
+    (1, m001_initial_schema),
+    (2, m002_agent_wallet_columns),
+    (3, m003_job_listing_indexes),
+    (4, m004_job_events),
+    (5, m005_leaderboard),
+    (6, m006_stats_rollup),
+    (7, m007_wallet_pool),
+    (8, m008_ledger_indexes),
+    (9, m009_row_versions),
+    (10, m010_result_verification),
+    (11, m011_webhooks),
+    (12, m012_claim_leases),
+    (13, m013_job_routing),
+    (14, m014_ledger_hash_chain),
+    (15, m015_webhook_event_gaps),
+    (16, m016_stats_counter_shards),
+    (17, m017_job_event_prune_lease),
+]
+
+
+def _applied_versions():
+    _create_tables(SchemaMigration)
+    db.session.commit()
+    return {row.version for row in SchemaMigration.query.all()}
+
+
+def upgrade(app):
+    """Applies every pending migration in order. Returns the versions applied."""
+    with app.app_context():
+        applied = _applied_versions()
+        done = []
+        for version, migration in MIGRATIONS:
+            if version in applied:
+                continue
+            name = migration.__name__
+            print(f"[Migrate] Applying {name}...")
+            try:
+                migration()
+                db.session.add(SchemaMigration(version=version, name=name))
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                raise
+            done.append(version)
+        print(f"[Migrate] Schema at version {MIGRATIONS[-1][0]} ({len(done)} applied).")
+        return done
+
+
+def status(app):
+    with app.app_context():
+        applied = _applied_versions()
+        for version, migration in MIGRATIONS:
+            state = "applied" if version in applied else "pending"
+            print(f"{version:04d} {migration.__name__:<32} {state}")
+
+
+if __name__ == "__main__":
+    from server import create_app
+    command = sys.argv[1] if len(sys.argv) > 1 else "upgrade"
+    if command == "upgrade":
+        upgrade(create_app())
+    elif command == "status":
+        status(create_app())
+    else:
+        print(f"Unknown command: {command} (expected 'upgrade' or 'status')")
+        sys.exit(1)
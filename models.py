@@ -2,8 +2,19 @@ from flask_sqlalchemy import SQLAlchemy
 from datetime import datetime
 import uuid
 from sqlalchemy import JSON, String, Numeric
+from sqlalchemy.orm import deferred
+from db_routing import RoutingSession
 
-db = SQLAlchemy()
+# Routes read-only requests to replicas when DATABASE_REPLICA_URLS is set
+db = SQLAlchemy(session_options={"class_": RoutingSession})
+
+
+class SchemaMigration(db.Model):
+    """Versions applied by migrations.py."""
+    __tablename__ = 'schema_migrations'
+    version = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(100), nullable=False)
+    applied_at = db.Column(db.DateTime, default=datetime.utcnow)
 
 
 class Owner(db.Model):
@@ -13,8 +24,14 @@ class Owner(db.Model):
     twitter_handle = db.Column(db.String(100))
     avatar_url = db.Column(db.Text)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    # Sum of the owner's agents' balances, maintained on settlement and adoption
+    total_profit = db.Column(db.Numeric(20, 6), default=0, nullable=False)
     agents = db.relationship('Agent', backref='owner', lazy=True)
 
+    __table_args__ = (
+        db.Index('idx_owners_total_profit', 'total_profit'),
+    )
+
 class Agent(db.Model):
     __tablename__ = 'agents'
     agent_id = db.Column(db.String(100), primary_key=True)
@@ -27,9 +44,17 @@ class Agent(db.Model):
     balance = db.Column(db.Numeric(20, 6), default=0)
     wallet_address = db.Column(db.String(42))
     encrypted_privkey = db.Column(db.Text)
+    capabilities = db.Column(JSON) # entrypoints GET /jobs/next routes to this agent; none means any
+    ledger_head = db.Column(db.String(64)) # entry_hash of the last ledger entry in the agent's chain
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    # Row version, bumped by every UPDATE (ORM or bulk); drives ETags on reads
+    version = db.Column(db.Integer, nullable=False, default=1, server_default='1', onupdate=db.literal_column('version + 1'))
     jobs_claimed = db.relationship('Job', backref='claimed_agent', lazy=True)
 
+    __table_args__ = (
+        db.Index('idx_agents_balance', 'balance'),
+    )
+
 class Job(db.Model):
     __tablename__ = 'jobs'
     task_id = db.Column(db.String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
@@ -41,10 +66,33 @@ class Job(db.Model):
     status = db.Column(db.String(20), default='posted') # 'posted', 'funded', 'claimed', 'submitted', 'completed'
     escrow_tx_hash = db.Column(db.String(100)) # Link to on-chain deposit
     signature = db.Column(db.String(200))      # Buyer's cryptographic sign-off
-    envelope_json = db.Column(JSON, nullable=False)
-    result_data = db.Column(JSON)
+    # Deferred: loaded only when read. Payloads past BLOB_INLINE_MAX_BYTES
+    # hold a blob_store reference instead of the value itself.
+    envelope_json = deferred(db.Column(JSON, nullable=False))
+    result_data = deferred(db.Column(JSON))
+    # envelope payload.entrypoint, copied out at post time for routing
+    entrypoint = db.Column(db.String(100))
+    # Buyer opted in to settlement as soon as the verifier passes the result
+    auto_settle = db.Column(db.Boolean, nullable=False, default=False, server_default='0')
+    verification_status = db.Column(db.String(20)) # 'pending', 'passed', 'failed', 'timeout', 'error', 'unverified'
+    # Set while claimed; the agent extends it by heartbeat or the job returns to 'funded'
+    lease_expires_at = db.Column(db.DateTime)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    # Row version, bumped by every UPDATE (ORM or bulk); drives ETags on reads
+    version = db.Column(db.Integer, nullable=False, default=1, server_default='1', onupdate=db.literal_column('version + 1'))
+
+    __table_args__ = (
+        # Keyset pagination for GET /jobs walks (created_at, task_id); the
+        # filtered variants lead with the filter column so each listing is a
+        # single index range scan.
+        db.Index('idx_jobs_created', 'created_at', 'task_id'),
+        db.Index('idx_jobs_status_created', 'status', 'created_at', 'task_id'),
+        db.Index('idx_jobs_buyer_created', 'buyer_id', 'created_at', 'task_id'),
+        db.Index('idx_jobs_claimed_by_created', 'claimed_by', 'created_at', 'task_id'),
+        # Only claimed jobs hold a lease, so the reaper's range scan touches just those
+        db.Index('idx_jobs_lease_expiry', 'lease_expires_at'),
+    )
 
 
 class LedgerEntry(db.Model):
@@ -56,5 +104,153 @@ class LedgerEntry(db.Model):
     transaction_type = db.Column(db.String(50))
     task_id = db.Column(db.String(36), db.ForeignKey('jobs.task_id'))
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    # Hash chain per paid agent (a settlement's fee entry joins the agent's
+    # chain too): entry_hash covers the entry and the previous entry_hash
+    chain_id = db.Column(db.String(100))
+    entry_hash = db.Column(db.String(64))
+
+    __table_args__ = (
+        # Per-agent history is paged newest-first on entry_id
+        db.Index('idx_ledger_target_entry', 'target_id', 'entry_id'),
+        db.Index('idx_ledger_task', 'task_id'),
+        db.Index('idx_ledger_chain_entry', 'chain_id', 'entry_id'),
+    )
+
+
+class LedgerCheckpoint(db.Model):
+    """How far each agent's ledger chain has been verified, and what the last audit found."""
+    __tablename__ = 'ledger_checkpoints'
+    agent_id = db.Column(db.String(100), primary_key=True)
+    last_entry_id = db.Column(db.Integer, nullable=False, default=0)
+    chain_head = db.Column(db.String(64))  # entry_hash at last_entry_id
+    running_sum = db.Column(db.Numeric(20, 6), nullable=False, default=0)  # payouts up to last_entry_id
+    entries = db.Column(db.Integer, nullable=False, default=0)
+    status = db.Column(db.String(10), nullable=False, default='ok')  # 'ok', 'drift', 'broken'
+    drift = db.Column(db.Numeric(20, 6), nullable=False, default=0)  # balance - running_sum
+    broken_entry_id = db.Column(db.Integer)  # first entry whose hash does not match
+    checked_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+
+class PooledWallet(db.Model):
+    """Pre-generated managed wallet waiting to be handed to a new agent."""
+    __tablename__ = 'wallet_pool'
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    wallet_address = db.Column(db.String(42), nullable=False)
+    encrypted_privkey = db.Column(db.Text, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+
+class LeaderboardState(db.Model):
+    """Single-row version counter shared by all workers' leaderboard caches."""
+    __tablename__ = 'leaderboard_state'
+    id = db.Column(db.Integer, primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+
+
+class PlatformStat(db.Model):
+    """
+    Running platform totals keyed by name, e.g. 'bounty_volume' or 'jobs_funded'.
+    Each total is split over counter shards; its value is their sum.
+    """
+    __tablename__ = 'platform_stats'
+    key = db.Column(db.String(50), primary_key=True)
+    shard = db.Column(db.Integer, primary_key=True, autoincrement=False, default=0, server_default='0')
+    value = db.Column(db.Numeric(20, 6), nullable=False, default=0)
+
+
+class StatsBucket(db.Model):
+    """Per-hour and per-day activity totals for the /stats/series charts, sharded like PlatformStat."""
+    __tablename__ = 'stats_buckets'
+    granularity = db.Column(db.String(10), primary_key=True) # 'hour', 'day'
+    bucket_start = db.Column(db.DateTime, primary_key=True)
+    shard = db.Column(db.Integer, primary_key=True, autoincrement=False, default=0, server_default='0')
+    posted = db.Column(db.Integer, nullable=False, default=0)
+    posted_volume = db.Column(db.Numeric(20, 6), nullable=False, default=0)
+    funded = db.Column(db.Integer, nullable=False, default=0)
+    claimed = db.Column(db.Integer, nullable=False, default=0)
+    submitted = db.Column(db.Integer, nullable=False, default=0)
+    completed = db.Column(db.Integer, nullable=False, default=0)
+    settled_volume = db.Column(db.Numeric(20, 6), nullable=False, default=0)
+    fees = db.Column(db.Numeric(20, 6), nullable=False, default=0)
+    reclaimed = db.Column(db.Integer, nullable=False, default=0, server_default='0') # expired claim leases
+
+
+class JobEvent(db.Model):
+    """Append-only record of job state transitions, consumed by the job feed."""
+    __tablename__ = 'job_events'
+    event_id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    task_id = db.Column(db.String(36), db.ForeignKey('jobs.task_id'), nullable=False)
+    status = db.Column(db.String(20), nullable=False)
+    buyer_id = db.Column(db.String(100))
+    claimed_by = db.Column(db.String(100))
+    price = db.Column(db.Numeric(20, 6))
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def to_dict(self):
+        return {
+            "event_id": self.event_id,
+            "task_id": self.task_id,
+            "status": self.status,
+            "buyer_id": self.buyer_id,
+            "claimed_by": self.claimed_by,
+            "price": float(self.price) if self.price is not None else None,
+        }
+
+
+class JobEventState(db.Model):
+    """Single row: when the job event log was last pruned, which leases pruning to one worker per interval."""
+    __tablename__ = 'job_event_state'
+    id = db.Column(db.Integer, primary_key=True)
+    pruned_at = db.Column(db.DateTime)
+
+
+class WebhookEndpoint(db.Model):
+    """URL receiving job events for one buyer or agent (matched on buyer_id or claimed_by)."""
+    __tablename__ = 'webhook_endpoints'
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    url = db.Column(db.Text, nullable=False)
+    subscriber_id = db.Column(db.String(100), nullable=False, index=True)
+    statuses = db.Column(db.String(200))  # comma separated filter; NULL means every status
+    secret = db.Column(db.String(64), nullable=False)
+    active = db.Column(db.Boolean, nullable=False, default=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "url": self.url,
+            "subscriber_id": self.subscriber_id,
+            "statuses": self.statuses.split(',') if self.statuses else None,
+            "active": self.active,
+        }
+
+
+class WebhookDelivery(db.Model):
+    """One job event queued for one endpoint: 'pending' until delivered, 'dead' once retries run out."""
+    __tablename__ = 'webhook_deliveries'
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    endpoint_id = db.Column(db.Integer, db.ForeignKey('webhook_endpoints.id'), nullable=False)
+    event_id = db.Column(db.Integer, nullable=False)
+    payload = db.Column(JSON, nullable=False)
+    status = db.Column(db.String(20), nullable=False, default='pending')
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    next_attempt_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    locked_until = db.Column(db.DateTime)
+    last_error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    delivered_at = db.Column(db.DateTime)
+
+    __table_args__ = (
+        # The dispatcher scans due pending deliveries; the endpoint view counts by status
+        db.Index('idx_webhook_deliveries_due', 'status', 'next_attempt_at'),
+        db.Index('idx_webhook_deliveries_endpoint', 'endpoint_id', 'status'),
+    )
 
 
+class WebhookState(db.Model):
+    """Single row: the last job event fanned out to webhook deliveries."""
+    __tablename__ = 'webhook_state'
+    id = db.Column(db.Integer, primary_key=True)
+    last_event_id = db.Column(db.Integer, nullable=False, default=0)
+    # Lower event ids not committed yet when fanned out past (job_feed.EventTail gaps, JSON)
+    gaps = db.Column(db.Text, nullable=False, default='{}', server_default='{}')
@@ -0,0 +1,70 @@
+import hashlib
+import threading
+from collections import OrderedDict
+
+from flask import Response, render_template, request
+
+
+class PageCache:
+    """
+    Bounded LRU of rendered HTML pages, served with validators.
+
+    Entries are keyed by whatever identifies a page's content, e.g.
+    (task_id, updated_at) for share pages, so an edit to the job simply
+    misses and the stale entry ages out. Each entry carries a strong ETag
+    (a hash of the rendered bytes), and responses honor If-None-Match /
+    If-Modified-Since with a 304, so CDNs and browsers revalidate instead
+    of pulling the page again.
+    """
+
+    def __init__(self, max_entries=1024):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def init_app(self, app):
+        self.max_entries = app.config.get('PAGE_CACHE_SIZE', self.max_entries)
+
+    def _get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+            else:
+                self.misses += 1
+            return entry
+
+    def _put(self, key, entry):
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def render(self, key, template, context=None, last_modified=None, max_age=60):
+        """
+        Returns the response for `template` rendered with the result of
+        `context()`. `context` is only called on a cache miss, so it can
+        defer the expensive loads.
+        """
+        entry = self._get(key)
+        if entry is None:
+            body = render_template(template, **(context() if context else {})).encode('utf-8')
+            entry = (body, hashlib.sha256(body).hexdigest()[:32])
+            self._put(key, entry)
+
+        body, etag = entry
+        response = Response(body, mimetype='text/html')
+        response.set_etag(etag)
+        if last_modified is not None:
+            response.last_modified = last_modified
+        response.cache_control.public = True
+        response.cache_control.max_age = max_age
+        return response.make_conditional(request)
+
+
+# Singleton instance
+page_cache = PageCache()
@@ -0,0 +1,274 @@
+import logging
+import math
+import threading
+import time
+from collections import OrderedDict
+
+from flask import current_app, jsonify, request
+from sqlalchemy import Column, Float, MetaData, String, Table, create_engine, event
+from sqlalchemy.exc import IntegrityError
+
+try:
+    import redis
+except ImportError:  # optional: only needed for a redis:// store
+    redis = None
+
+logger = logging.getLogger('relay')
+
+# Endpoint classes, each with its own (tokens per second, burst) limit
+LIMIT_CLASSES = ('reads', 'claims', 'settlements', 'writes')
+# Identity fields checked, in order, in the view args, query string and JSON body
+IDENTITY_FIELDS = ('agent_id', 'buyer_id')
+
+
+class MemoryStore:
+    """Buckets in this process only: limits apply per worker. Also the stand-in store for tests."""
+
+    def __init__(self, max_keys=100000):
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, key, rate, burst, count):
+        with self._lock:
+            now = time.monotonic()
+            tokens, updated = self._buckets.pop(key, (burst, now))
+            tokens = min(burst, tokens + (now - updated) * rate)
+            granted = min(count, int(tokens))
+            self._buckets[key] = (tokens - granted, now)
+            if len(self._buckets) > self.max_keys:
+                # Least recently used first; an evicted bucket comes back full
+                self._buckets.popitem(last=False)
+        return granted, tokens - granted
+
+
+class SQLStore:
+    """
+    Buckets in a SQL table, shared by every worker that points at the same
+    database (a local SQLite file is enough for one host). Each take is one
+    short write transaction.
+    """
+
+    def __init__(self, url):
+        self.engine = create_engine(url)
+        self.table = Table(
+            'rate_limit_buckets', MetaData(),
+            Column('key', String(200), primary_key=True),
+            Column('tokens', Float, nullable=False),
+            Column('updated_at', Float, nullable=False),
+        )
+        if self.engine.dialect.name == 'sqlite':
+            # Take the write lock up front so concurrent takes serialize
+            # instead of failing to upgrade a shared lock
+            @event.listens_for(self.engine, 'connect')
+            def _autocommit(dbapi_conn, record):
+                dbapi_conn.isolation_level = None
+
+            @event.listens_for(self.engine, 'begin')
+            def _begin_immediate(conn):
+                conn.exec_driver_sql('BEGIN IMMEDIATE')
+        self._created = False
+
+    def take(self, key, rate, burst, count):
+        if not self._created:
+            # On first use rather than at startup: the app factory does no database I/O
+            self.table.create(self.engine, checkfirst=True)
+            self._created = True
+        try:
+            return self._take(key, rate, burst, count)
+        except IntegrityError:
+            # Another worker created the bucket first; it exists now
+            return self._take(key, rate, burst, count)
+
+    def _take(self, key, rate, burst, count):
+        table = self.table
+        with self.engine.begin() as conn:
+            row = conn.execute(
+                table.select().where(table.c.key == key).with_for_update()
+            ).first()
+            # Read the clock once the row is locked, and never move a bucket
+            # back in time: a stale timestamp would refill the same interval twice
+            now = time.time() if row is None else max(time.time(), row.updated_at)
+            tokens = burst if row is None else min(burst, row.tokens + (now - row.updated_at) * rate)
+            granted = min(count, int(tokens))
+            values = {"tokens": tokens - granted, "updated_at": now}
+            if row is None:
+                conn.execute(table.insert().values(key=key, **values))
+            else:
+                conn.execute(table.update().where(table.c.key == key).values(**values))
+        return granted, tokens - granted
+
+
+class RedisStore:
+    """Buckets in Redis, refilled and debited atomically by a server-side script on Redis time."""
+
+    SCRIPT = """
+        local rate, burst, count = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3])
+        local time = redis.call('TIME')
+        local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+        local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'updated_at')
+        local tokens = tonumber(bucket[1]) or burst
+        local updated = tonumber(bucket[2]) or now
+        tokens = math.min(burst, tokens + math.max(0, now - updated) * rate)
+        local granted = math.min(count, math.floor(tokens))
+        tokens = tokens - granted
+        redis.call('HSET', KEYS[1], 'tokens', tokens, 'updated_at', now)
+        redis.call('EXPIRE', KEYS[1], math.ceil(burst / rate) + 1)
+        return {granted, tostring(tokens)}
+    """
+
+    def __init__(self, url):
+        if redis is None:
+            raise RuntimeError("A redis:// RATE_LIMIT_STORAGE_URL requires the redis package")
+        self._take = redis.Redis.from_url(url).register_script(self.SCRIPT)
+
+    def take(self, key, rate, burst, count):
+        granted, tokens = self._take(keys=[f"relay:rl:{key}"], args=[rate, burst, count])
+        return int(granted), float(tokens)
+
+
+def store_from_url(url):
+    if url.startswith('memory://'):
+        return MemoryStore()
+    if url.startswith(('redis://', 'rediss://', 'unix://')):
+        return RedisStore(url)
+    return SQLStore(url)
+
+
+def caller_identity(trusted_proxies=0):
+    """
+    Who the current request is from: the first agent_id / buyer_id in the
+    view args, query string or JSON body, else the client IP.
+    """
+    sources = [request.view_args or {}, request.args]
+    if request.is_json:
+        body = request.get_json(silent=True)
+        if isinstance(body, dict):
+            sources.append(body)
+    for field in IDENTITY_FIELDS:
+        for source in sources:
+            value = source.get(field)
+            if value and isinstance(value, str):
+                return f"{field}={value}"
+    return f"ip={client_ip(trusted_proxies)}"
+
+
+def client_ip(trusted_proxies=0):
+    route = request.access_route
+    # Behind N trusted proxies the client is the Nth address from the end
+    return route[-trusted_proxies] if trusted_proxies and len(route) >= trusted_proxies else request.remote_addr
+
+
+class _LocalBucket:
+    __slots__ = ('tokens', 'blocked_until')
+
+    def __init__(self):
+        self.tokens = 0
+        self.blocked_until = 0.0
+
+
+class RateLimiter:
+    """
+    Token-bucket admission control per caller and endpoint class.
+
+    Views opt in with `@rate_limiter.limit('reads')` (see LIMIT_CLASSES).
+    Each caller (see `caller_identity`) gets its own bucket per class.
+
+    The authoritative buckets live in the store named by
+    RATE_LIMIT_STORAGE_URL (memory:// for per-worker limits, redis:// or
+    any SQL URL to share them across workers). Workers do not consult the
+    store per request: each leases a slice of a bucket's tokens at a time
+    (RATE_LIMIT_LEASE of its burst) and spends them locally, and a caller
+    that finds the store empty is refused locally until its Retry-After
+    passes. The common path is a dict lookup and a decrement under a lock.
+    Leased-but-unspent tokens let a caller exceed its limit by at most
+    one lease per worker. If the store is unreachable requests are
+    admitted: the limiter must not take the API down with it. Refusals
+    show up in /metrics as 429s per endpoint.
+    """
+
+    def __init__(self, limits=None, lease=0.1, max_keys=100000, trusted_proxies=0):
+        self.limits = dict(limits or {})
+        self.lease = lease
+        self.max_keys = max_keys
+        self.trusted_proxies = trusted_proxies
+        self.enabled = True
+        self.store = None
+        self._local = OrderedDict()
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.enabled = app.config.get('RATE_LIMIT_ENABLED', self.enabled)
+        self.limits = dict(app.config.get('RATE_LIMITS', self.limits))
+        self.lease = app.config.get('RATE_LIMIT_LEASE', self.lease)
+        self.trusted_proxies = app.config.get('RATE_LIMIT_TRUSTED_PROXIES', self.trusted_proxies)
+        self.store = store_from_url(app.config.get('RATE_LIMIT_STORAGE_URL', 'memory://'))
+        app.before_request(self._before_request)
+
+    @staticmethod
+    def limit(limit_class):
+        """Marks a view as rate limited under `limit_class`."""
+        if limit_class not in LIMIT_CLASSES:
+            raise ValueError(f"Unknown rate limit class: {limit_class}")
+
+        def mark(view):
+            view.rate_limit_class = limit_class
+            return view
+        return mark
+
+    def _before_request(self):
+        if not self.enabled:
+            return None
+        view = current_app.view_functions.get(request.endpoint)
+        limit_class = getattr(view, 'rate_limit_class', None)
+        if limit_class is None or limit_class not in self.limits:
+            return None
+        key = f"{limit_class}:{caller_identity(self.trusted_proxies)}"
+        retry_after = self.acquire(key, *self.limits[limit_class])
+        if retry_after is None:
+            return None
+        response = jsonify({"error": "Rate limit exceeded", "limit_class": limit_class})
+        response.status_code = 429
+        response.headers['Retry-After'] = str(max(1, math.ceil(retry_after)))
+        return response
+
+    def acquire(self, key, rate, burst):
+        """Spends one token from `key`'s bucket. Returns None if admitted, else seconds to wait."""
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._local.get(key)
+            if bucket is None:
+                bucket = self._local[key] = _LocalBucket()
+                if len(self._local) > self.max_keys:
+                    self._evict()
+            else:
+                self._local.move_to_end(key)
+            if bucket.tokens:
+                bucket.tokens -= 1
+                return None
+            if now < bucket.blocked_until:
+                return bucket.blocked_until - now
+
+        # Local slice spent: lease the next one from the shared bucket
+        try:
+            granted, remaining = self.store.take(key, rate, burst, max(1, int(burst * self.lease)))
+        except Exception:
+            logger.exception("Rate limit store unavailable; admitting %s", key)
+            return None
+        with self._lock:
+            if granted:
+                bucket.tokens += granted - 1
+                return None
+            wait = (1 - remaining) / rate
+            bucket.blocked_until = now + wait
+            return wait
+
+    def _evict(self):
+        # Least recently used keys first (acquire moves a key to the end on
+        # every hit); dropping a local slice only forfeits its leased tokens
+        for _ in range(len(self._local) // 10):
+            self._local.popitem(last=False)
+
+
+# Singleton instance
+rate_limiter = RateLimiter()
@@ -0,0 +1,266 @@
+"""
+Async client for the relay API.
+
+One `RelayClient` holds a pooled set of keep-alive connections and a
+concurrency limit, so a single process can run hundreds of agents as
+asyncio tasks without opening a connection per call:
+
+    async with RelayClient("https://synai.shop") as relay:
+        await asyncio.gather(*(run_worker(relay, f"agent_{i}") for i in range(200)))
+
+Transient failures (connection errors, 408/425/429 and 5xx) are retried
+with full-jitter exponential backoff, honoring Retry-After. Other 4xx
+responses are the relay's answer (a lost claim, a bad payload) and raise
+`RelayError` straight away.
+
+Calls that change state (posting, funding, claiming, submitting,
+confirming, including GET /jobs/next) could be applied twice by a retry,
+so they are only retried when the relay cannot have acted on them: the
+connection was never made, or it answered 429/503 with a Retry-After.
+"""
+import asyncio
+import random
+
+import httpx
+
+DEFAULT_BASE_URL = "https://synai.shop"
+RETRY_STATUSES = frozenset({408, 425, 429, 500, 502, 503, 504})
+# What is still safe to retry for non-idempotent calls
+UNSENT_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+UNAPPLIED_STATUSES = frozenset({429, 503})  # with a Retry-After
+IDEMPOTENT_METHODS = frozenset({"GET", "HEAD", "PUT", "DELETE"})
+MAX_BATCH_CONFIRM = 500
+FEED_TIMEOUT = 25
+LEASE_HEARTBEAT_INTERVAL = 60  # well inside the relay's default 300s claim lease
+
+
+def _retryable(idempotent, resp=None, error=None):
+    if error is not None:
+        return idempotent or isinstance(error, UNSENT_ERRORS)
+    if idempotent:
+        return resp.status_code in RETRY_STATUSES
+    return resp.status_code in UNAPPLIED_STATUSES and "Retry-After" in resp.headers
+
+
+class RelayError(Exception):
+    """Non-retryable (or retries exhausted) error response from the relay."""
+
+    def __init__(self, status_code, body):
+        self.status_code = status_code
+        self.body = body
+        message = body.get("error") if isinstance(body, dict) else body
+        super().__init__(f"{status_code}: {message}")
+
+
+class RelayClient:
+    def __init__(self, base_url=DEFAULT_BASE_URL, max_connections=100, max_concurrency=50, max_feed_waiters=None,
+                 max_retries=4, backoff_base=0.5, backoff_cap=10.0, timeout=FEED_TIMEOUT + 10):
+        self.base_url = base_url.rstrip("/")
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        # Feed long-polls sit on a connection for up to FEED_TIMEOUT, so they
+        # get their own slots (by default the connections the other calls
+        # leave free): claims, submits and heartbeats never queue behind them
+        self._feed_semaphore = asyncio.Semaphore(max_feed_waiters or max(max_connections - max_concurrency, 1))
+        self._http = httpx.AsyncClient(
+            base_url=self.base_url,
+            timeout=timeout,
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+        )
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    async def close(self):
+        await self._http.aclose()
+
+    def _backoff(self, attempt, retry_after=None):
+        if retry_after is not None:
+            try:
+                return min(float(retry_after), self.backoff_cap)
+            except ValueError:
+                pass
+        return random.uniform(0, min(self.backoff_cap, self.backoff_base * 2 ** attempt))
+
+    async def request(self, method, path, json=None, params=None, idempotent=None, long_poll=False):
+        """
+        Sends one call, retrying transient failures. Returns (body, headers).
+        `idempotent` defaults to the method's semantics (see module docstring);
+        `long_poll` calls are limited separately from the others.
+        """
+        semaphore = self._feed_semaphore if long_poll else self._semaphore
+        if idempotent is None:
+            idempotent = method in IDEMPOTENT_METHODS
+        attempt = 0
+        while True:
+            retry_after = None
+            try:
+                async with semaphore:
+                    resp = await self._http.request(method, path, json=json, params=params)
+            except httpx.TransportError as e:
+                if attempt >= self.max_retries or not _retryable(idempotent, error=e):
+                    raise
+            else:
+                body = resp.json() if resp.headers.get("content-type", "").startswith("application/json") else resp.text
+                if resp.status_code < 400:
+                    return body, resp.headers
+                if attempt >= self.max_retries or not _retryable(idempotent, resp=resp):
+                    raise RelayError(resp.status_code, body)
+                retry_after = resp.headers.get("Retry-After")
+            # Sleep outside the semaphore so backing-off calls don't hold slots
+            await asyncio.sleep(self._backoff(attempt, retry_after))
+            attempt += 1
+
+    async def _call(self, method, path, json=None, params=None, idempotent=None, long_poll=False):
+        body, _ = await self.request(method, path, json=json, params=params, idempotent=idempotent,
+                                     long_poll=long_poll)
+        return body
+
+    # --- Jobs ---
+
+    async def post_job(self, buyer_id, title, price, envelope_json, description=None, auto_settle=False):
+        """`auto_settle` lets the relay settle as soon as the envelope's verifier passes."""
+        body = await self._call("POST", "/jobs", json={
+            "title": title,
+            "description": description,
+            "terms": {"price": price, "auto_settle": auto_settle},
+            "buyer_id": buyer_id,
+            "envelope_json": envelope_json,
+        })
+        return body["task_id"]
+
+    async def fund_job(self, task_id, escrow_tx_hash):
+        return await self._call("POST", f"/jobs/{task_id}/fund", json={"escrow_tx_hash": escrow_tx_hash})
+
+    async def claim_job(self, task_id, agent_id):
+        """Returns False if another agent got there first."""
+        try:
+            await self._call("POST", f"/jobs/{task_id}/claim", json={"agent_id": agent_id})
+            return True
+        except RelayError as e:
+            if e.status_code in (403, 404):
+                return False
+            raise
+
+    async def claim_jobs(self, agent_id, limit=1):
+        """Claims up to `limit` funded jobs in one call. Returns the claimed task_ids."""
+        body = await self._call("POST", "/jobs/claim", json={"agent_id": agent_id, "limit": limit})
+        return body["claimed"]
+
+    async def next_job(self, agent_id):
+        """Claims the relay's best match for the agent's capabilities. Returns the job, or None."""
+        body = await self._call("GET", "/jobs/next", params={"agent_id": agent_id}, idempotent=False)
+        return body or None
+
+    async def heartbeat(self, task_id, agent_id):
+        """Renews the claim lease. Returns False if the job was reclaimed."""
+        try:
+            # Renewing twice only pushes the expiry out again
+            await self._call("POST", f"/jobs/{task_id}/heartbeat", json={"agent_id": agent_id}, idempotent=True)
+            return True
+        except RelayError as e:
+            if e.status_code == 409:
+                return False
+            raise
+
+    async def keep_lease(self, task_id, agent_id, interval=LEASE_HEARTBEAT_INTERVAL):
+        """
+        Heartbeats every `interval` seconds until cancelled, for work that can
+        outlast the relay's claim lease. Returns if the lease is lost.
+        """
+        while True:
+            await asyncio.sleep(interval)
+            if not await self.heartbeat(task_id, agent_id):
+                return
+
+    async def submit_result(self, task_id, agent_id, result):
+        return await self._call("POST", f"/jobs/{task_id}/submit", json={"agent_id": agent_id, "result": result})
+
+    async def confirm_job(self, task_id, buyer_id, signature):
+        return await self._call("POST", f"/jobs/{task_id}/confirm", json={"buyer_id": buyer_id, "signature": signature})
+
+    async def get_job(self, task_id):
+        return await self._call("GET", f"/jobs/{task_id}")
+
+    async def list_jobs(self, **filters):
+        """One page of GET /jobs. Returns (jobs, next_cursor)."""
+        body, headers = await self.request("GET", "/jobs", params={k: v for k, v in filters.items() if v is not None})
+        return body, headers.get("X-Next-Cursor")
+
+    # --- Agents ---
+
+    async def set_capabilities(self, agent_id, entrypoints):
+        """Entrypoints next_job routes to this agent; an empty list means any."""
+        body = await self._call("PUT", f"/agents/{agent_id}/capabilities", json={"entrypoints": entrypoints})
+        return body["capabilities"]
+
+    # --- Feed ---
+
+    async def feed_cursor(self):
+        """Current head of the job feed, to subscribe from before listing."""
+        body = await self._call("GET", "/jobs/feed")
+        return body["cursor"]
+
+    async def wait_for(self, cursor, status=None, buyer_id=None, timeout=FEED_TIMEOUT):
+        """Long-polls the feed. Returns (events, cursor, resync)."""
+        body = await self._call("GET", "/jobs/feed", params={
+            k: v for k, v in {"cursor": cursor, "status": status, "buyer_id": buyer_id, "timeout": timeout}.items()
+            if v is not None
+        }, long_poll=True)
+        return body["events"], body["cursor"], body["resync"]
+
+    async def watch(self, status, buyer_id=None, limit=10):
+        """
+        Yields jobs entering `status`, forever: a listing to catch up, then the
+        feed. Falls back to a fresh listing whenever the feed asks for a resync.
+        """
+        cursor = await self.feed_cursor()
+        jobs, _ = await self.list_jobs(status=status, buyer_id=buyer_id, limit=limit)
+        while True:
+            for job in jobs:
+                yield job
+            events, cursor, resync = await self.wait_for(cursor, status=status, buyer_id=buyer_id)
+            if resync:
+                jobs, _ = await self.list_jobs(status=status, buyer_id=buyer_id, limit=limit)
+            else:
+                jobs = events
+
+    # --- Ledger ---
+
+    async def balance(self, agent_id):
+        body = await self._call("GET", f"/ledger/{agent_id}")
+        return body["balance"]
+
+    # --- Batch helpers ---
+
+    async def post_and_fund(self, buyer_id, title, price, envelope_json, escrow_tx_hash, description=None,
+                            auto_settle=False):
+        task_id = await self.post_job(buyer_id, title, price, envelope_json, description, auto_settle)
+        await self.fund_job(task_id, escrow_tx_hash)
+        return task_id
+
+    async def post_and_fund_many(self, buyer_id, specs):
+        """
+        Posts and funds each spec (dicts of post_and_fund kwargs) concurrently.
+        Returns task_ids, or the exception, in spec order.
+        """
+        return await asyncio.gather(
+            *(self.post_and_fund(buyer_id, **spec) for spec in specs), return_exceptions=True
+        )
+
+    async def confirm_batch(self, buyer_id, signatures):
+        """
+        Settles {task_id: signature} through /jobs/confirm/batch, chunked to the
+        relay's per-call cap. Returns the concatenated per-item results.
+        """
+        items = [{"task_id": t, "signature": s} for t, s in signatures.items()]
+        chunks = [items[i:i + MAX_BATCH_CONFIRM] for i in range(0, len(items), MAX_BATCH_CONFIRM)]
+        bodies = await asyncio.gather(
+            *(self._call("POST", "/jobs/confirm/batch", json={"buyer_id": buyer_id, "items": chunk}) for chunk in chunks)
+        )
+        return [item for body in bodies for item in body["results"]]
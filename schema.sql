@@ -52,3 +52,9 @@ CREATE TABLE ledger_entries (
 -- Indices for Ranking Performance
 CREATE INDEX idx_agents_balance ON agents (balance DESC);
 CREATE INDEX idx_jobs_status ON jobs (status);
+
+-- Indices for GET /jobs keyset pagination (created_at, task_id)
+CREATE INDEX idx_jobs_created ON jobs (created_at, task_id);
+CREATE INDEX idx_jobs_status_created ON jobs (status, created_at, task_id);
+CREATE INDEX idx_jobs_buyer_created ON jobs (buyer_id, created_at, task_id);
+CREATE INDEX idx_jobs_claimed_by_created ON jobs (claimed_by, created_at, task_id);
@@ -1,216 +1,806 @@
-from flask import Flask, request, jsonify, render_template_string, render_template
-from models import db, Owner, Agent, Job, LedgerEntry
+from flask import Flask, Blueprint, Response, current_app, request, jsonify, render_template, stream_with_context
+from models import db, Owner, Agent, Job, LedgerEntry, WebhookEndpoint, WebhookDelivery
+from job_feed import job_feed, record_job_event, record_job_events, decode_feed_cursor
+from leaderboard import leaderboard
+from stats_rollup import stats_rollup, GRANULARITIES, JOB_STATUSES
 from config import Config
 import os
 import uuid
+import base64
+import secrets
 import datetime
+import itertools
+import json
+import threading
+import logging
 from decimal import Decimal
-from wallet_manager import wallet_manager
-from sqlalchemy import text, inspect
+from wallet_pool import wallet_pool
+from instrumentation import instrumentation
+from page_cache import page_cache
+from compression import compression
+from json_provider import RelayJSONProvider, ndjson_stream
+from blob_store import blob_store
+from dashboard_state import dashboard_state, decode_cursor as decode_dashboard_cursor
+from verifier import verifier, VerificationTimeout, PATTERN_ERRORS
+from webhooks import webhook_dispatcher
+from leases import lease_reaper
+from job_router import job_router, envelope_entrypoint, ENTRYPOINT_MAX_LENGTH
+from rate_limit import rate_limiter
+from db_routing import db_router
+from group_commit import group_commit
+from ledger_audit import ledger_auditor, chain_entries, ledger_amount
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import load_only, undefer
 
-app = Flask(__name__)
-app.config.from_object(Config)
+relay = Blueprint('relay', __name__)
+logger = logging.getLogger('relay')
 
-db.init_app(app)
+_services_lock = threading.Lock()
+_services_started = False
 
 
-# Initialize Database
-print("[Relay] Starting SYNAI Relay Protocol Service...")
-with app.app_context():
-    try:
-        print(f"[Relay] Testing Database Connection...")
-        db.create_all()
-        # Migration Helper: Ensure wallet columns exist
-        print("[Relay] Running lightweight migrations...")
-        with db.engine.connect() as conn:
-            inspector = inspect(db.engine)
-            existing_columns = [col['name'] for col in inspector.get_columns('agents')]
-            
-            if 'wallet_address' not in existing_columns:
-                print("[Relay] Adding wallet_address column to agents table...")
-                conn.execute(text("ALTER TABLE agents ADD COLUMN wallet_address VARCHAR(42)"))
-            
-            if 'encrypted_privkey' not in existing_columns:
-                print("[Relay] Adding encrypted_privkey column to agents table...")
-                conn.execute(text("ALTER TABLE agents ADD COLUMN encrypted_privkey TEXT"))
-            
-            conn.commit()
-            
-        print("[Relay] Database check and migrations passed.")
-    except Exception as e:
-        print(f"[FATAL ERROR] Database initialization failed: {e}")
+def create_app(config=Config):
+    """
+    Application factory. Does no database I/O: the schema is managed by
+    migrations.py at release time, and background services start on the
+    first request a worker serves.
+    """
+    app = Flask(__name__)
+    app.config.from_object(config)
+    app.json = RelayJSONProvider(app)
+
+    if not logging.getLogger().handlers:
+        logging.basicConfig(format="[%(name)s] %(levelname)s %(message)s")
+    logging.getLogger('relay').setLevel(app.config['LOG_LEVEL'])
+
+    db.init_app(app)
+    instrumentation.init_app(app)
+    rate_limiter.init_app(app)
+    db_router.init_app(app)
+    group_commit.init_app(app)
+    compression.init_app(app)
+    job_feed.init_app(app)
+    wallet_pool.init_app(app)
+    page_cache.init_app(app)
+    blob_store.init_app(app)
+    dashboard_state.init_app(app)
+    verifier.init_app(app)
+    webhook_dispatcher.init_app(app)
+    lease_reaper.init_app(app)
+    job_router.init_app(app)
+    ledger_auditor.init_app(app)
+    stats_rollup.init_app(app)
+    app.register_blueprint(relay)
+    return app
+
+
+@relay.before_app_request
+def _start_background_services():
+    global _services_started
+    if _services_started:
+        return
+    with _services_lock:
+        if not _services_started:
+            wallet_pool.ensure_started()
+            dashboard_state.ensure_started()
+            webhook_dispatcher.ensure_started()
+            lease_reaper.ensure_started()
+            job_router.ensure_started()
+            ledger_auditor.ensure_started()
+            _services_started = True
 
-@app.route('/health')
+def _events_committed():
+    """Wakes the job feed and webhook dispatcher after a commit that wrote job events."""
+    job_feed.notify()
+    webhook_dispatcher.notify()
+
+@relay.route('/health')
 def health_check():
     return jsonify({"status": "healthy", "service": "synai-relay"}), 200
 
-@app.route('/')
+@relay.route('/')
 def landing():
     return render_template('landing.html')
 
-@app.route('/dashboard')
+@relay.route('/dashboard')
 def dashboard():
     return render_template('index.html')
 
-@app.route('/install.md')
+@relay.route('/dashboard/state', methods=['GET'])
+@rate_limiter.limit('reads')
+@db_router.replica_reads
+def get_dashboard_state():
+    """
+    What changed on the dashboard since `since` (the cursor from the previous
+    response): jobs touched, and rankings/stats when they may have moved.
+    Without a cursor, or with one past retention, a full snapshot flagged
+    `reset` is returned.
+    """
+    try:
+        since = decode_dashboard_cursor(request.args['since']) if request.args.get('since') else None
+    except ValueError as e:
+        return jsonify({"error": f"Invalid query parameter: {e}"}), 400
+    return jsonify(dashboard_state.delta(since)), 200
+
+@relay.route('/install.md')
 def install_script():
     return render_template('install.md')
 
-@app.route('/auth/twitter')
+# Share pages are revalidated by CDNs/browsers after this long
+SHARE_PAGE_MAX_AGE = 60
+
+@relay.route('/auth/twitter')
 def auth_twitter():
     # In a full app, this would redirect to Twitter OAuth
     # For now, we provide a smooth demo entry
-    html = """
-    <body style="background:#020202; color:#fff; font-family:sans-serif; display:flex; justify-content:center; align-items:center; height:100vh; text-align:center; background-image: radial-gradient(circle at 50% 50%, rgba(188, 19, 254, 0.1) 0%, transparent 80%);">
-        <div style="max-width:400px; padding:40px; border:1px solid rgba(255,255,255,0.1); border-radius:24px; background:rgba(255,255,255,0.03); backdrop-filter:blur(20px);">
-            <div style="font-size:40px; margin-bottom:20px;">🐦</div>
-            <h1 style="color:#bc13fe; margin-bottom:10px; font-size:24px;">DEMO AUTH MODE</h1>
-            <p style="color:#888; line-height:1.6; font-size:14px; margin-bottom:30px;">Twitter API keys are not yet configured in production. You are entering as <b>Test_User_01</b>.</p>
-            <a href="/dashboard" style="display:block; background:#bc13fe; color:#fff; text-decoration:none; padding:12px; border-radius:12px; font-weight:bold; transition:0.2s;">Enter Dashboard</a>
-            <p style="margin-top:20px; font-size:10px; color:#555;">PROCESSED BY SYNAI SECURITY LAYER</p>
-        </div>
-    </body>
-    """
-    return render_template_string(html)
+    return page_cache.render(('auth_twitter',), 'auth_twitter.html', max_age=SHARE_PAGE_MAX_AGE)
 
-@app.route('/ledger/ranking', methods=['GET'])
+@relay.route('/ledger/ranking', methods=['GET'])
+@rate_limiter.limit('reads')
+@db_router.replica_reads
 
 def get_ranking():
-    # Sort agents by balance (descending)
-    agents = Agent.query.order_by(Agent.balance.desc()).limit(10).all()
-    
-    agent_ranking = []
-    for a in agents:
-        agent_ranking.append({
-            "agent_id": a.agent_id,
-            "balance": float(a.balance),
-            "owner_id": a.owner.username if a.owner and not a.is_ghost else "[ENCRYPTED]",
-            "owner_twitter": a.owner.twitter_handle if a.owner else None,
-            "wallet_address": a.wallet_address,
-            "is_ghost": a.is_ghost
-        })
+    agent_ranking, owner_ranking = leaderboard.snapshot()
     
     # Platform Stats
-    total_agents = Agent.query.count()
-    total_bounty_volume = db.session.query(db.func.sum(Job.price)).scalar() or 0
-    active_tasks = Job.query.filter(Job.status != 'completed').count()
-    platform_revenue = db.session.query(db.func.sum(LedgerEntry.amount)).filter(LedgerEntry.target_id == 'platform_admin').scalar() or 0
-    
-    # Aggregate by owner for owner ranking
-    unique_owners = Owner.query.all()
-    owner_ranking = []
-    for o in unique_owners:
-        total_profit = sum(float(a.balance) for a in o.agents)
-        owner_ranking.append({
-            "owner_id": o.username,
-            "total_profit": total_profit
-        })
-    owner_ranking.sort(key=lambda x: x['total_profit'], reverse=True)
+    totals = stats_rollup.totals()
+    active_tasks = int(totals['jobs_total']) - totals['jobs_by_status']['completed']
     
     return jsonify({
         "stats": {
-            "total_agents": total_agents,
-            "total_bounty_volume": float(total_bounty_volume),
+            "total_agents": int(totals['total_agents']),
+            "total_bounty_volume": totals['bounty_volume'],
             "active_tasks": active_tasks
         },
         "agent_ranking": agent_ranking,
-        "owner_ranking": owner_ranking[:10],
-        "platform_revenue": float(platform_revenue)
+        "owner_ranking": owner_ranking,
+        "platform_revenue": totals['platform_revenue']
     }), 200
 
-@app.route('/ledger/<agent_id>', methods=['GET'])
+STATS_SERIES_DEFAULT_LIMIT = 48
+STATS_SERIES_MAX_LIMIT = 1000
+
+
+@relay.route('/stats/series', methods=['GET'])
+@rate_limiter.limit('reads')
+@db_router.replica_reads
+def get_stats_series():
+    """
+    Time-bucketed platform activity for charts, served from the rollup.
+
+    Query params: granularity (hour|day), since / until (ISO 8601) and
+    limit (most recent N buckets, used when no range is given).
+    """
+    args = request.args
+    granularity = args.get('granularity', 'hour')
+    if granularity not in GRANULARITIES:
+        return jsonify({"error": f"granularity must be one of {', '.join(GRANULARITIES)}"}), 400
+    try:
+        since = datetime.datetime.fromisoformat(args['since']) if args.get('since') else None
+        until = datetime.datetime.fromisoformat(args['until']) if args.get('until') else None
+        limit = min(int(args.get('limit', STATS_SERIES_DEFAULT_LIMIT)), STATS_SERIES_MAX_LIMIT) if not since else None
+        if limit is not None and limit < 1:
+            raise ValueError("limit must be positive")
+    except ValueError as e:
+        return jsonify({"error": f"Invalid query parameter: {e}"}), 400
+
+    buckets = stats_rollup.series(granularity, since, until, limit)
+    return jsonify({
+        "granularity": granularity,
+        "series": [{
+            "bucket_start": b.bucket_start.isoformat(),
+            "posted": b.posted,
+            "posted_volume": float(b.posted_volume),
+            "funded": b.funded,
+            "claimed": b.claimed,
+            "submitted": b.submitted,
+            "completed": b.completed,
+            "settled_volume": float(b.settled_volume),
+            "fees": float(b.fees),
+            "reclaimed": b.reclaimed
+        } for b in buckets]
+    }), 200
+
+def _unchanged_since(key, version):
+    """
+    Short-circuits a versioned read. Returns a bodiless 304 when If-None-Match
+    already names this version, a 204 when ?since_version= is at or past it,
+    or None when the caller should serialize the row.
+    """
+    etag = f"{key}-{version}"
+    if request.if_none_match.contains_weak(etag):
+        response = Response(status=304)
+    else:
+        since = request.args.get('since_version')
+        if since is None:
+            return None
+        try:
+            if version > int(since):
+                return None
+        except ValueError as e:
+            return jsonify({"error": f"Invalid query parameter: {e}"}), 400
+        response = Response(status=204)
+    response.set_etag(etag)
+    return response
+
+@relay.route('/ledger/<agent_id>', methods=['GET'])
+@rate_limiter.limit('reads')
+@db_router.replica_reads
 def get_balance(agent_id):
-    agent = Agent.query.filter_by(agent_id=agent_id).first()
-    if not agent:
-        return jsonify({"balance": 0.0}), 200
-    return jsonify({"balance": float(agent.balance)}), 200
+    row = db.session.query(Agent.balance, Agent.version).filter_by(agent_id=agent_id).first()
+    # Unregistered agents read as an empty balance at version 0
+    balance, version = row if row else (Decimal(0), 0)
+    unchanged = _unchanged_since(agent_id, version)
+    if unchanged is not None:
+        return unchanged
+    response = jsonify({"balance": float(balance), "version": version})
+    response.set_etag(f"{agent_id}-{version}")
+    return response, 200
+
+LEDGER_HISTORY_DEFAULT_LIMIT = 50
+LEDGER_HISTORY_MAX_LIMIT = 500
+
+
+# Rows fetched per round trip when streaming an export
+NDJSON_FETCH_SIZE = 1000
+
+
+def _wants_ndjson():
+    return request.args.get('format') == 'ndjson' or request.accept_mimetypes.best == 'application/x-ndjson'
+
+
+def _ndjson_response(query, to_dict):
+    """Streams a query as NDJSON from a server-side cursor, NDJSON_FETCH_SIZE rows at a time."""
+    rows = query.yield_per(NDJSON_FETCH_SIZE)
+    return Response(stream_with_context(ndjson_stream(rows, to_dict)), mimetype='application/x-ndjson')
+
+
+def _ledger_entry_dict(e):
+    return {
+        "entry_id": e.entry_id,
+        "source_id": e.source_id,
+        "amount": e.amount,
+        "transaction_type": e.transaction_type,
+        "task_id": e.task_id,
+        "created_at": e.created_at
+    }
+
+@relay.route('/ledger/<agent_id>/entries', methods=['GET'])
+@rate_limiter.limit('reads')
+@db_router.replica_reads
+def get_ledger_entries(agent_id):
+    """
+    Ledger entries credited to an agent, newest first.
+
+    Paged by entry_id via the `cursor` query param; the next page's cursor is
+    returned in the X-Next-Cursor header, as for GET /jobs. With
+    ?format=ndjson the whole history after `cursor` is streamed instead.
+    """
+    try:
+        limit = min(int(request.args.get('limit', LEDGER_HISTORY_DEFAULT_LIMIT)), LEDGER_HISTORY_MAX_LIMIT)
+        cursor = int(request.args['cursor']) if request.args.get('cursor') else None
+    except ValueError as e:
+        return jsonify({"error": f"Invalid query parameter: {e}"}), 400
+    if limit < 1:
+        return jsonify({"error": "limit must be positive"}), 400
 
-@app.route('/jobs', methods=['POST'])
+    query = db.session.query(
+        LedgerEntry.entry_id, LedgerEntry.source_id, LedgerEntry.amount,
+        LedgerEntry.transaction_type, LedgerEntry.task_id, LedgerEntry.created_at
+    ).filter(LedgerEntry.target_id == agent_id)
+    if cursor is not None:
+        query = query.filter(LedgerEntry.entry_id < cursor)
+    query = query.order_by(LedgerEntry.entry_id.desc())
+
+    if _wants_ndjson():
+        return _ndjson_response(query, _ledger_entry_dict)
+
+    entries = query.limit(limit + 1).all()
+    has_more = len(entries) > limit
+    entries = entries[:limit]
+
+    response = jsonify([_ledger_entry_dict(e) for e in entries])
+    if has_more:
+        response.headers['X-Next-Cursor'] = str(entries[-1].entry_id)
+    return response, 200
+
+LEDGER_AUDIT_DEFAULT_LIMIT = 100
+LEDGER_AUDIT_MAX_LIMIT = 1000
+
+
+@relay.route('/ledger/audit', methods=['GET'])
+@rate_limiter.limit('reads')
+@db_router.replica_reads
+def ledger_audit():
+    """
+    Reports the last reconciliation of agent balances against the
+    hash-chained ledger: agents per status, and the ones that are out of
+    balance or have a broken chain (or just ?agent_id=). Read-only: the
+    passes themselves run in the background (see LedgerAuditor).
+    """
+    try:
+        limit = int(request.args.get('limit', LEDGER_AUDIT_DEFAULT_LIMIT))
+    except ValueError:
+        return jsonify({"error": "limit must be an integer"}), 400
+    if not 1 <= limit <= LEDGER_AUDIT_MAX_LIMIT:
+        return jsonify({"error": f"limit must be between 1 and {LEDGER_AUDIT_MAX_LIMIT}"}), 400
+
+    return jsonify(ledger_auditor.report(request.args.get('agent_id'), limit)), 200
+
+@relay.route('/jobs', methods=['POST'])
+@rate_limiter.limit('writes')
 def post_job():
     data = request.json
     try:
-        new_job = Job(
+        fields = dict(
             title=data.get('title', 'Untitled Task'),
             description=data.get('description', ''),
             price=Decimal(str(data.get('terms', {}).get('price', 0))),
             buyer_id=data.get('buyer_id', 'unknown'),
-            envelope_json=data.get('envelope_json', {}),
-            status='posted'
+            envelope_json=blob_store.offload(data.get('envelope_json', {})),
+            entrypoint=envelope_entrypoint(data.get('envelope_json')),
+            auto_settle=bool(data.get('terms', {}).get('auto_settle', False)),
         )
-        db.session.add(new_job)
-        db.session.commit()
-        return jsonify({"status": "posted", "task_id": str(new_job.task_id)}), 201
+        task_id = group_commit.run(_insert_job, fields)
     except Exception as e:
-        db.session.rollback()
         return jsonify({"error": str(e)}), 400
+    _events_committed()
+    return jsonify({"status": "posted", "task_id": task_id}), 201
+
+def _insert_job(fields):
+    job = Job(status='posted', **fields)
+    db.session.add(job)
+    db.session.flush()
+    record_job_event(job)
+    stats_rollup.record_post(job)
+    return str(job.task_id)
 
-@app.route('/jobs/<task_id>/fund', methods=['POST'])
+@relay.route('/jobs/<task_id>/fund', methods=['POST'])
+@rate_limiter.limit('writes')
 def fund_job(task_id):
     tx_hash = request.json.get('escrow_tx_hash')
-    job = Job.query.filter_by(task_id=task_id).first()
-    if not job:
-        return jsonify({"error": "Job not found"}), 404
-    
     if not tx_hash:
         return jsonify({"error": "Escrow transaction hash required"}), 400
-        
-    job.status = 'funded'
-    job.escrow_tx_hash = tx_hash
-    db.session.commit()
+
+    route = group_commit.run(_fund, task_id, tx_hash)
+    if route is None:
+        return jsonify({"error": "Job not found"}), 404
+    job_router.add(*route)
+    _events_committed()
     return jsonify({"status": "funded", "tx_hash": tx_hash}), 200
 
-@app.route('/jobs/<task_id>/claim', methods=['POST'])
-def claim_job(task_id):
-    agent_id = request.json.get('agent_id')
+def _fund(task_id, tx_hash):
+    """Funds the job in the open session. Returns its routing key, or None if it does not exist."""
     job = Job.query.filter_by(task_id=task_id).first()
     if not job:
-        return jsonify({"error": "Job not found"}), 404
-    
-    # Strictly enforce funding check
-    if job.status != 'funded':
-        return jsonify({"error": "Job not yet funded"}), 403
-    
-    # Auto-register agent if not exists
-    agent = Agent.query.filter_by(agent_id=agent_id).first()
-    if not agent:
-        print(f"[Relay] New agent detected: {agent_id}. Registering with managed wallet...")
-        addr, enc_key = wallet_manager.create_wallet()
-        agent = Agent(
-            agent_id=agent_id, 
-            name=f"Agent_{agent_id[:6]}", 
+        return None
+    stats_rollup.record_transition(job.status, 'funded')
+    job.status = 'funded'
+    job.escrow_tx_hash = tx_hash
+    record_job_event(job)
+    return job.task_id, job.entrypoint, job.price, job.created_at
+
+MAX_MULTI_CLAIM = 50
+
+
+def _agent_exists(agent_id):
+    return db.session.query(Agent.agent_id).filter_by(agent_id=agent_id).scalar() is not None
+
+
+def _ensure_agent(agent_id):
+    """Registers an agent with a managed wallet if it is not known yet, and commits."""
+    if _agent_exists(agent_id):
+        return
+    logger.info("New agent detected: %s. Registering with managed wallet...", agent_id)
+    addr, enc_key = wallet_pool.take()
+    db.session.add(Agent(
+        agent_id=agent_id, 
+        name=f"Agent_{agent_id[:6]}", 
+        balance=0,
+        wallet_address=addr,
+        encrypted_privkey=enc_key
+    ))
+    stats_rollup.record_agent()
+    try:
+        db.session.commit()
+    except IntegrityError:
+        # A concurrent first claim by the same agent registered it first;
+        # the rollback also returns the pooled wallet
+        db.session.rollback()
+        return
+    leaderboard.publish_agent(agent_id)
+
+@relay.route('/wallets/pool', methods=['GET'])
+def wallet_pool_metrics():
+    return jsonify(wallet_pool.metrics()), 200
+
+def _register_claimant(agent_id, task_ids):
+    """
+    Auto-registers an agent with a managed wallet on its first successful
+    claim, in the open transaction, and hands it the jobs just claimed for
+    it. Returns True unless a concurrent first claim registered it first.
+    """
+    logger.info("New agent detected: %s. Registering with managed wallet...", agent_id)
+    addr, enc_key = wallet_pool.take()
+    dialect = postgresql if db.session.get_bind().dialect.name == 'postgresql' else sqlite
+    registered = db.session.execute(
+        dialect.insert(Agent).values(
+            agent_id=agent_id,
+            name=f"Agent_{agent_id[:6]}",
             balance=0,
             wallet_address=addr,
             encrypted_privkey=enc_key
-        )
-        db.session.add(agent)
-        
-    job.status = 'claimed'
-    job.claimed_by = agent_id
+        ).on_conflict_do_nothing()
+    ).rowcount == 1
+    if registered:
+        stats_rollup.record_agent()
+    db.session.execute(
+        db.update(Job).where(Job.task_id.in_(task_ids)).values(claimed_by=agent_id)
+        .execution_options(synchronize_session=False)
+    )
+    return registered
+
+def _claim(task_id, agent_id, lease_expires_at):
+    """
+    Claims one funded job in the open session. Returns (claimed, registered):
+    False if it was not funded, and whether the claim registered the agent.
+    """
+    # An unknown agent only gets a wallet once the claim is won; until then
+    # the claimed row has no claimant, as agents(agent_id) does not exist yet
+    known = _agent_exists(agent_id)
+    # Compare-and-set on status: exactly one racing claimer matches the row
+    claimed = Job.query.filter_by(task_id=task_id, status='funded').update(
+        {"status": "claimed", "claimed_by": agent_id if known else None, "lease_expires_at": lease_expires_at},
+        synchronize_session=False
+    )
+    if not claimed:
+        return False, False
+    registered = not known and _register_claimant(agent_id, [task_id])
+    record_job_events([task_id])
+    stats_rollup.record_transition('funded', 'claimed')
+    return True, registered
+
+def _claim_oldest(agent_id, limit, lease_expires_at):
+    """
+    Claims up to `limit` of the oldest funded jobs in the open session.
+    Returns (claimed task_ids, whether the claim registered the agent).
+    """
+    known = _agent_exists(agent_id)
+    # SKIP LOCKED lets concurrent multi-claims on Postgres take disjoint sets
+    # instead of queueing on the same oldest rows; SQLite serializes writers.
+    candidates = db.select(Job.task_id) \
+        .where(Job.status == 'funded') \
+        .order_by(Job.created_at.asc(), Job.task_id.asc()) \
+        .limit(limit) \
+        .with_for_update(skip_locked=True)
+    stmt = db.update(Job) \
+        .where(Job.task_id.in_(candidates), Job.status == 'funded') \
+        .values(status='claimed', claimed_by=agent_id if known else None, lease_expires_at=lease_expires_at) \
+        .returning(Job.task_id) \
+        .execution_options(synchronize_session=False)
+    task_ids = [str(row.task_id) for row in db.session.execute(stmt)]
+    # As in _claim, an unknown agent is registered only if it won jobs
+    registered = bool(task_ids) and not known and _register_claimant(agent_id, task_ids)
+    record_job_events(task_ids)
+    stats_rollup.record_transition('funded', 'claimed', len(task_ids))
+    return task_ids, registered
+
+@relay.route('/jobs/<task_id>/claim', methods=['POST'])
+@rate_limiter.limit('claims')
+def claim_job(task_id):
+    agent_id = request.json.get('agent_id')
+    if not agent_id:
+        return jsonify({"error": "agent_id required"}), 400
+
+    lease_expires_at = lease_reaper.expiry()
+    claimed, registered = group_commit.run(_claim, task_id, agent_id, lease_expires_at)
+    job_router.discard(task_id)
+
+    if not claimed:
+        # Losers only pay for a single-column lookup to pick the error
+        if db.session.query(Job.task_id).filter_by(task_id=task_id).scalar() is None:
+            return jsonify({"error": "Job not found"}), 404
+        return jsonify({"error": "Job not yet funded"}), 403
+    _events_committed()
+    if registered:
+        leaderboard.publish_agent(agent_id)
+    return jsonify({
+        "status": "success",
+        "message": f"Job claimed by {agent_id}",
+        "lease_expires_at": lease_expires_at.isoformat()
+    }), 200
+
+@relay.route('/jobs/claim', methods=['POST'])
+@rate_limiter.limit('claims')
+def claim_jobs():
+    """Atomically claims up to `limit` funded jobs, oldest first, for one agent."""
+    data = request.json
+    agent_id = data.get('agent_id')
+    if not agent_id:
+        return jsonify({"error": "agent_id required"}), 400
+    try:
+        limit = int(data.get('limit', 1))
+    except (TypeError, ValueError):
+        return jsonify({"error": "limit must be an integer"}), 400
+    if not 1 <= limit <= MAX_MULTI_CLAIM:
+        return jsonify({"error": f"limit must be between 1 and {MAX_MULTI_CLAIM}"}), 400
+
+    lease_expires_at = lease_reaper.expiry()
+    task_ids, registered = group_commit.run(_claim_oldest, agent_id, limit, lease_expires_at)
+    if registered:
+        leaderboard.publish_agent(agent_id)
+    for task_id in task_ids:
+        job_router.discard(task_id)
+    _events_committed()
+
+    return jsonify({
+        "status": "success",
+        "claimed": task_ids,
+        "lease_expires_at": lease_expires_at.isoformat()
+    }), 200
+
+# Index entries that lost a cross-worker race before the feed caught up
+NEXT_JOB_MAX_ATTEMPTS = 20
+
+
+@relay.route('/jobs/next', methods=['GET'])
+@rate_limiter.limit('claims')
+def next_job():
+    """
+    Claims and returns the best funded job for the agent: the highest
+    price, then the oldest, among the entrypoints in its capabilities (any
+    entrypoint if it has none). Served from the in-memory routing index,
+    so concurrent agents are handed distinct jobs. 204 when none match.
+    """
+    agent_id = request.args.get('agent_id')
+    if not agent_id:
+        return jsonify({"error": "agent_id required"}), 400
+
+    capabilities = db.session.query(Agent.capabilities).filter_by(agent_id=agent_id).scalar()
+
+    lease_expires_at = lease_reaper.expiry()
+    for _ in range(NEXT_JOB_MAX_ATTEMPTS):
+        task_id, entry = job_router.pop(capabilities)
+        if task_id is None:
+            break
+        try:
+            claimed, registered = group_commit.run(_claim, task_id, agent_id, lease_expires_at)
+        except Exception:
+            # Nothing was claimed: keep the job routable in this worker
+            job_router.restore(task_id, entry)
+            raise
+        if claimed:
+            _events_committed()
+            if registered:
+                leaderboard.publish_agent(agent_id)
+            job = db.session.query(Job.task_id, Job.title, Job.description, Job.price, Job.entrypoint) \
+                .filter_by(task_id=task_id).one()
+            return jsonify({
+                "task_id": str(job.task_id),
+                "title": job.title,
+                "description": job.description,
+                "price": job.price,
+                "entrypoint": job.entrypoint,
+                "lease_expires_at": lease_expires_at.isoformat()
+            }), 200
+    return Response(status=204)
+
+MAX_AGENT_CAPABILITIES = 50
+
+
+@relay.route('/agents/<agent_id>/capabilities', methods=['PUT'])
+@rate_limiter.limit('writes')
+def set_agent_capabilities(agent_id):
+    """Sets the envelope entrypoints GET /jobs/next routes to this agent (empty: any)."""
+    entrypoints = (request.json or {}).get('entrypoints')
+    if not isinstance(entrypoints, list) or len(entrypoints) > MAX_AGENT_CAPABILITIES or not all(
+            isinstance(e, str) and 0 < len(e) <= ENTRYPOINT_MAX_LENGTH for e in entrypoints):
+        return jsonify({"error": f"entrypoints must be a list of at most {MAX_AGENT_CAPABILITIES} "
+                                 f"strings of up to {ENTRYPOINT_MAX_LENGTH} characters"}), 400
+
+    _ensure_agent(agent_id)
+    capabilities = sorted(set(entrypoints)) or None
+    Agent.query.filter_by(agent_id=agent_id).update({"capabilities": capabilities}, synchronize_session=False)
     db.session.commit()
-    return jsonify({"status": "success", "message": f"Job claimed by {agent_id}"}), 200
+    return jsonify({"agent_id": agent_id, "capabilities": capabilities or []}), 200
+
+@relay.route('/jobs/<task_id>/heartbeat', methods=['POST'])
+@rate_limiter.limit('claims')
+def heartbeat_job(task_id):
+    """Extends the caller's claim lease by CLAIM_LEASE_SECONDS from now."""
+    agent_id = request.json.get('agent_id')
+    if not agent_id:
+        return jsonify({"error": "agent_id required"}), 400
 
+    lease_expires_at = lease_reaper.renew(task_id, agent_id)
+    db.session.commit()
+    if lease_expires_at is None:
+        # Reclaimed after the lease ran out, or never this agent's claim
+        return jsonify({"error": "Lease not held"}), 409
+    return jsonify({"status": "renewed", "lease_expires_at": lease_expires_at.isoformat()}), 200
 
-@app.route('/jobs/<task_id>/submit', methods=['POST'])
+@relay.route('/jobs/<task_id>/submit', methods=['POST'])
+@rate_limiter.limit('writes')
 def submit_job(task_id):
     agent_id = request.json.get('agent_id')
-    result = request.json.get('result')
-    job = Job.query.filter_by(task_id=task_id).first()
-    
-    if not job or job.claimed_by != agent_id:
+    # Offloaded up front to keep blob I/O off the writer thread; a rejected
+    # submission leaves at most an unreferenced blob (see BlobStore)
+    result_data = blob_store.offload(request.json.get('result'))
+    if not group_commit.run(_submit, task_id, agent_id, result_data):
         return jsonify({"error": "Unauthorized or not found"}), 403
+    _events_committed()
+    verifier.submit(_verify_submission, task_id)
     
+    logger.info("Task %s result submitted by %s. Awaiting Proxy verification...", task_id, agent_id)
+    return jsonify({"status": "submitted", "message": "Result pending verification"}), 200
+
+def _submit(task_id, agent_id, result_data):
+    """Records the agent's result in the open session. Returns False unless it holds the claim."""
+    # Row lock: the lease reaper cannot hand the job to another agent mid-submit
+    job = Job.query.filter_by(task_id=task_id).with_for_update().first()
+    if not job or job.claimed_by != agent_id:
+        return False
+    stats_rollup.record_transition(job.status, 'submitted')
     job.status = 'submitted'
-    job.result_data = result
+    job.result_data = result_data
+    job.verification_status = 'pending'
+    job.lease_expires_at = None
+    record_job_event(job)
+    return True
+
+# Settlement with 20% Platform Fee
+PLATFORM_FEE_RATE = Decimal('0.20')
+SELLER_PAYOUT_RATE = Decimal('0.80')
+MAX_BATCH_CONFIRM = 500
+MAX_SIGNATURE_LENGTH = Job.signature.type.length
+
+# Columns settlement needs, so envelope_json/result_data are never loaded
+SETTLEMENT_COLUMNS = (Job.task_id, Job.price, Job.buyer_id, Job.claimed_by, Job.status)
+
+
+def _settle_jobs(jobs, signatures):
+    """
+    Settles submitted jobs in the open transaction.
+
+    Jobs are moved to 'completed' with one compare-and-set UPDATE, so a job
+    settled concurrently elsewhere is skipped rather than paid twice. Ledger
+    entries are bulk inserted, chained onto each paid agent's ledger hash
+    chain (see LedgerAuditor), and each agent's balance and chain head get
+    one aggregated update. Returns ({task_id: (payout, fee)} for the jobs settled here,
+    [(ranking_token, agent)] to apply to the leaderboard after commit).
+    """
+    if not jobs:
+        return {}, []
+    won = set(db.session.execute(
+        db.update(Job)
+        .where(Job.task_id.in_([j.task_id for j in jobs]), Job.status == 'submitted')
+        .values(status='completed', signature=db.case(signatures, value=Job.task_id))
+        .returning(Job.task_id)
+        .execution_options(synchronize_session=False)
+    ).scalars())
+    if not won:
+        return {}, []
+    record_job_events(list(won))
+
+    settled = {}
+    for job in jobs:
+        if job.task_id in won:
+            settled[job.task_id] = (ledger_amount(job.price * SELLER_PAYOUT_RATE),
+                                    ledger_amount(job.price * PLATFORM_FEE_RATE))
+            logger.debug("Settling Task %s: Price=%s, Payout=%s, Fee=%s", job.task_id, job.price, *settled[job.task_id])
+
+    agent_ids = {job.claimed_by for job in jobs if job.task_id in won}
+    # Lock the paid agents (in a fixed order) before their entries are
+    # inserted, so each chain's entry_id order is the order it was hashed in
+    agents = {a.agent_id: a for a in Agent.query.filter(Agent.agent_id.in_(agent_ids))
+              .order_by(Agent.agent_id).with_for_update().populate_existing()}
+
+    now = datetime.datetime.utcnow()
+    entries = []
+    payouts = {}
+    total_payout = total_fee = Decimal(0)
+    for job in jobs:
+        if job.task_id not in won or job.claimed_by not in agents:
+            continue
+        payout, fee = settled[job.task_id]
+        entries.append(dict(source_id='platform', target_id=job.claimed_by, amount=payout,
+                            transaction_type='task_payout', task_id=job.task_id,
+                            chain_id=job.claimed_by, created_at=now))
+        entries.append(dict(source_id='platform', target_id='platform_admin', amount=fee,
+                            transaction_type='platform_fee', task_id=job.task_id,
+                            chain_id=job.claimed_by, created_at=now))
+        payouts[job.claimed_by] = payouts.get(job.claimed_by, Decimal(0)) + payout
+        total_payout += payout
+        total_fee += fee
+
+    # Log Ledger Entries
+    heads = {agent_id: agent.ledger_head for agent_id, agent in agents.items()}
+    if entries:
+        chain_entries(entries, heads)
+        db.session.execute(db.insert(LedgerEntry), entries)
+
+    ranking_tokens = []
+    # record_payout locks owner rows, so take them in a fixed order too:
+    # concurrent batches paying several owners would otherwise deadlock
+    for agent_id, amount in sorted(payouts.items(), key=lambda p: (agents[p[0]].owner_id or '', p[0])):
+        # Atomic increment: concurrent settlements for the same agent in other
+        # workers queue on the row lock instead of overwriting each other
+        new_balance = db.session.execute(
+            db.update(Agent)
+            .where(Agent.agent_id == agent_id)
+            .values(balance=Agent.balance + amount, ledger_head=heads[agent_id])
+            .returning(Agent.balance)
+            .execution_options(synchronize_session=False)
+        ).scalar()
+        logger.debug("Credited %s: +%s, New Balance=%s", agent_id, amount, new_balance)
+        ranking_tokens.append((leaderboard.record_payout(agents[agent_id], amount), agents[agent_id]))
+    if payouts:
+        stats_rollup.record_settlement(total_payout, total_fee)
+    stats_rollup.record_transition('submitted', 'completed', len(won))
+    return settled, ranking_tokens
+
+
+def _apply_ranking_tokens(ranking_tokens):
+    for token, agent in ranking_tokens:
+        leaderboard.publish_payout(token, agent)
+
+AUTO_SETTLE_SIGNATURE = "AUTO_VERIFIED"
+
+
+def _result_text(result):
+    if isinstance(result, str):
+        return result
+    return json.dumps(result, sort_keys=True, separators=(',', ':'))
+
+
+def _verify_submission(task_id):
+    """
+    Runs on the verifier pool after a submit commits. Records the outcome of
+    the envelope's verification_regex and, for buyers who opted in, settles
+    a passing job right away.
+    """
+    job = Job.query.options(
+        load_only(*SETTLEMENT_COLUMNS, Job.version, Job.auto_settle, Job.verification_status),
+        undefer(Job.envelope_json), undefer(Job.result_data)
+    ).filter_by(task_id=task_id).first()
+    if not job or job.status != 'submitted' or job.verification_status != 'pending':
+        return
+
+    payload = (blob_store.load(job.envelope_json) or {}).get('payload') or {}
+    pattern = payload.get('verification_regex')
+    if not pattern:
+        outcome = 'unverified'
+    else:
+        try:
+            outcome = 'passed' if verifier.check(pattern, _result_text(blob_store.load(job.result_data))) else 'failed'
+        except VerificationTimeout:
+            outcome = 'timeout'
+        except (ValueError, *PATTERN_ERRORS) as e:
+            logger.info("Verifier for task %s could not run: %s", task_id, e)
+            outcome = 'error'
+
+    # Compare-and-set on version: a resubmission since we loaded gets its own run
+    recorded = Job.query.filter_by(task_id=task_id, status='submitted', version=job.version).update(
+        {"verification_status": outcome}, synchronize_session=False
+    )
+    settled, ranking_tokens = {}, []
+    if recorded and outcome == 'passed' and job.auto_settle:
+        settled, ranking_tokens = _settle_jobs([job], {task_id: AUTO_SETTLE_SIGNATURE})
     db.session.commit()
-    
-    print(f"[Relay] Task {task_id} result submitted by {agent_id}. Awaiting Proxy verification...")
-    return jsonify({"status": "submitted", "message": "Result pending verification"}), 200
+    if settled:
+        _events_committed()
+        _apply_ranking_tokens(ranking_tokens)
+        logger.info("Task %s passed verification and was auto-settled.", task_id)
+    elif recorded:
+        logger.info("Task %s verification: %s", task_id, outcome)
 
-@app.route('/jobs/<task_id>/confirm', methods=['POST'])
+@relay.route('/jobs/<task_id>/confirm', methods=['POST'])
+@rate_limiter.limit('settlements')
 def confirm_job(task_id):
     buyer_id = request.json.get('buyer_id')
     signature = request.json.get('signature')
-    job = Job.query.filter_by(task_id=task_id).first()
+    job = Job.query.options(load_only(*SETTLEMENT_COLUMNS)).filter_by(task_id=task_id).first()
     
     if not job or job.buyer_id != buyer_id:
         return jsonify({"error": "Unauthorized"}), 403
@@ -221,52 +811,95 @@ def confirm_job(task_id):
     if not signature:
         return jsonify({"error": "Acceptance signature required for release"}), 400
 
-    # Settlement with 20% Platform Fee
-    price = job.price
-    platform_fee = price * Decimal('0.20')
-    seller_payout = price * Decimal('0.80')
-    agent_id = job.claimed_by
-    
-    job.signature = signature
-    
-    print(f"[DEBUG] Settling Task {task_id}: Price={price}, Payout={seller_payout}, Fee={platform_fee}")
-    
-    agent = Agent.query.filter_by(agent_id=agent_id).first()
-    if agent:
-        print(f"[DEBUG] Old Balance for {agent_id}: {agent.balance}")
-        agent.balance += seller_payout
-        print(f"[DEBUG] New Balance for {agent_id}: {agent.balance}")
-
-        
-        # Log Ledger Entries
-        payout_entry = LedgerEntry(
-            source_id='platform',
-            target_id=agent_id,
-            amount=seller_payout,
-            transaction_type='task_payout',
-            task_id=job.task_id
-        )
-        fee_entry = LedgerEntry(
-            source_id='platform',
-            target_id='platform_admin',
-            amount=platform_fee,
-            transaction_type='platform_fee',
-            task_id=job.task_id
-        )
-        db.session.add(payout_entry)
-        db.session.add(fee_entry)
-    
-    job.status = 'completed'
+    settled, ranking_tokens = _settle_jobs([job], {job.task_id: signature})
     db.session.commit()
+    _events_committed()
+    if not settled:
+        # Confirmed concurrently between our read and the compare-and-set
+        return jsonify({"error": "Job not in submitted state"}), 400
+    _apply_ranking_tokens(ranking_tokens)
+    seller_payout, platform_fee = settled[job.task_id]
     
-    print(f"[Relay] Proxy {buyer_id} confirmed task {task_id}. Settlement complete.")
+    logger.info("Proxy %s confirmed task %s. Settlement complete.", buyer_id, task_id)
     return jsonify({
         "status": "success", 
         "payout": float(seller_payout),
         "fee": float(platform_fee)
     }), 200
 
-@app.route('/agents/adopt', methods=['POST'])
+@relay.route('/jobs/confirm/batch', methods=['POST'])
+@rate_limiter.limit('settlements')
+def confirm_jobs_batch():
+    """
+    Settles many submitted jobs for one buyer in a single transaction.
+
+    Body: {"buyer_id": ..., "items": [{"task_id": ..., "signature": ...}]}.
+    Every item gets its own result in request order; invalid items are
+    reported and skipped without failing the rest of the batch.
+    """
+    data = request.json
+    buyer_id = data.get('buyer_id')
+    items = data.get('items')
+    if not isinstance(items, list) or not items:
+        return jsonify({"error": "items must be a non-empty list"}), 400
+    if len(items) > MAX_BATCH_CONFIRM:
+        return jsonify({"error": f"At most {MAX_BATCH_CONFIRM} items per batch"}), 400
+
+    errors = {}
+    for index, item in enumerate(items):
+        # Malformed items fail on their own instead of breaking the batch's
+        # queries (or, for over-long signatures, its Postgres transaction)
+        if not isinstance(item, dict) or not isinstance(item.get('task_id'), str):
+            errors[index] = ("task_id must be a string", 400)
+        elif not item.get('signature'):
+            errors[index] = ("Acceptance signature required for release", 400)
+        elif not isinstance(item['signature'], str) or len(item['signature']) > MAX_SIGNATURE_LENGTH:
+            errors[index] = (f"signature must be a string of at most {MAX_SIGNATURE_LENGTH} characters", 400)
+
+    task_ids = [item['task_id'] for index, item in enumerate(items) if index not in errors]
+    jobs = {j.task_id: j for j in Job.query.options(load_only(*SETTLEMENT_COLUMNS)).filter(Job.task_id.in_(task_ids))}
+
+    signatures = {}
+    for index, item in enumerate(items):
+        if index in errors:
+            continue
+        task_id = item['task_id']
+        job = jobs.get(task_id)
+        if task_id in signatures:
+            errors[index] = ("Duplicate task_id in batch", 400)
+        elif not job or job.buyer_id != buyer_id:
+            errors[index] = ("Unauthorized", 403)
+        elif job.status != 'submitted':
+            errors[index] = ("Job not in submitted state", 400)
+        else:
+            signatures[task_id] = item['signature']
+
+    settled, ranking_tokens = _settle_jobs([jobs[t] for t in signatures], signatures)
+    db.session.commit()
+    _events_committed()
+    _apply_ranking_tokens(ranking_tokens)
+
+    results = []
+    for index, item in enumerate(items):
+        task_id = item.get('task_id') if isinstance(item, dict) else None
+        if index not in errors and task_id not in settled:
+            errors[index] = ("Job not in submitted state", 400)
+        if index in errors:
+            message, code = errors[index]
+            results.append({"task_id": task_id, "status": "error", "error": message, "code": code})
+        else:
+            payout, fee = settled[task_id]
+            results.append({"task_id": task_id, "status": "success", "payout": float(payout), "fee": float(fee)})
+
+    logger.info("Proxy %s batch-confirmed %d/%d tasks.", buyer_id, len(settled), len(items))
+    return jsonify({
+        "settled": len(settled),
+        "failed": len(items) - len(settled),
+        "results": results
+    }), 200
+
+@relay.route('/agents/adopt', methods=['POST'])
+@rate_limiter.limit('writes')
 def adopt_agent():
     data = request.json
     agent_id = data.get('agent_id')
@@ -276,7 +909,8 @@ def adopt_agent():
     if not agent_id or not twitter_handle:
         return jsonify({"error": "agent_id and twitter_handle are required"}), 400
 
-    agent = Agent.query.filter_by(agent_id=agent_id).first()
+    # Row lock so no settlement credits the old owner while the balance moves
+    agent = Agent.query.filter_by(agent_id=agent_id).with_for_update().first()
     if not agent:
         return jsonify({"error": "Agent not found"}), 404
 
@@ -290,113 +924,291 @@ def adopt_agent():
             twitter_handle=twitter_handle
         )
         db.session.add(owner)
+        db.session.flush()
     
+    leaderboard.record_adoption(agent, agent.owner_id, owner.owner_id)
     agent.owner_id = owner.owner_id
     agent.adoption_tweet_url = tweet_url
     agent.adopted_at = datetime.datetime.utcnow()
     
     db.session.commit()
-    print(f"[Relay] Agent {agent_id} adopted by @{twitter_handle}")
+    logger.info("Agent %s adopted by @%s", agent_id, twitter_handle)
     return jsonify({"status": "success", "message": f"Agent {agent_id} adopted by @{twitter_handle}"}), 200
 
-@app.route('/jobs', methods=['GET'])
-def list_jobs():
-    all_jobs = Job.query.all()
-    return jsonify([{
+JOB_LIST_DEFAULT_LIMIT = 100
+JOB_LIST_MAX_LIMIT = 500
+
+
+def _encode_job_cursor(created_at, task_id):
+    raw = f"{created_at.isoformat()}|{task_id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def _decode_job_cursor(cursor):
+    created_at, task_id = base64.urlsafe_b64decode(cursor.encode()).decode().split('|', 1)
+    return datetime.datetime.fromisoformat(created_at), task_id
+
+
+def _job_summary(j):
+    return {
         "task_id": str(j.task_id),
         "title": j.title,
-        "price": float(j.price),
+        "price": j.price,
         "status": j.status,
         "claimed_by": j.claimed_by
-    } for j in all_jobs]), 200
+    }
+
+
+@relay.route('/jobs', methods=['GET'])
+@rate_limiter.limit('reads')
+@db_router.replica_reads
+def list_jobs():
+    """
+    Lists jobs with server-side filtering and keyset pagination.
+
+    Query params: status (comma separated), buyer_id, claimed_by, min_price,
+    max_price, created_after (ISO 8601), order (asc|desc), limit and cursor.
+    The next page's cursor is returned in the X-Next-Cursor header. With
+    ?format=ndjson every matching row is streamed (up to `limit`, if given).
+    """
+    args = request.args
+    stream = _wants_ndjson()
+    try:
+        if stream:
+            limit = int(args['limit']) if args.get('limit') else None
+        else:
+            limit = min(int(args.get('limit', JOB_LIST_DEFAULT_LIMIT)), JOB_LIST_MAX_LIMIT)
+        if limit is not None and limit < 1:
+            raise ValueError("limit must be positive")
+        order = args.get('order', 'asc')
+        if order not in ('asc', 'desc'):
+            raise ValueError("order must be 'asc' or 'desc'")
+
+        # Only the listed columns, so envelope_json/result_data are never loaded
+        query = db.session.query(
+            Job.task_id, Job.title, Job.price, Job.status, Job.claimed_by, Job.created_at
+        )
+
+        if args.get('status'):
+            statuses = args['status'].split(',')
+            query = query.filter(Job.status.in_(statuses)) if len(statuses) > 1 else query.filter(Job.status == statuses[0])
+        if args.get('buyer_id'):
+            query = query.filter(Job.buyer_id == args['buyer_id'])
+        if args.get('claimed_by'):
+            query = query.filter(Job.claimed_by == args['claimed_by'])
+        if args.get('min_price'):
+            query = query.filter(Job.price >= Decimal(args['min_price']))
+        if args.get('max_price'):
+            query = query.filter(Job.price <= Decimal(args['max_price']))
+        if args.get('created_after'):
+            query = query.filter(Job.created_at > datetime.datetime.fromisoformat(args['created_after']))
+
+        if args.get('cursor'):
+            cursor_created, cursor_task = _decode_job_cursor(args['cursor'])
+            if order == 'asc':
+                query = query.filter(db.or_(
+                    Job.created_at > cursor_created,
+                    db.and_(Job.created_at == cursor_created, Job.task_id > cursor_task)
+                ))
+            else:
+                query = query.filter(db.or_(
+                    Job.created_at < cursor_created,
+                    db.and_(Job.created_at == cursor_created, Job.task_id < cursor_task)
+                ))
+    except (ValueError, ArithmeticError) as e:
+        return jsonify({"error": f"Invalid query parameter: {e}"}), 400
+
+    if order == 'asc':
+        query = query.order_by(Job.created_at.asc(), Job.task_id.asc())
+    else:
+        query = query.order_by(Job.created_at.desc(), Job.task_id.desc())
+
+    if stream:
+        return _ndjson_response(query.limit(limit) if limit else query, _job_summary)
 
-@app.route('/jobs/<task_id>', methods=['GET'])
+    # Fetch one extra row to learn whether another page exists
+    rows = query.limit(limit + 1).all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
+    response = jsonify([_job_summary(j) for j in rows])
+    if has_more:
+        last = rows[-1]
+        response.headers['X-Next-Cursor'] = _encode_job_cursor(last.created_at, last.task_id)
+    return response, 200
+
+JOB_FEED_DEFAULT_TIMEOUT = 25
+JOB_FEED_MAX_TIMEOUT = 30
+
+
+@relay.route('/jobs/feed', methods=['GET'])
+@rate_limiter.limit('reads')
+def job_feed_poll():
+    """
+    Long-poll feed of job state changes.
+
+    Without a cursor, returns the current feed position immediately; clients
+    take that cursor, list anything already pending via GET /jobs, then wait
+    here. With a cursor, blocks until an event after it matches the status /
+    buyer_id filters or the timeout elapses, then returns the matching events
+    and the cursor to wait from next. Cursors are opaque: besides the feed
+    position they name events still expected to commit.
+    """
+    args = request.args
+    if 'cursor' not in args:
+        return jsonify({"events": [], "cursor": job_feed.position, "resync": False}), 200
+
+    try:
+        cursor = decode_feed_cursor(args['cursor'])
+        timeout = min(float(args.get('timeout', JOB_FEED_DEFAULT_TIMEOUT)), JOB_FEED_MAX_TIMEOUT)
+    except ValueError as e:
+        return jsonify({"error": f"Invalid query parameter: {e}"}), 400
+
+    statuses = set(args['status'].split(',')) if args.get('status') else None
+    buyer_id = args.get('buyer_id')
+
+    def match(event):
+        if statuses and event["status"] not in statuses:
+            return False
+        return not buyer_id or event["buyer_id"] == buyer_id
+
+    events, cursor, resync = job_feed.wait(cursor, match, max(timeout, 0))
+    return jsonify({"events": events, "cursor": cursor, "resync": resync}), 200
+
+@relay.route('/jobs/<task_id>', methods=['GET'])
+@rate_limiter.limit('reads')
+@db_router.replica_reads
 def get_job(task_id):
-    job = Job.query.filter_by(task_id=task_id).first()
+    # Pollers usually already hold the current version: answer them from a
+    # single-column lookup before loading and serializing the row
+    version = db.session.query(Job.version).filter_by(task_id=task_id).scalar()
+    if version is None:
+        return jsonify({"error": "Job not found"}), 404
+    unchanged = _unchanged_since(task_id, version)
+    if unchanged is not None:
+        return unchanged
+
+    job = Job.query.options(undefer(Job.result_data)).filter_by(task_id=task_id).first()
     if job:
-        return jsonify({
+        body = {
             "task_id": str(job.task_id),
             "title": job.title,
             "description": job.description,
-            "price": float(job.price),
+            "price": job.price,
             "status": job.status,
             "claimed_by": job.claimed_by,
-            "result": job.result_data
-        }), 200
+            "verification_status": job.verification_status,
+            "lease_expires_at": job.lease_expires_at.isoformat() if job.lease_expires_at else None,
+            "version": job.version
+        }
+        if blob_store.is_ref(job.result_data):
+            # Splice the stored JSON in as it is read instead of loading it
+            head = current_app.json.dumpb(body)[:-1] + b',"result":'
+            response = Response(
+                itertools.chain([head], blob_store.stream(job.result_data), [b'}']),
+                mimetype='application/json'
+            )
+        else:
+            body["result"] = job.result_data
+            response = jsonify(body)
+        response.set_etag(f"{job.task_id}-{job.version}")
+        return response, 200
     return jsonify({"error": "Job not found"}), 404
 
+@relay.route('/webhooks', methods=['POST'])
+@rate_limiter.limit('writes')
+def register_webhook():
+    """
+    Registers a URL to receive batched job events for a buyer or agent
+    (`subscriber_id` matched against buyer_id and claimed_by). Optional
+    `statuses` limits delivery to those transitions. The returned secret
+    signs every delivery (X-Relay-Signature: sha256=HMAC of the body).
+    """
+    data = request.json or {}
+    url = data.get('url') or ''
+    subscriber_id = data.get('subscriber_id')
+    statuses = data.get('statuses')
+    if not url.startswith(('http://', 'https://')) or not subscriber_id:
+        return jsonify({"error": "http(s) url and subscriber_id are required"}), 400
+    if statuses is not None and (not isinstance(statuses, list) or not set(statuses) <= set(JOB_STATUSES)):
+        return jsonify({"error": f"statuses must be a list of {', '.join(JOB_STATUSES)}"}), 400
+
+    endpoint = WebhookEndpoint(
+        url=url,
+        subscriber_id=subscriber_id,
+        statuses=','.join(statuses) if statuses else None,
+        secret=secrets.token_hex(32)
+    )
+    db.session.add(endpoint)
+    db.session.commit()
+    return jsonify(dict(endpoint.to_dict(), secret=endpoint.secret)), 201
+
+@relay.route('/webhooks/<int:endpoint_id>', methods=['GET'])
+@rate_limiter.limit('reads')
+@db_router.replica_reads
+def get_webhook(endpoint_id):
+    endpoint = db.session.get(WebhookEndpoint, endpoint_id)
+    if not endpoint:
+        return jsonify({"error": "Webhook not found"}), 404
+    return jsonify(dict(endpoint.to_dict(), deliveries=webhook_dispatcher.counts(endpoint_id))), 200
+
+@relay.route('/webhooks/<int:endpoint_id>', methods=['DELETE'])
+@rate_limiter.limit('writes')
+def delete_webhook(endpoint_id):
+    endpoint = db.session.get(WebhookEndpoint, endpoint_id)
+    if not endpoint:
+        return jsonify({"error": "Webhook not found"}), 404
+    endpoint.active = False
+    WebhookDelivery.query.filter_by(endpoint_id=endpoint_id, status='pending').delete(synchronize_session=False)
+    db.session.commit()
+    return jsonify({"status": "deleted"}), 200
+
+@relay.route('/webhooks/<int:endpoint_id>/redrive', methods=['POST'])
+@rate_limiter.limit('writes')
+def redrive_webhook(endpoint_id):
+    """Requeues the endpoint's dead-lettered deliveries."""
+    endpoint = db.session.get(WebhookEndpoint, endpoint_id)
+    if not endpoint or not endpoint.active:
+        return jsonify({"error": "Webhook not found"}), 404
+    redriven = webhook_dispatcher.redrive(endpoint_id)
+    db.session.commit()
+    webhook_dispatcher.notify()
+    return jsonify({"redriven": redriven}), 200
+
 # Agent Adoption Verification (Tweet-to-Adopt)
-@app.route('/share/job/<task_id>', methods=['GET'])
+@relay.route('/share/job/<task_id>', methods=['GET'])
+@db_router.replica_reads
 def share_job(task_id):
-    job = Job.query.filter_by(task_id=task_id).first()
+    # envelope_json stays deferred: it is only loaded to render a cache miss
+    job = Job.query.options(load_only(
+        Job.task_id, Job.title, Job.description, Job.price, Job.created_at, Job.updated_at
+    )).filter_by(task_id=task_id).first()
     if not job:
         return "Task not found", 404
-        
-    # Extract technical details from envelope
-    env = job.envelope_json or {}
-    payload = env.get('payload', {})
-    criteria = payload.get('verification_regex', 'N/A')
-    entrypoint = payload.get('entrypoint', 'N/A')
-    env_setup = payload.get('environment_setup', 'Standard ATP Node v1')
-    
-    # A high-fidelity technical sharing page
-    html = f"""
-    <!DOCTYPE html>
-    <html>
-    <head>
-        <title>SYNAI.SHOP - {job.title}</title>
-        <meta name="viewport" content="width=device-width, initial-scale=1.0">
-        <style>
-            @import url('https://fonts.googleapis.com/css2?family=JetBrains+Mono:wght@400;700&display=swap');
-            body {{ background: #050505; color: #e1e1e1; font-family: 'Inter', sans-serif; display: flex; justify-content: center; align-items: center; min-height: 100vh; margin: 0; padding: 20px; }}
-            .card {{ background: rgba(15,15,20,0.9); border: 1px solid rgba(0,243,255,0.3); padding: 40px; border-radius: 24px; text-align: left; max-width: 600px; width: 100%; box-shadow: 0 0 50px rgba(0,243,255,0.1); backdrop-filter: blur(10px); }}
-            .brand {{ color: #00ff41; font-family: 'JetBrains Mono', monospace; font-size: 12px; letter-spacing: 2px; margin-bottom: 20px; }}
-            h1 {{ color: #fff; font-size: 28px; margin: 0 0 10px 0; letter-spacing: -1px; }}
-            .desc {{ color: #888; font-size: 15px; line-height: 1.6; margin-bottom: 30px; }}
-            .price-row {{ display: flex; justify-content: space-between; align-items: center; padding: 20px; background: rgba(188,19,254,0.05); border-left: 4px solid #bc13fe; border-radius: 8px; margin-bottom: 30px; }}
-            .price-val {{ font-size: 32px; font-family: 'JetBrains Mono', monospace; color: #bc13fe; font-weight: bold; }}
-            .tech-specs {{ background: rgba(255,255,255,0.03); padding: 20px; border-radius: 12px; font-family: 'JetBrains Mono', monospace; font-size: 13px; border: 1px solid rgba(255,255,255,0.05); }}
-            .spec-item {{ margin-bottom: 15px; }}
-            .spec-label {{ color: #555; text-transform: uppercase; font-size: 10px; margin-bottom: 5px; }}
-            .spec-val {{ color: #00f3ff; word-break: break-all; }}
-            .btn {{ display: block; text-align: center; padding: 15px; background: #00f3ff; color: #000; text-decoration: none; border-radius: 8px; margin-top: 30px; font-weight: 800; text-transform: uppercase; letter-spacing: 1px; transition: 0.2s; }}
-            .btn:hover {{ background: #fff; box-shadow: 0 0 20px #00f3ff; }}
-        </style>
-    </head>
-    <body>
-        <div class="card">
-            <div class="brand">● SYNAI.SHOP // TASK_MANIFEST_v1.0</div>
-            <h1>{job.title}</h1>
-            <p class="desc">{job.description or 'Autonomous task requiring specialized execution and verification.'}</p>
-            
-            <div class="price-row">
-                <span style="font-size: 11px; color: #bc13fe; font-weight: 800;">BOUNTY</span>
-                <span class="price-val">{float(job.price)} USDC</span>
-            </div>
-
-            <div class="tech-specs">
-                <div class="spec-item">
-                    <div class="spec-label">Acceptance Criteria (Regex)</div>
-                    <div class="spec-val">{criteria}</div>
-                </div>
-                <div class="spec-item">
-                    <div class="spec-label">Entrypoint / Verifier</div>
-                    <div class="spec-val">{entrypoint}</div>
-                </div>
-                <div class="spec-item">
-                    <div class="spec-label">Target Environment</div>
-                    <div class="spec-val">{env_setup}</div>
-                </div>
-            </div>
-
-            <a href="https://synai.shop" class="btn">Deploy Solution</a>
-        </div>
-    </body>
-    </html>
-    """
-    return render_template_string(html)
 
+    def context():
+        # Extract technical details from envelope
+        env = blob_store.load(job.envelope_json) or {}
+        payload = env.get('payload', {})
+        return {
+            "title": job.title,
+            "description": job.description,
+            "price": float(job.price),
+            "criteria": payload.get('verification_regex', 'N/A'),
+            "entrypoint": payload.get('entrypoint', 'N/A'),
+            "env_setup": payload.get('environment_setup', 'Standard ATP Node v1'),
+        }
+
+    # A high-fidelity technical sharing page
+    modified = job.updated_at or job.created_at
+    return page_cache.render(
+        ('share_job', job.task_id, modified), 'share_job.html', context,
+        last_modified=modified.replace(tzinfo=datetime.timezone.utc), max_age=SHARE_PAGE_MAX_AGE
+    )
 
 
 if __name__ == "__main__":
+    from migrations import upgrade
+    app = create_app()
+    upgrade(app)
     app.run(port=5005, debug=True)
@@ -0,0 +1,186 @@
+import datetime
+import random
+from collections import defaultdict
+from decimal import Decimal
+
+from sqlalchemy.dialects import postgresql, sqlite
+
+from models import db, Agent, Job, LedgerEntry, PlatformStat, StatsBucket
+
+# Each status also names the bucket column counting jobs that entered it
+JOB_STATUSES = ('posted', 'funded', 'claimed', 'submitted', 'completed')
+GRANULARITIES = ('hour', 'day')
+BUCKET_COUNTERS = tuple(c.name for c in StatsBucket.__table__.columns
+                        if c.name not in ('granularity', 'bucket_start', 'shard'))
+# The bucket columns the raw tables can be replayed into
+BUCKET_REBUILD_COLUMNS = ('posted', 'posted_volume', 'completed', 'settled_volume', 'fees')
+
+
+def _bucket_start(ts, granularity):
+    if granularity == 'hour':
+        return ts.replace(minute=0, second=0, microsecond=0)
+    return ts.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+class StatsRollup:
+    """
+    Running platform totals and hourly/daily activity buckets.
+
+    Every mutation in the job lifecycle calls one of the `record_*` methods
+    inside its own transaction, so the rollup commits (or rolls back) with
+    the change it describes. Reads then cost a handful of primary-key rows
+    instead of aggregates over `jobs` and `ledger_entries`.
+
+    Every row is split over `shards` counter rows, and each write adds to a
+    random one, so concurrent transactions rarely wait on each other's row
+    locks; reads sum the shards. Within a write, rows are locked in a fixed
+    order (totals by key, then buckets) so two writes cannot deadlock.
+    """
+
+    def __init__(self, shards=8):
+        self.shards = shards
+
+    def init_app(self, app):
+        self.shards = app.config.get('STATS_COUNTER_SHARDS', self.shards)
+
+    def record_post(self, job):
+        self._add_totals({
+            'jobs_total': 1,
+            'jobs_posted': 1,
+            'bounty_volume': job.price,
+        })
+        self._add_buckets({'posted': 1, 'posted_volume': job.price})
+
+    def record_transition(self, old_status, new_status, count=1):
+        if old_status == new_status or not count:
+            return
+        deltas = {f'jobs_{new_status}': count}
+        if old_status:
+            deltas[f'jobs_{old_status}'] = -count
+        self._add_totals(deltas)
+        self._add_buckets({new_status: count})
+
+    def record_reclaim(self, count):
+        """Jobs whose claim lease expired, back from 'claimed' to 'funded'."""
+        if not count:
+            return
+        self._add_totals({'jobs_claimed': -count, 'jobs_funded': count, 'lease_reclaims': count})
+        self._add_buckets({'funded': count, 'reclaimed': count})
+
+    def record_settlement(self, payout, fee):
+        self._add_totals({
+            'settled_volume': payout + fee,
+            'platform_revenue': fee,
+        })
+        self._add_buckets({'settled_volume': payout + fee, 'fees': fee})
+
+    def record_agent(self):
+        self._add_totals({'total_agents': 1})
+
+    def totals(self):
+        values = dict(db.session.query(PlatformStat.key, db.func.sum(PlatformStat.value)).group_by(PlatformStat.key))
+        totals = {key: values.get(key, Decimal(0)) for key in (
+            'total_agents', 'jobs_total', 'bounty_volume', 'settled_volume', 'platform_revenue', 'lease_reclaims'
+        )}
+        totals['jobs_by_status'] = {status: int(values.get(f'jobs_{status}', 0)) for status in JOB_STATUSES}
+        return totals
+
+    def series(self, granularity, since=None, until=None, limit=None):
+        query = db.session.query(
+            StatsBucket.bucket_start,
+            *(db.func.sum(StatsBucket.__table__.c[col]).label(col) for col in BUCKET_COUNTERS)
+        ).filter(StatsBucket.granularity == granularity).group_by(StatsBucket.bucket_start)
+        if since:
+            query = query.filter(StatsBucket.bucket_start >= _bucket_start(since, granularity))
+        if until:
+            query = query.filter(StatsBucket.bucket_start <= until)
+        if limit:
+            # Most recent buckets, returned oldest first
+            rows = query.order_by(StatsBucket.bucket_start.desc()).limit(limit).all()[::-1]
+        else:
+            rows = query.order_by(StatsBucket.bucket_start.asc()).all()
+        return rows
+
+    def rebuild(self):
+        """
+        Recomputes every total and bucket from the raw tables (cold start / repair).
+
+        Migration 6 runs this against whatever schema version it upgrades, so
+        it names the columns it reads and writes instead of loading models.
+        """
+        print("[Relay] Rebuilding platform stats rollup from raw tables...")
+        db.session.execute(db.delete(PlatformStat))
+        db.session.execute(db.delete(StatsBucket))
+
+        totals = defaultdict(Decimal)
+        buckets = defaultdict(lambda: dict.fromkeys(BUCKET_REBUILD_COLUMNS, Decimal(0)))
+
+        totals['total_agents'] = Decimal(db.session.query(db.func.count(Agent.agent_id)).scalar())
+        for status, count, volume in db.session.query(
+                Job.status, db.func.count(), db.func.sum(Job.price)).group_by(Job.status):
+            totals[f'jobs_{status}'] += count
+            totals['jobs_total'] += count
+            totals['bounty_volume'] += volume or 0
+
+        for created_at, price in db.session.query(Job.created_at, Job.price).yield_per(1000):
+            for granularity in GRANULARITIES:
+                bucket = buckets[(granularity, _bucket_start(created_at, granularity))]
+                bucket['posted'] += 1
+                bucket['posted_volume'] += price
+
+        # Settlements are only timestamped by their ledger entries
+        for created_at, kind, amount in db.session.query(
+                LedgerEntry.created_at, LedgerEntry.transaction_type, LedgerEntry.amount).yield_per(1000):
+            totals['settled_volume'] += amount
+            if kind == 'platform_fee':
+                totals['platform_revenue'] += amount
+            for granularity in GRANULARITIES:
+                bucket = buckets[(granularity, _bucket_start(created_at, granularity))]
+                bucket['settled_volume'] += amount
+                if kind == 'platform_fee':
+                    bucket['fees'] += amount
+                    bucket['completed'] += 1
+
+        # Lease reclaims leave no trace in the raw tables, so they restart from zero
+        if totals:
+            db.session.execute(db.insert(PlatformStat), [
+                {'key': key, 'value': value} for key, value in totals.items()
+            ])
+        if buckets:
+            db.session.execute(db.insert(StatsBucket), [
+                dict({k: int(v) if k in JOB_STATUSES else v for k, v in values.items()},
+                     granularity=granularity, bucket_start=start)
+                for (granularity, start), values in buckets.items()
+            ])
+        db.session.commit()
+
+    def _add_totals(self, deltas):
+        shard = random.randrange(self.shards)
+        for key in sorted(deltas):
+            _upsert_add(PlatformStat, {'key': key, 'shard': shard}, {'value': deltas[key]})
+
+    def _add_buckets(self, deltas):
+        now = datetime.datetime.utcnow()
+        shard = random.randrange(self.shards)
+        for granularity in GRANULARITIES:
+            _upsert_add(StatsBucket, {
+                'granularity': granularity,
+                'bucket_start': _bucket_start(now, granularity),
+                'shard': shard,
+            }, deltas)
+
+
+def _upsert_add(model, keys, deltas):
+    """INSERT ... ON CONFLICT DO UPDATE SET col = col + delta, for SQLite and Postgres."""
+    dialect = postgresql if db.session.get_bind().dialect.name == 'postgresql' else sqlite
+    table = model.__table__
+    stmt = dialect.insert(table).values(**keys, **deltas)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=list(keys),
+        set_={col: table.c[col] + stmt.excluded[col] for col in deltas}
+    )
+    db.session.execute(stmt)
+
+
+# Singleton instance
+stats_rollup = StatsRollup()
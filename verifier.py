@@ -0,0 +1,153 @@
+import functools
+import logging
+import multiprocessing
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from models import db
+
+try:
+    import regex
+except ImportError:  # in requirements.txt; without it `re` runs in a killable child process
+    regex = None
+
+logger = logging.getLogger('relay')
+
+# Raised for invalid patterns by whichever engine is in use
+PATTERN_ERRORS = (re.error, regex.error) if regex is not None else (re.error,)
+
+
+class VerificationTimeout(Exception):
+    """The verifier did not finish within VERIFIER_TIMEOUT (e.g. catastrophic backtracking)."""
+
+
+def _search_loop(conn):
+    """Child side of a _SearchWorker: answers (pattern, flags, text) searches until the pipe closes."""
+    compile_pattern = functools.lru_cache(maxsize=64)(re.compile)
+    conn.send(True)  # started: the parent's timeout only covers searches
+    while True:
+        try:
+            pattern, flags, text = conn.recv()
+        except EOFError:
+            return
+        conn.send(compile_pattern(pattern, flags).search(text) is not None)
+
+
+class _SearchWorker:
+    """
+    Long-lived child process running plain-`re` searches for one verifier
+    thread. Spawned, not forked, so it never inherits locks held by the
+    worker's other threads; killed and replaced when a search times out.
+    """
+
+    def __init__(self):
+        ctx = multiprocessing.get_context('spawn')
+        self._conn, child_conn = ctx.Pipe()
+        self._proc = ctx.Process(target=_search_loop, args=(child_conn,), name="verifier-re", daemon=True)
+        self._proc.start()
+        child_conn.close()
+        self._conn.recv()
+
+    @property
+    def alive(self):
+        return self._proc.is_alive()
+
+    def search(self, compiled, text, timeout):
+        try:
+            self._conn.send((compiled.pattern, compiled.flags, text))
+            if self._conn.poll(timeout):
+                return self._conn.recv()
+        except (EOFError, OSError):
+            # The child died; the next search gets a fresh one
+            self.close()
+            raise
+        self.close()
+        raise VerificationTimeout(compiled.pattern)
+
+    def close(self):
+        self._proc.kill()
+        self._proc.join()
+        self._conn.close()
+
+
+class Verifier:
+    """
+    Evaluates result verifiers off the request path.
+
+    Submissions are handed to a small thread pool, so submit returns as soon
+    as its commit lands. Compiled patterns are kept in an LRU cache, since
+    many jobs share a verifier. Every evaluation has a hard timeout: with
+    the `regex` package it is enforced by the matcher itself; without it,
+    plain `re` (which cannot be interrupted) searches in a long-lived child
+    process per pool thread, which is killed and respawned on expiry.
+    """
+
+    def __init__(self, workers=4, cache_size=256, timeout=1.0, max_input_bytes=1024 * 1024):
+        self.workers = workers
+        self.timeout = timeout
+        self.max_input_bytes = max_input_bytes
+        self._compile = functools.lru_cache(maxsize=cache_size)(self._compile_uncached)
+        self._app = None
+        self._executor = None
+        self._start_lock = threading.Lock()
+        self._local = threading.local()
+
+    def init_app(self, app):
+        self._app = app
+        self.workers = app.config.get('VERIFIER_WORKERS', self.workers)
+        self.timeout = app.config.get('VERIFIER_TIMEOUT', self.timeout)
+        self.max_input_bytes = app.config.get('VERIFIER_MAX_INPUT_BYTES', self.max_input_bytes)
+        self._compile = functools.lru_cache(maxsize=app.config.get('VERIFIER_CACHE_SIZE', 256))(self._compile_uncached)
+
+    def ensure_started(self):
+        if self._executor is not None:
+            return
+        with self._start_lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="verifier")
+
+    def submit(self, fn, *args):
+        """Runs fn(*args) on the pool inside an app context."""
+        self.ensure_started()
+        self._executor.submit(self._run, fn, *args)
+
+    def _run(self, fn, *args):
+        with self._app.app_context():
+            try:
+                fn(*args)
+            except Exception:
+                logger.exception("Verification task %s%r failed", fn.__name__, args)
+                db.session.rollback()
+            finally:
+                db.session.remove()
+
+    @staticmethod
+    def _compile_uncached(pattern):
+        return (regex or re).compile(pattern)
+
+    def check(self, pattern, text):
+        """
+        True if `pattern` matches somewhere in `text`. Raises
+        VerificationTimeout, ValueError for oversized input, or the regex
+        engine's error for an invalid pattern.
+        """
+        if len(text.encode('utf-8')) > self.max_input_bytes:
+            raise ValueError(f"result exceeds {self.max_input_bytes} bytes")
+        compiled = self._compile(pattern)
+        if regex is not None:
+            try:
+                return compiled.search(text, timeout=self.timeout) is not None
+            except TimeoutError:
+                raise VerificationTimeout(pattern)
+        return self._check_in_child(compiled, text)
+
+    def _check_in_child(self, compiled, text):
+        worker = getattr(self._local, 'worker', None)
+        if worker is None or not worker.alive:
+            worker = self._local.worker = _SearchWorker()
+        return worker.search(compiled, text, self.timeout)
+
+
+# Singleton instance
+verifier = Verifier()
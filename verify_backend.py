@@ -1,6 +1,12 @@
 import requests
 import time
 import json
+import os
+import sqlite3
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, HTTPServer
 
 RELAY_URL = "http://127.0.0.1:5005"
 
@@ -63,8 +69,278 @@ def test_flow():
     ranking_v2 = requests.get(f"{RELAY_URL}/ledger/ranking").json()
     print(f"[+] Top Agent Owner: {ranking_v2['agent_ranking'][0]['owner_id']}")
 
+def post_funded_job(price=10):
+    resp = requests.post(f"{RELAY_URL}/jobs", json={
+        "title": "Claim Race Probe",
+        "buyer_id": "proxy_human_01",
+        "terms": {"price": price},
+        "envelope_json": {"entry": "race.sh"}
+    })
+    task_id = resp.json()['task_id']
+    requests.post(f"{RELAY_URL}/jobs/{task_id}/fund", json={"escrow_tx_hash": "0xrace_dummy_tx_hash"})
+    return task_id
+
+def test_claim_race(threads=32):
+    print(f"[*] Hammering one funded task from {threads} threads...")
+    task_id = post_funded_job()
+
+    def claim(i):
+        return requests.post(f"{RELAY_URL}/jobs/{task_id}/claim", json={"agent_id": f"racer_{i:03d}"})
+
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        responses = list(pool.map(claim, range(threads)))
+
+    winners = [r for r in responses if r.status_code == 200]
+    losers = [r for r in responses if r.status_code == 403]
+    assert len(winners) == 1, f"expected exactly one winner, got {len(winners)}"
+    assert len(losers) == threads - 1, f"unexpected responses: {[r.status_code for r in responses]}"
+    owner = requests.get(f"{RELAY_URL}/jobs/{task_id}").json()['claimed_by']
+    assert winners[0].json()['message'].endswith(owner), "winner does not own the job"
+    print(f"[+] Single winner: {owner}")
+
+def test_claim_lease():
+    print("[*] Renewing a claim lease by heartbeat...")
+    task_id = post_funded_job()
+    claim = requests.post(f"{RELAY_URL}/jobs/{task_id}/claim", json={"agent_id": "lease_holder"}).json()
+    renewed = requests.post(f"{RELAY_URL}/jobs/{task_id}/heartbeat", json={"agent_id": "lease_holder"})
+    stranger = requests.post(f"{RELAY_URL}/jobs/{task_id}/heartbeat", json={"agent_id": "lease_stranger"})
+    assert renewed.status_code == 200, renewed.text
+    assert renewed.json()['lease_expires_at'] >= claim['lease_expires_at'], "lease did not move forward"
+    assert stranger.status_code == 409, f"non-holder heartbeat got {stranger.status_code}"
+    print(f"[+] Lease held until {renewed.json()['lease_expires_at']}")
+
+def test_multi_claim_race(jobs=40, threads=8, per_claim=10):
+    print(f"[*] Racing {threads} multi-claims of {per_claim} over {jobs} funded tasks...")
+    posted = {post_funded_job() for _ in range(jobs)}
+
+    def claim(i):
+        return requests.post(f"{RELAY_URL}/jobs/claim", json={"agent_id": f"bulk_{i:03d}", "limit": per_claim}).json()['claimed']
+
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        batches = list(pool.map(claim, range(threads)))
+
+    claimed = [task_id for batch in batches for task_id in batch if task_id in posted]
+    assert len(claimed) == len(set(claimed)), "a task was claimed by more than one agent"
+    print(f"[+] {len(claimed)} tasks claimed, no duplicates")
+
+def ledger_total(agent_id):
+    total, cursor = 0.0, None
+    while True:
+        params = {"limit": 200, **({"cursor": cursor} if cursor else {})}
+        resp = requests.get(f"{RELAY_URL}/ledger/{agent_id}/entries", params=params)
+        total += sum(e['amount'] for e in resp.json())
+        cursor = resp.headers.get('X-Next-Cursor')
+        if not cursor:
+            return total
+
+def test_next_job(jobs=30, threads=16):
+    entrypoint = f"probe.{int(time.time())}"
+    print(f"[*] Routing {jobs} '{entrypoint}' tasks to {threads} capable agents...")
+    for i in range(jobs):
+        task_id = requests.post(f"{RELAY_URL}/jobs", json={
+            "title": "Routing Probe", "buyer_id": "proxy_human_01", "terms": {"price": i + 1},
+            "envelope_json": {"payload": {"entrypoint": entrypoint}}
+        }).json()['task_id']
+        requests.post(f"{RELAY_URL}/jobs/{task_id}/fund", json={"escrow_tx_hash": "0xroute_dummy_tx_hash"})
+    for i in range(threads):
+        requests.put(f"{RELAY_URL}/agents/router_{i:02d}/capabilities", json={"entrypoints": [entrypoint]})
+    time.sleep(1)  # every worker's index follows the job feed
+
+    def take(i):
+        resp = requests.get(f"{RELAY_URL}/jobs/next", params={"agent_id": f"router_{i % threads:02d}"})
+        return resp.json() if resp.status_code == 200 else None
+
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        handed = [job for job in pool.map(take, range(jobs + threads)) if job]
+    task_ids = [job['task_id'] for job in handed]
+    assert len(task_ids) == len(set(task_ids)), "a job was handed out twice"
+    assert len(task_ids) == jobs, f"expected {jobs} jobs routed, got {len(task_ids)}"
+    assert all(job['entrypoint'] == entrypoint for job in handed), "job routed outside capabilities"
+    print(f"[+] {jobs} distinct jobs handed out, none twice")
+
+def test_concurrent_payouts(jobs=60, threads=16):
+    agent_id = f"payout_probe_{int(time.time())}"
+    print(f"[*] Settling {jobs} tasks for {agent_id} from {threads} threads...")
+    task_ids = []
+    for i in range(jobs):
+        task_id = post_funded_job(price=i + 1)
+        requests.post(f"{RELAY_URL}/jobs/{task_id}/claim", json={"agent_id": agent_id})
+        requests.post(f"{RELAY_URL}/jobs/{task_id}/submit", json={"agent_id": agent_id, "result": "ok"})
+        task_ids.append(task_id)
+
+    def confirm(task_id):
+        return requests.post(f"{RELAY_URL}/jobs/{task_id}/confirm", json={
+            "buyer_id": "proxy_human_01",
+            "signature": f"sig_{task_id}"
+        }).status_code
+
+    # Every task confirmed twice at once: exactly one of each pair may pay out
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        codes = list(pool.map(confirm, task_ids + task_ids))
+
+    expected = round(sum((i + 1) * 0.8 for i in range(jobs)), 6)
+    balance = round(requests.get(f"{RELAY_URL}/ledger/{agent_id}").json()['balance'], 6)
+    ledger = round(ledger_total(agent_id), 6)
+    assert codes.count(200) == jobs, f"expected {jobs} settlements, got {codes.count(200)}"
+    assert balance == expected, f"balance {balance} != expected {expected}"
+    assert ledger == expected, f"ledger total {ledger} != expected {expected}"
+    print(f"[+] Balance and ledger both exact: {balance}")
+    return agent_id
+
+def test_ledger_audit(agent_id, timeout=30):
+    # Audit passes run in the background: start the relay with a short
+    # LEDGER_AUDIT_INTERVAL (seconds) for this one to finish in time
+    print(f"[*] Waiting for the background audit of {agent_id}'s ledger chain...")
+    balance = round(requests.get(f"{RELAY_URL}/ledger/{agent_id}").json()['balance'], 6)
+    deadline = time.time() + timeout
+    while True:
+        audit = requests.get(f"{RELAY_URL}/ledger/audit", params={"agent_id": agent_id}).json()
+        state = audit['flagged'][0] if audit['flagged'] else None
+        if state and (state['status'] != 'ok' or round(state['ledger_sum'], 6) == balance) or time.time() > deadline:
+            break
+        time.sleep(0.5)
+    assert state, f"{agent_id} not audited within {timeout}s"
+    assert state['status'] == 'ok', f"audit reports {state['status']} (drift {state['drift']}, broken at {state['broken_entry_id']})"
+    assert round(state['ledger_sum'], 6) == balance, f"audited ledger sum {state['ledger_sum']} != balance {balance}"
+    again = requests.get(f"{RELAY_URL}/ledger/audit", params={"agent_id": agent_id, "full": "1"}).json()
+    assert again == audit, "reading the audit report changed it"
+    print(f"[+] Chain intact, {state['verified_entries']} entries verified, ledger sum {state['ledger_sum']}")
+
+class WebhookReceiver(BaseHTTPRequestHandler):
+    """Stand-in subscriber: records delivered events and fails its first call to exercise retries."""
+    events = []
+    calls = 0
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        type(self).calls += 1
+        if self.calls == 1:
+            self.send_response(500)
+        else:
+            type(self).events.extend(body['events'])
+            self.send_response(204)
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+def test_webhooks(timeout=30):
+    server = HTTPServer(("127.0.0.1", 0), WebhookReceiver)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    buyer_id = f"hook_buyer_{int(time.time())}"
+    print(f"[*] Delivering {buyer_id}'s job events to a local receiver on port {server.server_port}...")
+    endpoint = requests.post(f"{RELAY_URL}/webhooks", json={
+        "url": f"http://127.0.0.1:{server.server_port}/hook",
+        "subscriber_id": buyer_id
+    }).json()
+
+    task_id = requests.post(f"{RELAY_URL}/jobs", json={
+        "title": "Webhook Probe", "buyer_id": buyer_id, "terms": {"price": 5}, "envelope_json": {"entry": "hook.sh"}
+    }).json()['task_id']
+    requests.post(f"{RELAY_URL}/jobs/{task_id}/fund", json={"escrow_tx_hash": "0xhook_dummy_tx_hash"})
+    requests.post(f"{RELAY_URL}/jobs/{task_id}/claim", json={"agent_id": "hook_agent"})
+    requests.post(f"{RELAY_URL}/jobs/{task_id}/submit", json={"agent_id": "hook_agent", "result": "ok"})
+    requests.post(f"{RELAY_URL}/jobs/{task_id}/confirm", json={"buyer_id": buyer_id, "signature": "sig_hook"})
+
+    expected = ['job.posted', 'job.funded', 'job.claimed', 'job.submitted', 'job.completed']
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        # A retried batch can land after later ones; receivers order by event_id
+        received = [e['type'] for e in sorted(WebhookReceiver.events, key=lambda e: e['event_id'])
+                    if e['task_id'] == task_id]
+        if received == expected:
+            break
+        time.sleep(0.5)
+    server.shutdown()
+    assert received == expected, f"received {received} after {WebhookReceiver.calls} calls"
+    counts = requests.get(f"{RELAY_URL}/webhooks/{endpoint['id']}").json()['deliveries']
+    assert counts['pending'] == 0 and counts['dead'] == 0, f"undelivered: {counts}"
+    requests.delete(f"{RELAY_URL}/webhooks/{endpoint['id']}")
+    print(f"[+] All {len(expected)} events delivered after a failed first attempt ({WebhookReceiver.calls} calls)")
+
+def test_rate_limit(max_requests=4000, threads=16):
+    agent_id = f"flooder_{int(time.time())}"
+    print(f"[*] Flooding reads as {agent_id} until throttled...")
+    throttled = threading.Event()
+
+    def poll(_):
+        if throttled.is_set():
+            return None
+        resp = requests.get(f"{RELAY_URL}/ledger/{agent_id}")
+        if resp.status_code == 429:
+            throttled.set()
+        return resp
+
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        responses = [r for r in pool.map(poll, range(max_requests)) if r is not None]
+    limited = [r for r in responses if r.status_code == 429]
+    assert limited, f"no 429 after {len(responses)} reads"
+    assert int(limited[0].headers['Retry-After']) >= 1, "429 without a usable Retry-After"
+    other = requests.get(f"{RELAY_URL}/ledger/{agent_id}_neighbour")
+    assert other.status_code == 200, "throttling leaked to another agent"
+    print(f"[+] Throttled after {len(responses) - len(limited)} reads (Retry-After {limited[0].headers['Retry-After']}s)")
+
+def _copy_sqlite(source, target):
+    """Stands in for replication: makes `target` a snapshot of `source`."""
+    src, dst = sqlite3.connect(source), sqlite3.connect(target)
+    try:
+        src.backup(dst)
+    finally:
+        src.close()
+        dst.close()
+
+def test_replica_routing(window=1.0):
+    """
+    In-process, against its own relay app: one SQLite file as the primary
+    and two as replicas. Nothing replicates between them on its own, so
+    whether a read finds a job shows which database served it.
+    """
+    print("[*] Routing reads between a primary and two replicas (SQLite files)...")
+    tmp = tempfile.mkdtemp()
+    primary, *replicas = (os.path.join(tmp, f"{name}.db") for name in ("primary", "replica_0", "replica_1"))
+    os.environ.update(
+        DATABASE_URL=f"sqlite:///{primary}",
+        DATABASE_REPLICA_URLS=",".join(f"sqlite:///{path}" for path in replicas),
+        REPLICA_READ_YOUR_WRITES_SECONDS=str(window),
+        RATE_LIMIT_ENABLED="0",
+    )
+    import migrations
+    from server import create_app
+    app = create_app()
+    migrations.upgrade(app)
+    for replica in replicas:
+        _copy_sqlite(primary, replica)
+
+    def read(task_id, ip, client=None):
+        return (client or app.test_client()).get(f"/jobs/{task_id}", environ_base={"REMOTE_ADDR": ip}).status_code
+
+    writer = app.test_client()
+    task_id = writer.post("/jobs", json={
+        "title": "Replica Probe", "buyer_id": "replica_buyer", "terms": {"price": 1}, "envelope_json": {}
+    }, environ_base={"REMOTE_ADDR": "10.0.0.1"}).json['task_id']
+    assert read(task_id, "10.0.0.1", writer) == 200, "writer's cookie did not pin its read to the primary"
+    assert read(task_id, "10.0.0.1") == 200, "writer's IP did not read its write from the primary"
+    assert read(task_id, "10.0.0.2") == 404, "another caller's read did not go to a replica"
+    time.sleep(window + 0.2)
+    assert read(task_id, "10.0.0.1") == 404, "writer still reads the primary after the read-your-writes window"
+
+    # Only replica_0 catches up: each caller keeps seeing the same replica
+    _copy_sqlite(primary, replicas[0])
+    seen = {ip: {read(task_id, ip) for _ in range(3)} for ip in (f"10.0.1.{i}" for i in range(1, 17))}
+    assert all(len(codes) == 1 for codes in seen.values()), f"callers hopped between replicas: {seen}"
+    assert {code for codes in seen.values() for code in codes} == {200, 404}, "reads not spread over both replicas"
+    print(f"[+] Replica reads, read-your-writes for {window}s and per-caller stickiness all hold")
+
 if __name__ == "__main__":
     try:
         test_flow()
+        test_claim_race()
+        test_claim_lease()
+        test_multi_claim_race()
+        test_next_job()
+        test_ledger_audit(test_concurrent_payouts())
+        test_webhooks()
+        test_rate_limit()
+        test_replica_routing()
     except Exception as e:
         print(f"[!] Test failed: {e}")
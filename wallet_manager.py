@@ -1,33 +1,69 @@
 import os
 import base64
-from eth_account import Account
+import threading
 from cryptography.fernet import Fernet
 from cryptography.hazmat.primitives import hashes
 from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
 
-# Enable Mnemonic generation if needed
-Account.enable_unaudited_hdwallet_features()
-
 class WalletManager:
+    """
+    Managed-wallet key generation and encryption.
+
+    Construction is free: the Fernet key (100,000 PBKDF2 iterations) is
+    derived and `eth_account` is imported on first use, then memoized, so
+    importing this module costs nothing on worker boot.
+    """
+
     def __init__(self):
-        # We look for SYNAI_MASTER_KEY in environment variables
-        # If not found, we use a fallback (not recommended for production)
-        master_key_str = os.getenv('SYNAI_MASTER_KEY', 'default_synai_secret_key_change_me')
-        
-        # Derive a proper 32-byte key for Fernet
-        salt = b'synai_salt_v1' # Use a static salt for consistency across restarts
-        kdf = PBKDF2HMAC(
-            algorithm=hashes.SHA256(),
-            length=32,
-            salt=salt,
-            iterations=100000,
-        )
-        self.key = base64.urlsafe_b64encode(kdf.derive(master_key_str.encode()))
-        self.cipher_suite = Fernet(self.key)
+        self._lock = threading.Lock()
+        self._key = None
+        self._cipher_suite = None
+        self._account = None
+
+    @property
+    def key(self):
+        self._init_cipher()
+        return self._key
+
+    @property
+    def cipher_suite(self):
+        self._init_cipher()
+        return self._cipher_suite
+
+    def _init_cipher(self):
+        if self._cipher_suite is not None:
+            return
+        with self._lock:
+            if self._cipher_suite is not None:
+                return
+            # We look for SYNAI_MASTER_KEY in environment variables
+            # If not found, we use a fallback (not recommended for production)
+            master_key_str = os.getenv('SYNAI_MASTER_KEY', 'default_synai_secret_key_change_me')
+
+            # Derive a proper 32-byte key for Fernet
+            salt = b'synai_salt_v1' # Use a static salt for consistency across restarts
+            kdf = PBKDF2HMAC(
+                algorithm=hashes.SHA256(),
+                length=32,
+                salt=salt,
+                iterations=100000,
+            )
+            self._key = base64.urlsafe_b64encode(kdf.derive(master_key_str.encode()))
+            self._cipher_suite = Fernet(self._key)
+
+    def _get_account(self):
+        if self._account is None:
+            with self._lock:
+                if self._account is None:
+                    from eth_account import Account
+                    # Enable Mnemonic generation if needed
+                    Account.enable_unaudited_hdwallet_features()
+                    self._account = Account
+        return self._account
 
     def create_wallet(self):
         """Generates a new ETH wallet and returns (address, encrypted_privkey)."""
-        acct = Account.create()
+        acct = self._get_account().create()
         encrypted_key = self.cipher_suite.encrypt(acct.key.hex().encode()).decode()
         return acct.address, encrypted_key
 
@@ -36,7 +72,7 @@ class WalletManager:
         decrypted_key = self.cipher_suite.decrypt(encrypted_key.encode()).decode()
         return decrypted_key
 
-# Singleton instance
+# Singleton instance (lazy; see WalletManager)
 wallet_manager = WalletManager()
 
 if __name__ == "__main__":
@@ -0,0 +1,194 @@
+import logging
+import threading
+
+from sqlalchemy import literal, text
+
+from models import db, Agent, PooledWallet
+from wallet_manager import wallet_manager
+
+logger = logging.getLogger('relay')
+
+# pg_advisory_xact_lock key serializing pool top-ups across workers
+FILL_LOCK_KEY = 0x77616c6c  # 'wall'
+
+
+class WalletPool:
+    """
+    Reserve of pre-generated, pre-encrypted managed wallets.
+
+    Key generation and Fernet encryption happen on a background filler
+    thread, which tops the `wallet_pool` table back up to `target` whenever
+    it drops below `low_water`. Every worker runs a filler, but each
+    generated wallet is inserted only while the pool is below `target`
+    (checked by the INSERT itself, under an advisory lock on Postgres), so
+    concurrent fillers never overshoot it together.
+
+    Claims take a wallet with a single DELETE ... RETURNING in their own
+    transaction, so a rolled-back registration puts the wallet back. On an
+    empty pool the agent is registered without a wallet rather than
+    generating one inline (claims run on the group-commit writer, which
+    would stall every queued write); the filler hands it one after refilling.
+    """
+
+    def __init__(self, low_water=50, target=200, batch_size=20, check_interval=5.0):
+        self.low_water = low_water
+        self.target = target
+        self.batch_size = batch_size
+        self.check_interval = check_interval
+        self._app = None
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stats_lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.generated = 0
+        # Agents may be waiting for a wallet: set by a miss, and once on start
+        self._unassigned = True
+
+    def init_app(self, app):
+        self._app = app
+        self.low_water = app.config.get('WALLET_POOL_LOW_WATER', self.low_water)
+        self.target = app.config.get('WALLET_POOL_TARGET', self.target)
+
+    def ensure_started(self):
+        if self._thread is not None:
+            return
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="wallet-pool-filler", daemon=True)
+                self._thread.start()
+
+    def take(self):
+        """
+        Removes one pooled wallet in the open transaction and returns
+        (address, encrypted_privkey), or (None, None) if the pool is empty.
+        """
+        self.ensure_started()
+        for _ in range(3):
+            # SKIP LOCKED keeps concurrent claims on Postgres from queueing on the same row
+            wallet_id = db.session.query(PooledWallet.id) \
+                .order_by(PooledWallet.id.asc()) \
+                .limit(1) \
+                .with_for_update(skip_locked=True) \
+                .scalar()
+            if wallet_id is None:
+                break
+            row = db.session.execute(
+                db.delete(PooledWallet)
+                .where(PooledWallet.id == wallet_id)
+                .returning(PooledWallet.wallet_address, PooledWallet.encrypted_privkey)
+            ).first()
+            if row:
+                with self._stats_lock:
+                    self.hits += 1
+                return row.wallet_address, row.encrypted_privkey
+
+        with self._stats_lock:
+            self.misses += 1
+            self._unassigned = True
+        self._wakeup.set()
+        logger.warning("Wallet pool empty, registering agent without a wallet until the next refill")
+        return None, None
+
+    def metrics(self):
+        size = db.session.query(db.func.count(PooledWallet.id)).scalar()
+        with self._stats_lock:
+            return {
+                "size": size,
+                "low_water": self.low_water,
+                "target": self.target,
+                "hits": self.hits,
+                "misses": self.misses,
+                "generated": self.generated
+            }
+
+    def fill(self):
+        """
+        Tops the pool up to `target` if it is below `low_water`, then hands
+        wallets to agents registered while it was empty. Returns wallets added.
+        """
+        with self._app.app_context():
+            try:
+                added = self._top_up()
+                if self._unassigned:
+                    self._assign_missing()
+                return added
+            finally:
+                db.session.remove()
+
+    def _top_up(self):
+        size = db.session.query(db.func.count(PooledWallet.id)).scalar()
+        # End the read before generating: on SQLite a later write in the same
+        # transaction fails if another worker wrote in between
+        db.session.commit()
+        if size >= self.low_water:
+            return 0
+        added = 0
+        while size + added < self.target:
+            batch = min(self.batch_size, self.target - size - added)
+            wallets = [wallet_manager.create_wallet() for _ in range(batch)]
+            with self._stats_lock:
+                self.generated += batch
+            inserted = self._insert_below_target(wallets)
+            added += inserted
+            if inserted < batch:
+                break  # another worker's filler got there first
+        return added
+
+    def _insert_below_target(self, wallets):
+        """Inserts wallets one by one while the pool is below `target`, in one transaction. Returns rows inserted."""
+        if db.session.get_bind().dialect.name == 'postgresql':
+            db.session.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": FILL_LOCK_KEY})
+        size = db.select(db.func.count(PooledWallet.id)).scalar_subquery()
+        inserted = 0
+        for addr, enc_key in wallets:
+            # The first INSERT takes SQLite's write lock, so the count each one sees is current
+            if not db.session.execute(
+                db.insert(PooledWallet).from_select(
+                    ['wallet_address', 'encrypted_privkey'],
+                    db.select(literal(addr), literal(enc_key)).where(size < self.target)
+                )
+            ).rowcount:
+                break
+            inserted += 1
+        db.session.commit()
+        return inserted
+
+    def _assign_missing(self):
+        """Gives pooled wallets to agents registered without one, a batch per call."""
+        agent_ids = [agent_id for (agent_id,) in db.session.query(Agent.agent_id)
+                     .filter(Agent.wallet_address.is_(None)).limit(self.batch_size)]
+        db.session.commit()
+        with self._stats_lock:
+            self._unassigned = len(agent_ids) == self.batch_size
+        for agent_id in agent_ids:
+            addr, enc_key = self.take()
+            if addr is None:
+                db.session.rollback()
+                return  # take() flagged it again; retried after the next refill
+            assigned = db.session.execute(
+                db.update(Agent)
+                .where(Agent.agent_id == agent_id, Agent.wallet_address.is_(None))
+                .values(wallet_address=addr, encrypted_privkey=enc_key)
+                .execution_options(synchronize_session=False)
+            ).rowcount
+            if assigned:
+                db.session.commit()
+            else:
+                db.session.rollback()  # assigned by another worker: the wallet goes back
+
+    def _run(self):
+        while True:
+            try:
+                added = self.fill()
+                if added:
+                    logger.info("Wallet pool refilled with %d wallets", added)
+            except Exception:
+                logger.exception("Wallet pool refill failed")
+            self._wakeup.wait(self.check_interval)
+            self._wakeup.clear()
+
+
+# Singleton instance
+wallet_pool = WalletPool()
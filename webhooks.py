@@ -0,0 +1,270 @@
+import datetime
+import hashlib
+import hmac
+import json
+import logging
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from job_feed import EventTail, dump_gaps, load_gaps
+from models import db, WebhookEndpoint, WebhookDelivery, WebhookState
+
+logger = logging.getLogger('relay')
+
+
+class WebhookDispatcher:
+    """
+    Delivers job events to registered webhook URLs.
+
+    `job_events` is the outbox: every job transition appends its event in
+    the same commit as the transition itself, so an event exists if and only
+    if the change does. The dispatcher runs in every worker process and
+    works in two steps, both safe to run concurrently:
+
+    - Fan-out copies new events into `webhook_deliveries`, one row per
+      matching endpoint, and advances the shared `webhook_state` cursor with
+      a compare-and-set in the same transaction, so exactly one process
+      fans out each range. The cursor is an EventTail position: event ids
+      still uncommitted when fan-out moved past them are kept with it and
+      fanned out when they commit, so no event is skipped.
+    - Delivery leases due rows (compare-and-set on `locked_until`), groups
+      them per endpoint into batches of up to `batch_size` events, and POSTs
+      the batches with at most `concurrency` requests in flight. A 2xx marks
+      the batch delivered. Anything else reschedules it with exponential
+      backoff and jitter, and after `max_attempts` the deliveries are
+      dead-lettered ('dead') until redriven.
+
+    Delivery is at-least-once and a retried batch can arrive after later
+    ones, so receivers should dedupe and order by `event_id`. Bodies are
+    signed with the endpoint's secret (HMAC-SHA256 in X-Relay-Signature).
+    """
+
+    def __init__(self, poll_interval=1.0, batch_size=100, fanout_size=500, concurrency=8, max_attempts=8,
+                 backoff_base=2.0, backoff_cap=3600.0, request_timeout=5.0, lease_seconds=60, retention_days=7,
+                 gap_seconds=60.0):
+        self.poll_interval = poll_interval
+        self.batch_size = batch_size
+        self.fanout_size = fanout_size
+        self.concurrency = concurrency
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.request_timeout = request_timeout
+        self.lease_seconds = lease_seconds
+        self.retention_days = retention_days
+        self.gap_seconds = gap_seconds
+        self._app = None
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._session = requests.Session()
+
+    def init_app(self, app):
+        self._app = app
+        self.batch_size = app.config.get('WEBHOOK_BATCH_SIZE', self.batch_size)
+        self.concurrency = app.config.get('WEBHOOK_CONCURRENCY', self.concurrency)
+        self.max_attempts = app.config.get('WEBHOOK_MAX_ATTEMPTS', self.max_attempts)
+        self.backoff_base = app.config.get('WEBHOOK_BACKOFF_BASE', self.backoff_base)
+        self.request_timeout = app.config.get('WEBHOOK_TIMEOUT', self.request_timeout)
+        self.gap_seconds = app.config.get('JOB_EVENT_GAP_SECONDS', self.gap_seconds)
+        adapter = requests.adapters.HTTPAdapter(pool_maxsize=self.concurrency)
+        self._session.mount('http://', adapter)
+        self._session.mount('https://', adapter)
+
+    def ensure_started(self):
+        if self._thread is not None:
+            return
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="webhook-dispatcher", daemon=True)
+                self._thread.start()
+
+    def notify(self):
+        """Called after a commit that wrote job events, to skip the poll delay."""
+        self._wakeup.set()
+
+    # --- Fan-out ---
+
+    def fan_out(self):
+        """Copies the next batch of events into deliveries. Returns events consumed."""
+        state = db.session.query(WebhookState.last_event_id, WebhookState.gaps).filter_by(id=1).first()
+        cursor, gaps = (state.last_event_id, state.gaps) if state else (0, '{}')
+        tail = EventTail(cursor, load_gaps(gaps), self.gap_seconds)
+        events = tail.read(self.fanout_size)
+        new_gaps = dump_gaps(tail.gaps)
+        if not events and new_gaps == gaps:
+            return 0
+
+        subscribers = {e.buyer_id for e in events} | {e.claimed_by for e in events if e.claimed_by}
+        endpoints = WebhookEndpoint.query.filter(
+            WebhookEndpoint.active.is_(True), WebhookEndpoint.subscriber_id.in_(subscribers)
+        ).all()
+        by_subscriber = {}
+        for endpoint in endpoints:
+            by_subscriber.setdefault(endpoint.subscriber_id, []).append(endpoint)
+
+        now = datetime.datetime.utcnow()
+        rows = []
+        for event in events:
+            payload = dict(event.to_dict(), type=f"job.{event.status}",
+                           created_at=event.created_at.isoformat() if event.created_at else None)
+            targets = {}
+            for subscriber in (event.buyer_id, event.claimed_by):
+                for endpoint in by_subscriber.get(subscriber, ()):
+                    targets[endpoint.id] = endpoint
+            for endpoint in targets.values():
+                if endpoint.statuses and event.status not in endpoint.statuses.split(','):
+                    continue
+                rows.append(dict(endpoint_id=endpoint.id, event_id=event.event_id, payload=payload,
+                                 status='pending', attempts=0, next_attempt_at=now))
+
+        advanced = db.session.execute(
+            db.update(WebhookState)
+            .where(WebhookState.id == 1, WebhookState.last_event_id == cursor, WebhookState.gaps == gaps)
+            .values(last_event_id=tail.head, gaps=new_gaps)
+            .execution_options(synchronize_session=False)
+        ).rowcount
+        if not advanced:
+            # Another process fanned this range out first
+            db.session.rollback()
+            return 0
+        if rows:
+            db.session.execute(db.insert(WebhookDelivery), rows)
+        db.session.commit()
+        return len(events)
+
+    # --- Delivery ---
+
+    def _lease_due(self):
+        now = datetime.datetime.utcnow()
+        due = db.select(WebhookDelivery.id).where(
+            WebhookDelivery.status == 'pending',
+            WebhookDelivery.next_attempt_at <= now,
+            db.or_(WebhookDelivery.locked_until.is_(None), WebhookDelivery.locked_until < now)
+        ).order_by(WebhookDelivery.next_attempt_at.asc()).limit(self.batch_size * self.concurrency)
+        leased = db.session.execute(
+            db.update(WebhookDelivery)
+            .where(WebhookDelivery.id.in_(due),
+                   db.or_(WebhookDelivery.locked_until.is_(None), WebhookDelivery.locked_until < now))
+            .values(locked_until=now + datetime.timedelta(seconds=self.lease_seconds))
+            .returning(WebhookDelivery.id, WebhookDelivery.endpoint_id, WebhookDelivery.event_id,
+                       WebhookDelivery.payload, WebhookDelivery.attempts)
+            .execution_options(synchronize_session=False)
+        ).all()
+        db.session.commit()
+        return leased
+
+    def deliver_due(self):
+        """Leases due deliveries and sends them, batched per endpoint. Returns deliveries attempted."""
+        leased = self._lease_due()
+        if not leased:
+            return 0
+        endpoints = {e.id: e for e in WebhookEndpoint.query.filter(
+            WebhookEndpoint.id.in_({row.endpoint_id for row in leased}))}
+
+        batches = []
+        per_endpoint = {}
+        for row in sorted(leased, key=lambda r: r.event_id):
+            per_endpoint.setdefault(row.endpoint_id, []).append(row)
+        for endpoint_id, rows in per_endpoint.items():
+            for i in range(0, len(rows), self.batch_size):
+                batches.append((endpoints[endpoint_id], rows[i:i + self.batch_size]))
+
+        with ThreadPoolExecutor(max_workers=self.concurrency) as pool:
+            outcomes = list(pool.map(lambda b: self._post(*b), batches))
+
+        now = datetime.datetime.utcnow()
+        for (endpoint, rows), error in zip(batches, outcomes):
+            ids = [row.id for row in rows]
+            if error is None:
+                db.session.execute(
+                    db.update(WebhookDelivery).where(WebhookDelivery.id.in_(ids))
+                    .values(status='delivered', delivered_at=now, attempts=WebhookDelivery.attempts + 1,
+                            locked_until=None, last_error=None)
+                    .execution_options(synchronize_session=False)
+                )
+                continue
+            # Rows of one batch were sent together, so they share an attempt count
+            attempts = max(row.attempts for row in rows) + 1
+            dead = attempts >= self.max_attempts
+            delay = min(self.backoff_cap, self.backoff_base * 2 ** (attempts - 1)) * random.uniform(0.5, 1.0)
+            db.session.execute(
+                db.update(WebhookDelivery).where(WebhookDelivery.id.in_(ids))
+                .values(status='dead' if dead else 'pending', attempts=attempts, last_error=error[:500],
+                        next_attempt_at=now + datetime.timedelta(seconds=delay), locked_until=None)
+                .execution_options(synchronize_session=False)
+            )
+            if dead:
+                logger.warning("Webhook endpoint %s: %d deliveries dead-lettered (%s)", endpoint.id, len(ids), error)
+        db.session.commit()
+        return len(leased)
+
+    def _post(self, endpoint, rows):
+        """Sends one batch. Returns None on success, else an error description."""
+        body = json.dumps({"events": [row.payload for row in rows]}, separators=(',', ':')).encode('utf-8')
+        signature = hmac.new(endpoint.secret.encode('utf-8'), body, hashlib.sha256).hexdigest()
+        try:
+            resp = self._session.post(endpoint.url, data=body, timeout=self.request_timeout, headers={
+                'Content-Type': 'application/json',
+                'X-Relay-Signature': f"sha256={signature}",
+                'X-Relay-Endpoint': str(endpoint.id),
+            })
+        except requests.RequestException as e:
+            return f"{type(e).__name__}: {e}"
+        if 200 <= resp.status_code < 300:
+            return None
+        return f"HTTP {resp.status_code}: {resp.text[:200]}"
+
+    def purge_delivered(self):
+        cutoff = datetime.datetime.utcnow() - datetime.timedelta(days=self.retention_days)
+        deleted = WebhookDelivery.query.filter(
+            WebhookDelivery.status == 'delivered', WebhookDelivery.delivered_at < cutoff
+        ).delete(synchronize_session=False)
+        db.session.commit()
+        return deleted
+
+    # --- Endpoint management ---
+
+    @staticmethod
+    def counts(endpoint_id):
+        rows = db.session.query(WebhookDelivery.status, db.func.count(WebhookDelivery.id)) \
+            .filter(WebhookDelivery.endpoint_id == endpoint_id) \
+            .group_by(WebhookDelivery.status).all()
+        counts = {"pending": 0, "delivered": 0, "dead": 0}
+        counts.update({status: count for status, count in rows})
+        return counts
+
+    @staticmethod
+    def redrive(endpoint_id):
+        """Moves an endpoint's dead-lettered deliveries back to pending. Returns how many."""
+        return WebhookDelivery.query.filter_by(endpoint_id=endpoint_id, status='dead').update({
+            "status": 'pending', "attempts": 0, "next_attempt_at": datetime.datetime.utcnow(), "last_error": None
+        }, synchronize_session=False)
+
+    def _run(self):
+        last_purge = 0.0
+        while True:
+            try:
+                with self._app.app_context():
+                    try:
+                        while self.fan_out() == self.fanout_size:
+                            pass
+                        while self.deliver_due():
+                            pass
+                        if time.monotonic() - last_purge > 3600:
+                            self.purge_delivered()
+                            last_purge = time.monotonic()
+                    finally:
+                        db.session.remove()
+            except Exception:
+                logger.exception("Webhook dispatch failed")
+            self._wakeup.wait(self.poll_interval)
+            self._wakeup.clear()
+
+
+# Singleton instance
+webhook_dispatcher = WebhookDispatcher()